@@ -6,9 +6,12 @@ http://mail.python.org/pipermail/python-dev/2008-January/076194.html
 
 from __future__ import absolute_import, unicode_literals
 
+import inspect
+
 
 __all__ = (
     'get_model', 'get_models', 'monkeypatch_method', 'monkeypatch_property',
+    'call_last_modified',
 )
 
 
@@ -49,3 +52,29 @@ def monkeypatch_property(cls):
         setattr(cls, func.__name__, property(func))
         return func
     return decorator
+
+
+_accepts_request = {}
+
+
+def call_last_modified(obj, request):
+    """
+    Returns ``obj.last_modified(request)``, or ``obj.last_modified()`` if
+    the method does not accept the request (implementations written before
+    the request has been passed).
+    """
+    method = obj.last_modified
+    func = getattr(method, '__func__', method)
+    accepts = _accepts_request.get(func)
+    if accepts is None:
+        try:
+            spec = inspect.getfullargspec(func)
+        except AttributeError:  # Python 2
+            spec = inspect.getargspec(func)
+        bound = 1 if hasattr(method, '__func__') else 0
+        accepts = _accepts_request[func] = bool(
+            spec.varargs or len(spec.args) > bound)
+
+    if accepts:
+        return method(request)
+    return method()
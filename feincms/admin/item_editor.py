@@ -9,13 +9,16 @@ import logging
 import warnings
 
 from django import forms
+from django.contrib.admin import helpers
 from django.contrib.admin.options import InlineModelAdmin
 try:
     from django.contrib.admin.utils import unquote
 except ImportError:  # Django 1.6
     from django.contrib.admin.util import unquote
 from django.contrib.auth import get_permission_codename
+from django.core.urlresolvers import reverse
 from django.http import Http404
+from django.template.response import TemplateResponse
 
 from feincms import settings, ensure_completely_loaded
 from feincms.extensions import ExtensionModelAdmin
@@ -51,6 +54,16 @@ class FeinCMSInline(InlineModelAdmin):
     fk_name = 'parent'
     template = 'admin/feincms/content_inline.html'
 
+    def get_queryset(self, request):
+        qs = super(FeinCMSInline, self).get_queryset(request)
+
+        # ``ItemEditor.change_view`` determines the content types in use with
+        # a single query. Do not hit the database for all others.
+        in_use = getattr(request, '_feincms_content_types_in_use', None)
+        if in_use is not None and self.model not in in_use:
+            return qs.none()
+        return qs
+
 
 # ------------------------------------------------------------------------
 class ItemEditor(ExtensionModelAdmin):
@@ -133,6 +146,21 @@ class ItemEditor(ExtensionModelAdmin):
                     (content_name, content_type.__name__.lower()))
         return content_types
 
+    def get_content_types_in_use(self, obj):
+        """
+        Return the set of content types which have at least one content block
+        belonging to ``obj``, determined using a single query.
+        """
+        if not obj._feincms_content_types:
+            # Without content types, the query would be empty
+            return set()
+
+        counts = obj.content._fetch_content_type_count_helper(obj.pk)
+        return set(
+            obj._feincms_content_types[ct_idx]
+            for region in counts.values()
+            for pk, ct_idx in region)
+
     def get_extra_context(self, request):
         """ Return extra context parameters for add/change views. """
 
@@ -144,6 +172,13 @@ class ItemEditor(ExtensionModelAdmin):
             'content_types': self.get_content_type_map(request),
             'FEINCMS_JQUERY_NO_CONFLICT': settings.FEINCMS_JQUERY_NO_CONFLICT,
             'FEINCMS_CONTENT_FIELDSET_NAME': FEINCMS_CONTENT_FIELDSET_NAME,
+            'FEINCMS_ITEM_EDITOR_LAZY_INLINES': (
+                settings.FEINCMS_ITEM_EDITOR_LAZY_INLINES),
+            'content_type_form_url': reverse(
+                '%s:%s_%s_content_type_form' % (
+                    self.admin_site.name,
+                    self.model._meta.app_label,
+                    self.model._meta.model_name)),
         }
 
         for processor in self.model.feincms_item_editor_context_processors:
@@ -151,6 +186,58 @@ class ItemEditor(ExtensionModelAdmin):
 
         return extra_context
 
+    def get_urls(self):
+        from django.conf.urls import url
+
+        urls = super(ItemEditor, self).get_urls()
+        my_urls = [
+            url(
+                r'^content-type-form/$',
+                self.admin_site.admin_view(self.content_type_form_view),
+                name='%s_%s_content_type_form' % (
+                    self.model._meta.app_label,
+                    self.model._meta.model_name),
+            ),
+        ]
+
+        return my_urls + urls
+
+    def content_type_form_view(self, request):
+        """
+        Render the inline of a single content type, identified by the formset
+        prefix passed as ``?prefix=``. Used by the item editor to fetch the
+        empty form of content types which have not been rendered upfront
+        (see ``FEINCMS_ITEM_EDITOR_LAZY_INLINES``).
+        """
+        if not self.has_change_permission(request):
+            logger.warning(
+                "Denied fetching content type form of %s to \"%s\""
+                " (no edit permission)",
+                self.model,
+                request.user
+            )
+            raise Http404
+
+        prefix = request.GET.get('prefix')
+        for inline in self.get_inline_instances(request):
+            FormSet = inline.get_formset(request)
+            if FormSet.get_default_prefix() == prefix:
+                break
+        else:
+            raise Http404
+
+        formset = FormSet(instance=self.model(), prefix=prefix)
+        inline_admin_formset = helpers.InlineAdminFormSet(
+            inline, formset,
+            list(inline.get_fieldsets(request)),
+            inline.get_prepopulated_fields(request),
+            list(inline.get_readonly_fields(request)),
+            model_admin=self)
+
+        return TemplateResponse(request, inline.template, {
+            'inline_admin_formset': inline_admin_formset,
+        })
+
     def add_view(self, request, **kwargs):
         if not self.has_add_permission(request):
             logger.warning(
@@ -199,6 +286,10 @@ class ItemEditor(ExtensionModelAdmin):
             )
             raise Http404
 
+        if obj is not None and hasattr(obj, '_feincms_content_types'):
+            request._feincms_content_types_in_use = (
+                self.get_content_types_in_use(obj))
+
         context = {}
         context.update(self.get_extra_context(request))
         context.update(kwargs.get('extra_context', {}))
@@ -26,6 +26,7 @@ from mptt.forms import MPTTAdminForm
 
 from feincms import settings
 from feincms.extensions import ExtensionModelAdmin
+from feincms.utils.tree import delete_subtrees
 
 
 logger = logging.getLogger(__name__)
@@ -515,32 +516,33 @@ class TreeEditor(ExtensionModelAdmin):
 
     def delete_selected_tree(self, modeladmin, request, queryset):
         """
-        Deletes multiple instances and makes sure the MPTT fields get
-        recalculated properly. (Because merely doing a bulk delete doesn't
-        trigger the post_delete hooks.)
+        Deletes multiple instances including their subtrees and makes sure
+        the MPTT fields get recalculated properly. Content blocks and nodes
+        are removed in bulk using ``feincms.utils.tree.delete_subtrees``
+        instead of deleting every node separately.
         """
         # If this is True, the confirmation page has been displayed
         if request.POST.get('post'):
-            n = 0
-            # TODO: The disable_mptt_updates / rebuild is a work around
-            # for what seems to be a mptt problem when deleting items
-            # in a loop. Revisit this, there should be a better solution.
-            with queryset.model.objects.disable_mptt_updates():
-                for obj in queryset:
-                    if self.has_delete_permission(request, obj):
-                        obj.delete()
-                        n += 1
-                        obj_display = force_text(obj)
-                        self.log_deletion(request, obj, obj_display)
-                    else:
-                        logger.warning(
-                            "Denied delete request by \"%s\" for object #%s",
-                            request.user, obj.id)
-            if n > 0:
-                queryset.model.objects.rebuild()
+            allowed = []
+            for obj in queryset:
+                if self.has_delete_permission(request, obj):
+                    allowed.append(obj)
+                else:
+                    logger.warning(
+                        "Denied delete request by \"%s\" for object #%s",
+                        request.user, obj.id)
+
+            if allowed:
+                delete_subtrees(queryset.model._default_manager.filter(
+                    pk__in=[obj.pk for obj in allowed]))
+
+                for obj in allowed:
+                    self.log_deletion(request, obj, force_text(obj))
+
             self.message_user(
                 request,
-                _("Successfully deleted %(count)d items.") % {"count": n})
+                _("Successfully deleted %(count)d items.") % {
+                    "count": len(allowed)})
             # Return None to display the change list page again
             return None
         else:
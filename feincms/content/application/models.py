@@ -5,12 +5,15 @@ Third-party application inclusion support.
 from __future__ import absolute_import, unicode_literals
 
 from email.utils import parsedate
-from time import mktime
+from time import mktime, time
 from random import SystemRandom
 import re
+import threading
+import warnings
 
 from django.conf import settings
 from django.core.cache import cache
+from django.core.signals import request_finished, request_started
 from django.core.urlresolvers import (
     Resolver404, resolve, reverse, NoReverseMatch,
     get_script_prefix, set_script_prefix,
@@ -26,13 +29,63 @@ from django.utils.translation import get_language, ugettext_lazy as _
 
 from feincms.admin.item_editor import ItemEditorForm
 from feincms.contrib.fields import JSONField
+from feincms.signals import subtrees_post_delete
 from feincms.translations import short_language_code
-from feincms.utils import get_object
+from feincms.utils import LRUCache, get_object
 
 
 APP_REVERSE_CACHE_GENERATION_KEY = 'FEINCMS:APPREVERSECACHE'
 APP_REVERSE_CACHE_TIMEOUT = 300
 
+#: Maximum count of memoized ``resolve`` and ``reverse`` results per process
+APP_RESOLVER_CACHE_SIZE = 1000
+
+_app_resolve_cache = LRUCache(APP_RESOLVER_CACHE_SIZE)
+_app_reverse_cache = LRUCache(APP_RESOLVER_CACHE_SIZE)
+
+# Per-process copy of the mount tables in the shared cache. Keys contain the
+# cache generation, therefore tables of earlier generations are never hit.
+# Tables expire after APP_REVERSE_CACHE_TIMEOUT seconds too, because pages
+# may become (in)active without being saved (f.e. the datepublisher
+# extension).
+_app_mount_tables = LRUCache(100)
+
+#: Page fields influencing the results of ``app_reverse``. The cache is only
+#: invalidated if one of these fields changes on a page which hosts an
+#: application content (or is an ancestor of such a page).
+APP_REVERSE_PAGE_FIELDS = (
+    '_cached_url', 'active', 'language', 'site_id',
+    'publication_date', 'publication_end_date')
+
+# The cache generation is fetched at most once per request and thread.
+_local = threading.local()
+
+
+def _request_started(sender, **kwargs):
+    _local.in_request = True
+    _local.generation = None
+
+
+def _request_finished(sender, **kwargs):
+    _local.in_request = False
+    _local.generation = None
+
+
+request_started.connect(_request_started)
+request_finished.connect(_request_finished)
+
+
+def _app_reverse_generation():
+    generation = getattr(_local, 'generation', None)
+    if generation is None:
+        generation = cache.get(APP_REVERSE_CACHE_GENERATION_KEY)
+        if generation is None:
+            # This might never happen. Still, better be safe than sorry.
+            generation = cycle_app_reverse_cache()
+        elif getattr(_local, 'in_request', False):
+            _local.generation = generation
+    return generation
+
 
 class UnpackTemplateResponse(TemplateResponse):
     """
@@ -48,6 +101,8 @@ def cycle_app_reverse_cache(*args, **kwargs):
     values for all newly generated keys"""
     value = '%07x' % (SystemRandom().randint(0, 0x10000000))
     cache.set(APP_REVERSE_CACHE_GENERATION_KEY, value)
+    if getattr(_local, 'in_request', False):
+        _local.generation = value
     return value
 
 
@@ -56,6 +111,32 @@ def cycle_app_reverse_cache(*args, **kwargs):
 cycle_app_reverse_cache()
 
 
+def app_resolve(path, urlconf_path):
+    """
+    Memoizing version of Django's ``resolve``. Django already builds only one
+    resolver per URLconf and process, but still has to run through all URL
+    patterns every time. Results are remembered per URLconf, language and path
+    (failed lookups are not).
+    """
+    key = (urlconf_path, get_language(), path)
+    match = _app_resolve_cache.get(key)
+    if match is None:
+        match = resolve(path, urlconf_path)
+        match = (match.func, match.args, match.kwargs)
+        _app_resolve_cache.set(key, match)
+
+    fn, args, kwargs = match
+    return fn, args, dict(kwargs)
+
+
+def _typed_key(args, kwargs):
+    # True == 1 == 1.0, but they may reverse to different URLs
+    return (
+        tuple((type(value), value) for value in args),
+        frozenset(
+            (name, type(value), value) for name, value in kwargs.items()))
+
+
 def app_reverse(viewname, urlconf=None, args=None, kwargs=None,
                 *vargs, **vkwargs):
     """
@@ -83,31 +164,27 @@ def app_reverse(viewname, urlconf=None, args=None, kwargs=None,
     urlconf = appconfig.get('urlconf_path', urlconf)
 
     appcontent_class = ApplicationContent._feincms_content_models[0]
-    cache_key = appcontent_class.app_reverse_cache_key(urlconf)
-    url_prefix = cache.get(cache_key)
-
-    if url_prefix is None:
-        content = appcontent_class.closest_match(urlconf)
-
-        if content is not None:
-            if urlconf in appcontent_class.ALL_APPS_CONFIG:
-                # We have an overridden URLconf
-                app_config = appcontent_class.ALL_APPS_CONFIG[urlconf]
-                urlconf = app_config['config'].get('urls', urlconf)
-
-            prefix = content.parent.get_absolute_url()
-            prefix += '/' if prefix[-1] != '/' else ''
-
-            url_prefix = (urlconf, prefix)
-            cache.set(cache_key, url_prefix, timeout=APP_REVERSE_CACHE_TIMEOUT)
+    url_prefix = appcontent_class.app_mount(urlconf)
 
     if url_prefix:
         # vargs and vkwargs are used to send through additional parameters
         # which are uninteresting to us (such as current_app)
+        try:
+            key = (
+                url_prefix, get_language(), viewname,
+                _typed_key(args or (), kwargs or {}),
+                _typed_key(vargs, vkwargs))
+            url = _app_reverse_cache.get(key)
+        except TypeError:  # unhashable arguments, do not memoize
+            key, url = None, None
+
+        if url is not None:
+            return url
+
         prefix = get_script_prefix()
         try:
             set_script_prefix(url_prefix[1])
-            return reverse(
+            url = reverse(
                 viewname,
                 url_prefix[0],
                 args=args,
@@ -116,6 +193,10 @@ def app_reverse(viewname, urlconf=None, args=None, kwargs=None,
         finally:
             set_script_prefix(prefix)
 
+        if key is not None:
+            _app_reverse_cache.set(key, url)
+        return url
+
     raise NoReverseMatch("Unable to find ApplicationContent for %r" % urlconf)
 
 
@@ -250,18 +331,69 @@ class ApplicationContent(models.Model):
         cls.feincms_item_editor_form = ApplicationContentItemEditorForm
 
         # Clobber the app_reverse cache when saving application contents
-        # and/or pages
+        # and when pages hosting application contents change in a way which
+        # is relevant to app_reverse. Deleting pages deletes their
+        # application contents too, which already clobbers the cache.
         page_class = cls.parent.field.rel.to
         signals.post_save.connect(cycle_app_reverse_cache, sender=cls)
         signals.post_delete.connect(cycle_app_reverse_cache, sender=cls)
-        signals.post_save.connect(cycle_app_reverse_cache, sender=page_class)
-        signals.post_delete.connect(cycle_app_reverse_cache, sender=page_class)
+        signals.pre_save.connect(cls._page_pre_save, sender=page_class)
+        signals.post_save.connect(cls._page_post_save, sender=page_class)
+        subtrees_post_delete.connect(
+            cycle_app_reverse_cache, sender=page_class)
+
+    @classmethod
+    def _page_pre_save(cls, sender, instance, **kwargs):
+        instance._app_reverse_state = None
+        if instance.pk is None:
+            # New pages cannot host any application contents yet
+            return
+
+        opts = instance._mptt_meta
+        hosts_applications = cls.objects.filter(**{
+            'parent__%s' % opts.tree_id_attr: getattr(
+                instance, opts.tree_id_attr),
+            'parent__%s__gte' % opts.left_attr: getattr(
+                instance, opts.left_attr),
+            'parent__%s__lte' % opts.right_attr: getattr(
+                instance, opts.right_attr),
+        }).exists()
+        if not hosts_applications:
+            return
+
+        fields = [
+            f for f in APP_REVERSE_PAGE_FIELDS
+            if f in [field.attname for field in sender._meta.fields]]
+        instance._app_reverse_state = (
+            fields,
+            list(sender._base_manager.filter(
+                pk=instance.pk).values_list(*fields)[:1]))
+
+    @classmethod
+    def _page_post_save(cls, sender, instance, **kwargs):
+        state = getattr(instance, '_app_reverse_state', None)
+        if state is None:
+            return
+
+        fields, old_values = state
+        new_values = tuple(getattr(instance, f) for f in fields)
+        if not old_values or tuple(old_values[0]) != new_values:
+            cycle_app_reverse_cache()
 
     def __init__(self, *args, **kwargs):
         super(ApplicationContent, self).__init__(*args, **kwargs)
         self.app_config = self.ALL_APPS_CONFIG.get(
             self.urlconf_path, {}).get('config', {})
 
+    @property
+    def feincms_process_concurrently(self):
+        """
+        Applications are only processed concurrently with other content
+        blocks if their configuration contains ``'process_concurrently':
+        True`` (see ``FEINCMS_PROCESS_CONCURRENCY``).
+        """
+        return self.app_config.get('process_concurrently', False)
+
     def process(self, request, **kw):
         page_url = self.parent.get_absolute_url()
 
@@ -281,7 +413,7 @@ class ApplicationContent(models.Model):
         urlconf_path = self.app_config.get('urls', self.urlconf_path)
 
         try:
-            fn, args, kwargs = resolve(path, urlconf_path)
+            fn, args, kwargs = app_resolve(path, urlconf_path)
         except (ValueError, Resolver404):
             raise Resolver404(str('Not found (resolving %r in %r failed)') % (
                 path, urlconf_path))
@@ -378,9 +510,13 @@ class ApplicationContent(models.Model):
         # Ideally, for the Cache-Control header, we'd want to do some
         # intelligent combining, but that's hard. Let's just collect and unique
         # them and let the client worry about that.
-        cc_headers = set(('must-revalidate',))
+        # Directives are kept in the order of their first appearance so that
+        # the header does not depend on set ordering.
+        cc_headers = ['must-revalidate']
         for x in (cc.split(",") for cc in headers.get('Cache-Control', ())):
-            cc_headers |= set((s.strip() for s in x))
+            for directive in (s.strip() for s in x):
+                if directive not in cc_headers:
+                    cc_headers.append(directive)
 
         if len(cc_headers):
             response['Cache-Control'] = ", ".join(cc_headers)
@@ -399,19 +535,111 @@ class ApplicationContent(models.Model):
 
     @classmethod
     def app_reverse_cache_key(self, urlconf_path, **kwargs):
-        cache_generation = cache.get(APP_REVERSE_CACHE_GENERATION_KEY)
-        if cache_generation is None:
-            # This might never happen. Still, better be safe than sorry.
-            cache_generation = cycle_app_reverse_cache()
-
+        warnings.warn(
+            'app_reverse_cache_key is unused, app_reverse caches the'
+            ' app_mount_table instead.',
+            DeprecationWarning, stacklevel=2)
         return 'FEINCMS:%s:APPCONTENT:L%s:U%s:G%s' % (
             getattr(settings, 'SITE_ID', 0),
             get_language(),
             urlconf_path,
-            cache_generation)
+            _app_reverse_generation())
+
+    @classmethod
+    def app_mount_table_cache_key(cls):
+        return 'FEINCMS:%s:APPCONTENT:MOUNTS:G%s' % (
+            getattr(settings, 'SITE_ID', 0),
+            _app_reverse_generation())
+
+    @classmethod
+    def app_mount_table(cls):
+        """
+        Returns a dictionary mapping URLconf paths to lists of
+        ``(language, (urlconf, prefix))`` tuples, one for every active page
+        hosting an application content, in the order of ``closest_match``.
+
+        The table is built with a single query after every change to pages
+        and application contents and kept in the shared cache and in
+        process memory.
+        """
+        cache_key = cls.app_mount_table_cache_key()
+        table, expires = _app_mount_tables.get(cache_key, (None, 0))
+
+        if table is None or expires < time():
+            table = cache.get(cache_key)
+            if table is None:
+                table = cls._build_app_mount_table()
+                cache.set(cache_key, table, timeout=APP_REVERSE_CACHE_TIMEOUT)
+            _app_mount_tables.set(
+                cache_key, (table, time() + APP_REVERSE_CACHE_TIMEOUT))
+
+        return table
+
+    @classmethod
+    def _build_app_mount_table(cls):
+        page_class = cls.parent.field.rel.to
+
+        contents = cls.objects.filter(
+            parent__in=page_class.objects.active(),
+        ).order_by('pk').select_related('parent')
+
+        table = {}
+        for content in contents:
+            language = getattr(content.parent, 'language', None)
+            table.setdefault(content.urlconf_path, []).append((
+                language and short_language_code(language),
+                cls._content_mount(content),
+            ))
+
+        return table
+
+    @classmethod
+    def _content_mount(cls, content):
+        # Returns the ``(urlconf, prefix)`` tuple of an application content
+        urlconf = content.urlconf_path
+        if urlconf in cls.ALL_APPS_CONFIG:
+            # We have an overridden URLconf
+            app_config = cls.ALL_APPS_CONFIG[urlconf]
+            urlconf = app_config['config'].get('urls', urlconf)
+
+        prefix = content.parent.get_absolute_url()
+        prefix += '/' if prefix[-1] != '/' else ''
+        return urlconf, prefix
+
+    @classmethod
+    def app_mount(cls, urlconf_path):
+        """
+        Returns the ``(urlconf, prefix)`` tuple used by ``app_reverse`` for
+        the given URLconf path and the current language, or ``None``. Uses
+        the same rules as ``closest_match`` without hitting the database.
+
+        Subclasses overriding ``closest_match`` are asked directly instead,
+        which costs one query per call.
+        """
+        closest_match = getattr(cls.closest_match, '__func__', None)
+        if closest_match is not ApplicationContent.closest_match.__func__:
+            content = cls.closest_match(urlconf_path)
+            return content and cls._content_mount(content)
+
+        mounts = cls.app_mount_table().get(urlconf_path)
+        if not mounts:
+            return None
+
+        current = get_language()
+        current = current and short_language_code(current)
+        for language, mount in mounts:
+            if language == current:
+                return mount
+        return mounts[0][1]
 
     @classmethod
     def closest_match(cls, urlconf_path):
+        """
+        Returns the application content ``app_reverse`` should use for the
+        given URLconf path, preferring contents on pages in the current
+        language. The default rules are applied by ``app_mount`` using the
+        precomputed mount table; override this method to use other rules.
+        """
         page_class = cls.parent.field.rel.to
 
         contents = cls.objects.filter(
@@ -8,10 +8,10 @@ from __future__ import absolute_import, unicode_literals
 import os
 
 from django.db import models
-from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 
 from feincms import settings
+from feincms.utils.templates import render_to_string
 
 
 class FileContent(models.Model):
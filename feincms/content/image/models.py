@@ -8,11 +8,11 @@ from __future__ import absolute_import, unicode_literals
 import os
 
 from django.db import models
-from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 
 from feincms import settings
 from feincms.templatetags import feincms_thumbnail
+from feincms.utils.templates import render_to_string
 
 
 class ImageContent(models.Model):
@@ -7,11 +7,11 @@ from __future__ import absolute_import, unicode_literals
 from django.contrib import admin
 from django.core.exceptions import ImproperlyConfigured
 from django.db import models
-from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 
 from feincms.admin.item_editor import FeinCMSInline
 from feincms.module.medialibrary.fields import ContentWithMediaFile
+from feincms.utils.templates import render_to_string
 
 
 class MediaFileContentInline(FeinCMSInline):
@@ -46,6 +46,9 @@ class MediaFileContent(ContentWithMediaFile):
 
     feincms_item_editor_inline = MediaFileContentInline
 
+    # Templates often generate thumbnails while rendering
+    feincms_render_concurrently = True
+
     class Meta:
         abstract = True
         verbose_name = _('media file')
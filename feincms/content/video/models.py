@@ -3,9 +3,10 @@ from __future__ import absolute_import, unicode_literals
 import re
 
 from django.db import models
-from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 
+from feincms.utils.templates import render_to_string
+
 
 class VideoContent(models.Model):
     """
@@ -38,6 +38,16 @@ FEINCMS_MEDIALIBRARY_THUMBNAIL = getattr(
     'FEINCMS_MEDIALIBRARY_THUMBNAIL',
     'feincms.module.medialibrary.thumbnail.default_admin_thumbnail')
 
+#: Named thumbnail presets generated in the background right after saving an
+#: image media file, f.e.
+#: ``{'teaser': {'size': '300x200', 'mode': 'cropscale'}}``. ``mode`` is
+#: either ``'thumbnail'`` (the default) or ``'cropscale'``. Use the presets in
+#: templates with ``{{ mediafile.file|thumbnail_preset:"teaser" }}``.
+FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS = getattr(
+    settings,
+    'FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS',
+    {})
+
 # ------------------------------------------------------------------------
 # Settings for RichText
 
@@ -64,6 +74,15 @@ FEINCMS_JQUERY_NO_CONFLICT = getattr(
     'FEINCMS_JQUERY_NO_CONFLICT',
     False)
 
+#: Only render the empty form templates of content types which are not used
+#: yet when the content type is added for the first time in the item editor.
+#: Keeps the size of the change form independent of the number of registered
+#: content types.
+FEINCMS_ITEM_EDITOR_LAZY_INLINES = getattr(
+    settings,
+    'FEINCMS_ITEM_EDITOR_LAZY_INLINES',
+    True)
+
 # ------------------------------------------------------------------------
 # Settings for the page module
 
@@ -169,6 +188,44 @@ FEINCMS_THUMBNAIL_DIR = getattr(
     'FEINCMS_THUMBNAIL_DIR',
     '_thumbs/')
 
+#: Seconds thumbnails known to be up to date are remembered in Django's cache.
+#: Rendering those does not access the storage at all. Set this to ``0`` to
+#: check the storage every time.
+FEINCMS_THUMBNAIL_CACHE_TIMEOUT = getattr(
+    settings,
+    'FEINCMS_THUMBNAIL_CACHE_TIMEOUT',
+    7 * 24 * 3600)
+
+#: Directory used for queueing thumbnail jobs. If set, missing or outdated
+#: thumbnails are not generated while rendering; the URL of the original is
+#: used until the ``generate_thumbnails`` management command has processed
+#: the queue.
+FEINCMS_THUMBNAIL_QUEUE = getattr(
+    settings,
+    'FEINCMS_THUMBNAIL_QUEUE',
+    None)
+
+#: Count of threads used for generating thumbnails in the background, f.e.
+#: the presets of newly uploaded media files.
+FEINCMS_THUMBNAIL_WORKERS = getattr(
+    settings,
+    'FEINCMS_THUMBNAIL_WORKERS',
+    2)
+
+#: Encoder options per thumbnail output format, used for thumbnails with an
+#: explicit output format (f.e. presets containing ``'format': 'webp'``).
+#: Options set on the preset itself take precedence. ``colors`` quantizes PNG
+#: thumbnails to a palette of this many colors.
+FEINCMS_THUMBNAIL_FORMAT_OPTIONS = getattr(
+    settings,
+    'FEINCMS_THUMBNAIL_FORMAT_OPTIONS',
+    {
+        'jpeg': {'quality': 85, 'progressive': True, 'optimize': True},
+        'png': {'optimize': True},
+        'webp': {'quality': 80, 'method': 6},
+        'avif': {'quality': 60},
+    })
+
 # ------------------------------------------------------------------------
 #: Prevent changing template within admin for pages which have been
 #: allocated a Template with singleton=True -- template field will become
@@ -195,3 +252,49 @@ FEINCMS_FRONTEND_LANGUAGES = getattr(
     None)
 
 # ------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------
+#: Cache complete responses of pages without content types having a
+#: ``process`` or ``finalize`` method for anonymous users. The cache is
+#: cleared whenever a page or a content block is saved or deleted.
+FEINCMS_RESPONSE_CACHE = getattr(
+    settings,
+    'FEINCMS_RESPONSE_CACHE',
+    False)
+
+#: Timeout in seconds of cached responses. Changes to data not belonging to
+#: pages (f.e. media files) only become visible after this timeout.
+FEINCMS_RESPONSE_CACHE_TIMEOUT = getattr(
+    settings,
+    'FEINCMS_RESPONSE_CACHE_TIMEOUT',
+    300)
+
+# ------------------------------------------------------------------------
+#: Record the time taken by request and response processors and by the
+#: ``process``, ``render`` and ``finalize`` methods of content types.
+#: * ``None``: Disabled.
+#: * ``'header'``: Add a summary as ``X-FeinCMS-Profile`` response header.
+#: * ``'log'``: Log a summary using the ``feincms.utils.profiling`` logger.
+FEINCMS_PROFILE = getattr(
+    settings,
+    'FEINCMS_PROFILE',
+    None)
+
+# ------------------------------------------------------------------------
+#: Maximum count of threads used to run the ``process`` methods of content
+#: types setting ``feincms_process_concurrently = True`` concurrently when a
+#: page contains more than one of them. Only ``GET`` and ``HEAD`` requests are
+#: handled concurrently. ``0`` runs everything sequentially.
+FEINCMS_PROCESS_CONCURRENCY = getattr(
+    settings,
+    'FEINCMS_PROCESS_CONCURRENCY',
+    0)
+
+#: Maximum count of threads used to render content blocks of content types
+#: setting ``feincms_render_concurrently = True`` (f.e. content types fetching
+#: data from remote APIs) concurrently in ``feincms_render_region``. ``0``
+#: renders everything sequentially.
+FEINCMS_RENDER_CONCURRENCY = getattr(
+    settings,
+    'FEINCMS_RENDER_CONCURRENCY',
+    0)
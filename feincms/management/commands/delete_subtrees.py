@@ -0,0 +1,57 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``delete_subtrees``
+-------------------
+
+``delete_subtrees`` deletes pages including all their descendants and
+content blocks in bulk. Use this instead of the admin action for very large
+subtrees.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from feincms import settings
+from feincms._internal import get_model
+from feincms.utils.tree import delete_subtrees
+
+
+class Command(BaseCommand):
+    args = '<pk pk ...>'
+    help = (
+        "Delete the given pages including all descendants and content"
+        " blocks.")
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--model', dest='model',
+            default=settings.FEINCMS_DEFAULT_PAGE_MODEL,
+            help='app_label.model_name of the tree model (default: %s)' % (
+                settings.FEINCMS_DEFAULT_PAGE_MODEL)),
+        make_option(
+            '--batch-size', dest='batch_size', type='int', default=500,
+            help='Number of rows deleted per statement (default: 500)'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Pass the primary keys of the subtree roots.')
+
+        try:
+            model = get_model(*options['model'].split('.'))
+        except LookupError:
+            model = None
+        if model is None:
+            raise CommandError('Cannot load model "%s"' % options['model'])
+
+        pks = delete_subtrees(
+            model._default_manager.filter(pk__in=args),
+            batch_size=options['batch_size'])
+
+        self.stdout.write('Deleted %d %s.' % (
+            len(pks), model._meta.verbose_name_plural))
@@ -0,0 +1,56 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``feincms_profile``
+-------------------
+
+``feincms_profile`` prints the page profiles collected by
+``feincms.module.page.processors.sampling_profiler_request_processor``,
+aggregated per page template.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from feincms.utils.profiling import get_aggregates, reset_aggregates
+
+
+class Command(NoArgsCommand):
+    help = "Prints the sampled page profiles aggregated per page template."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--reset', action='store_true', dest='reset', default=False,
+            help='Delete all collected profiles after printing them.'),
+    )
+
+    def handle_noargs(self, **options):
+        aggregates = get_aggregates()
+        if not aggregates:
+            self.stdout.write('No profiles collected yet.')
+
+        for key, aggregate in sorted(
+                aggregates.items(),
+                key=lambda item: -item[1]['db_time'] / item[1]['requests']):
+            requests = aggregate['requests']
+            self.stdout.write(
+                '%s: %d requests, %.1f queries (max %d), %.1fms database,'
+                ' %.1fms content rendering, %.1fms template rendering' % (
+                    key,
+                    requests,
+                    float(aggregate['queries']) / requests,
+                    aggregate['max_queries'],
+                    aggregate['db_time'] * 1000 / requests,
+                    aggregate['render_time'] * 1000 / requests,
+                    aggregate['template_time'] * 1000 / requests))
+
+            for sql, count in sorted(
+                    aggregate['duplicates'].items(), key=lambda d: -d[1]):
+                self.stdout.write('    %5dx %s' % (count, sql))
+
+        if options['reset']:
+            reset_aggregates()
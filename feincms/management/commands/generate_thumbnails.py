@@ -0,0 +1,109 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``generate_thumbnails``
+-----------------------
+
+``generate_thumbnails`` processes the thumbnail jobs queued while rendering
+if ``FEINCMS_THUMBNAIL_QUEUE`` is set. Run it as a cronjob or from a process
+supervisor.
+
+With ``--presets``, it regenerates the thumbnail presets
+(``FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS``) of all images in the media
+library instead.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from multiprocessing import Pool
+from optparse import make_option
+import time
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connections
+
+from feincms import settings
+from feincms.module.medialibrary.models import MediaFile
+from feincms.module.medialibrary.thumbnail import rebuild_presets
+from feincms.utils.thumbnails import process_job, queued_jobs
+
+
+class Command(NoArgsCommand):
+    help = (
+        "Generates the thumbnails queued in FEINCMS_THUMBNAIL_QUEUE or the"
+        " thumbnail presets of all media files.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--workers', dest='workers', type='int', default=1,
+            help='Number of worker processes (default: 1)'),
+        make_option(
+            '--watch', dest='watch', type='int', default=0,
+            help='Keep running and look for new jobs every WATCH seconds.'),
+        make_option(
+            '--presets', action='store_true', dest='presets', default=False,
+            help='Regenerate the thumbnail presets of all media files.'),
+        make_option(
+            '--batch-size', dest='batch_size', type='int', default=100,
+            help='Number of media files processed per batch (default: 100)'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['presets']:
+            if not settings.FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS:
+                raise CommandError(
+                    'FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS is not set.')
+        elif not settings.FEINCMS_THUMBNAIL_QUEUE:
+            raise CommandError('FEINCMS_THUMBNAIL_QUEUE is not set.')
+
+        self.pool = None
+        if options['presets']:
+            names = list(MediaFile.objects.filter(
+                type='image').values_list('file', flat=True))
+
+        if options['workers'] > 1:
+            # Forked workers must not share database connections
+            for connection in connections.all():
+                connection.close()
+            self.pool = Pool(options['workers'])
+
+        try:
+            if options['presets']:
+                self.rebuild_presets(names, **options)
+            else:
+                self.process_queue(**options)
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+
+    def map(self, fn, items):
+        if self.pool is None:
+            return [fn(item) for item in items]
+        return self.pool.map(fn, items)
+
+    def process_queue(self, **options):
+        while True:
+            jobs = queued_jobs()
+            results = self.map(process_job, jobs)
+
+            if int(options['verbosity']) > 1 or jobs:
+                self.stdout.write('Generated %d of %d queued thumbnails.' % (
+                    sum(results), len(jobs)))
+
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
+
+    def rebuild_presets(self, names, **options):
+        batch_size = options['batch_size']
+        for i in range(0, len(names), batch_size):
+            self.map(rebuild_presets, names[i:i + batch_size])
+            if int(options['verbosity']) > 1:
+                self.stdout.write('Processed %d of %d media files.' % (
+                    min(i + batch_size, len(names)), len(names)))
+
+        self.stdout.write(
+            'Regenerated the thumbnail presets of %d media files.' % (
+                len(names)))
@@ -0,0 +1,61 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``import_mediafiles``
+---------------------
+
+``import_mediafiles`` imports the contents of a zip file into the media
+library, the same way the bulk upload in the administration does. Use this
+for archives which are too large to be uploaded through the browser.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from feincms.module.medialibrary.models import Category
+from feincms.module.medialibrary.zip import import_zipfile
+
+
+class Command(BaseCommand):
+    args = '<zipfile>'
+    help = "Import the files contained in a zip file into the media library."
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--category', dest='category', type='int', default=None,
+            help='Primary key of a category added to all imported files.'),
+        make_option(
+            '--overwrite', action='store_true', dest='overwrite',
+            default=False,
+            help='Overwrite existing files with the same name.'),
+        make_option(
+            '--workers', dest='workers', type='int', default=4,
+            help='Number of threads writing files (default: 4)'),
+        make_option(
+            '--batch-size', dest='batch_size', type='int', default=100,
+            help='Number of files imported per batch (default: 100)'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Pass the path of exactly one zip file.')
+
+        if (options['category'] and not Category.objects.filter(
+                pk=options['category']).exists()):
+            raise CommandError(
+                'Category %s does not exist.' % options['category'])
+
+        def progress(done, total):
+            if int(options['verbosity']) > 0:
+                self.stdout.write('Imported %d of %d files.' % (done, total))
+
+        count = import_zipfile(
+            options['category'], options['overwrite'], args[0],
+            workers=options['workers'], batch_size=options['batch_size'],
+            progress=progress)
+
+        self.stdout.write('Imported %d files.' % count)
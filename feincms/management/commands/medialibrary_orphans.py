@@ -1,22 +1,106 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``medialibrary_orphans``
+------------------------
+
+``medialibrary_orphans`` prints all files in the upload directory of the
+media library which do not belong to a media file. It works with all
+storage backends.
+
+With ``--missing``, it prints the files of media files which do not exist
+in the storage instead. ``--thumbnails`` additionally prints thumbnails
+whose original does not exist anymore or is an orphaned file itself.
+``--delete`` deletes the orphaned files and thumbnails (never media files).
+
+The upload directory is derived from ``upload_to`` of the media file field.
+If that is not possible (callable ``upload_to`` or ``upload_to`` starting
+with a date placeholder) the whole storage is searched; ``--delete``
+requires passing the directory using ``--root`` then, so that files of
+other apps sharing the storage are never deleted.
+"""
+
 from __future__ import absolute_import, unicode_literals
 
-import os
+from optparse import make_option
 
-from django.core.management.base import NoArgsCommand
-from django.utils.encoding import force_text
+from django.core.management.base import CommandError, NoArgsCommand
 
 from feincms.module.medialibrary.models import MediaFile
+from feincms.module.medialibrary.orphans import (
+    delete_files, find_missing, find_orphans, find_thumbnail_orphans,
+    upload_root)
+from feincms.utils import thumbnails
 
 
 class Command(NoArgsCommand):
-    help = "Prints all orphaned files in the `media/medialibrary` folder"
+    help = (
+        "Prints all orphaned files in the upload directory of the media"
+        " library.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--missing', action='store_true', dest='missing', default=False,
+            help='Print media files whose file does not exist instead.'),
+        make_option(
+            '--thumbnails', action='store_true', dest='thumbnails',
+            default=False,
+            help='Also print thumbnails of missing or orphaned files.'),
+        make_option(
+            '--delete', action='store_true', dest='delete', default=False,
+            help='Delete the orphaned files.'),
+        make_option(
+            '--root', dest='root', default=None,
+            help='Directory containing the uploaded media files (default:'
+                 ' derived from upload_to).'),
+        make_option(
+            '--workers', dest='workers', type='int', default=1,
+            help='Number of threads deleting files (default: 1)'),
+    )
 
     def handle_noargs(self, **options):
-        mediafiles = list(MediaFile.objects.values_list('file', flat=True))
-
-        # TODO make this smarter, and take MEDIA_ROOT into account
-        for base, dirs, files in os.walk('media/medialibrary'):
-            for f in files:
-                full = os.path.join(base[6:], f)
-                if force_text(full) not in mediafiles:
-                    self.stdout.write(os.path.join(base, f))
+        if options['missing'] and options['delete']:
+            raise CommandError('--delete cannot be combined with --missing.')
+
+        field = MediaFile._meta.get_field('file')
+        storage = field.storage
+        root = (options['root'] or upload_root(field)).strip('/')
+        if options['delete'] and not root:
+            raise CommandError(
+                'The upload directory cannot be determined from upload_to,'
+                ' pass it using --root to use --delete.')
+        names = set(MediaFile.objects.values_list('file', flat=True))
+
+        if options['missing']:
+            for name in find_missing(storage, names, root):
+                self.stdout.write(name)
+            return
+
+        orphans = []
+        for name in find_orphans(storage, names, root):
+            self.stdout.write(name)
+            orphans.append(name)
+
+        miniatures = []
+        if options['thumbnails']:
+            for name in find_thumbnail_orphans(storage, orphans):
+                self.stdout.write(name)
+                miniatures.append(name)
+
+        if options['delete']:
+            failed = delete_files(
+                storage, orphans + miniatures, options['workers'])
+            for name, exc_info in failed:
+                self.stderr.write('Cannot delete %s: %s' % (name, exc_info[1]))
+
+            # Deleted thumbnails must not be served from the registry
+            failed_names = set(name for name, exc_info in failed)
+            for name in orphans:
+                if name not in failed_names:
+                    thumbnails.forget(name)
+            thumbnails.unregister(
+                [name for name in miniatures if name not in failed_names])
+
+            self.stdout.write('Deleted %d orphaned files.' % (
+                len(orphans) + len(miniatures) - len(failed)))
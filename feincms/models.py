@@ -30,6 +30,7 @@ from feincms import ensure_completely_loaded
 from feincms._internal import get_model
 from feincms.extensions import ExtensionsMixin
 from feincms.utils import copy_model_instance
+from feincms.utils.templates import select_template
 
 
 @python_2_unicode_compatible
@@ -95,6 +96,15 @@ class Template(object):
     def __str__(self):
         return force_text(self.title)
 
+    def get_template(self):
+        """
+        Returns the compiled Django template for ``path``. Templates are only
+        loaded once per process (and path) unless ``DEBUG`` is active, so
+        that rendering a CMS object does not have to go through all template
+        loaders again and again.
+        """
+        return select_template(self.path)
+
 
 class ContentProxy(object):
     """
@@ -10,11 +10,20 @@ from __future__ import absolute_import, unicode_literals
 from email.utils import parsedate_tz, mktime_tz
 
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models import Max
+from django.db.models.signals import (
+    class_prepared, post_delete, post_save, pre_save)
+from django.http import HttpResponseNotModified
 from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
 from django.utils.translation import ugettext_lazy as _
 
 from feincms import extensions
+from feincms._internal import call_last_modified
+
+
+#: Models using this extension
+_tracked_models = set()
 
 
 # ------------------------------------------------------------------------
@@ -29,6 +38,57 @@ def pre_save_handler(sender, instance, **kwargs):
     instance.modification_date = now
 
 
+def content_changed_handler(sender, instance, **kwargs):
+    """
+    Update the modification date of the parent when content blocks are saved
+    or deleted. Uses ``update()`` so that the parent is not saved again.
+    """
+    cls = getattr(sender, '_feincms_content_class', None)
+    if cls is None or cls not in _tracked_models:
+        return
+
+    cls._base_manager.filter(pk=instance.parent_id).update(
+        modification_date=timezone.now())
+
+
+def _track_content_type(content_type):
+    post_save.connect(
+        content_changed_handler, sender=content_type,
+        dispatch_uid='feincms.changedate.content_changed')
+    post_delete.connect(
+        content_changed_handler, sender=content_type,
+        dispatch_uid='feincms.changedate.content_deleted')
+
+
+def class_prepared_handler(sender, **kwargs):
+    """
+    Connect ``content_changed_handler`` to content types created after the
+    extension has been registered.
+    """
+    for model in _tracked_models:
+        base = getattr(model, '_feincms_content_model', None)
+        if base is not None and issubclass(sender, base):
+            _track_content_type(sender)
+
+
+def last_modified(self, request=None):
+    """
+    Returns the latest modification date of the object itself and its content
+    blocks. If the template has inherited regions, the modification dates of
+    all ancestors are taken into account too.
+    """
+    modification_date = self.modification_date
+    if not (hasattr(self, 'get_ancestors') and any(
+            region.inherited for region in self.template.regions)):
+        return modification_date
+
+    ancestors = self.get_ancestors().aggregate(
+        modification_date=Max('modification_date'))['modification_date']
+    if ancestors is None or modification_date is None:
+        return modification_date or ancestors
+    return max(modification_date, ancestors)
+
+
 # ------------------------------------------------------------------------
 def dt_to_utc_timestamp(dt):
     from time import mktime
@@ -47,21 +107,72 @@ class Extension(extensions.Extension):
                 lambda page: page.modification_date and str(
                     dt_to_utc_timestamp(page.modification_date)))
 
-        self.model.last_modified = lambda p: p.modification_date
+        self.model.last_modified = last_modified
 
         pre_save.connect(pre_save_handler, sender=self.model)
 
+        _tracked_models.add(self.model)
+        for content_type in getattr(
+                self.model, '_feincms_content_types', ()):
+            _track_content_type(content_type)
+        class_prepared.connect(
+            class_prepared_handler,
+            dispatch_uid='feincms.changedate.class_prepared')
+
 
 # ------------------------------------------------------------------------
-def last_modified_response_processor(page, request, response):
-    from django.utils.http import http_date
+def last_modified_request_processor(page, request):
+    """
+    Returns a ``304 Not Modified`` response if the page has not been modified
+    since the date sent in the ``If-Modified-Since`` header. This happens
+    before any content blocks are loaded. Pages containing content types with
+    a ``process`` method (f.e. ``ApplicationContent``) are never
+    short-circuited because their output is not covered by the modification
+    date.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return
+
+    since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE') or '')
+    if since is None:
+        return
+
+    modification_date = call_last_modified(page, request)
+    if modification_date is None:
+        return
+
+    last_modified = dt_to_utc_timestamp(modification_date)
+    if last_modified > since:
+        return
+
+    process_types = set(page._feincms_content_types_with_process)
+    if process_types:
+        # Only counts content blocks; the query result is reused later
+        for blocks in page.content._fetch_content_type_counts().values():
+            for pk, ct_idx in blocks:
+                if page._feincms_content_types[ct_idx] in process_types:
+                    return
 
+    response = HttpResponseNotModified()
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+last_modified_request_processor.response_cache_safe = True
+
+
+def last_modified_response_processor(page, request, response):
     # Don't include Last-Modified if we don't want to be cached
     if "no-cache" in response.get('Cache-Control', ''):
         return
 
+    modification_date = call_last_modified(page, request)
+    if modification_date is None:
+        return
+
     # If we already have a Last-Modified, take the later one
-    last_modified = dt_to_utc_timestamp(page.last_modified())
+    last_modified = dt_to_utc_timestamp(modification_date)
     if response.has_header('Last-Modified'):
         last_modified = max(
             last_modified,
@@ -69,4 +180,7 @@ def last_modified_response_processor(page, request, response):
 
     response['Last-Modified'] = http_date(last_modified)
 
+
+last_modified_response_processor.response_cache_safe = True
+
 # ------------------------------------------------------------------------
@@ -83,6 +83,9 @@ def datepublisher_response_processor(page, request, response):
             patch_response_headers(response, delta - 7200)
 
 
+datepublisher_response_processor.response_cache_safe = True
+
+
 # ------------------------------------------------------------------------
 class Extension(extensions.Extension):
     def handle_model(self):
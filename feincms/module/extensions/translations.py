@@ -127,6 +127,9 @@ def translations_request_processor_explicit(page, request):
     return translation_set_language(request, desired_language)
 
 
+translations_request_processor_explicit.response_cache_safe = True
+
+
 # ------------------------------------------------------------------------
 def translations_request_processor_standard(page, request):
     # If this page is just a redirect, don't do any language specific setup
@@ -139,6 +142,9 @@ def translations_request_processor_standard(page, request):
     return translation_set_language(request, page.language)
 
 
+translations_request_processor_standard.response_cache_safe = True
+
+
 # ------------------------------------------------------------------------
 def get_current_language_code(request):
     language_code = getattr(request, 'LANGUAGE_CODE', None)
@@ -11,6 +11,7 @@ from django import forms
 from django.utils.translation import ugettext_lazy as _
 
 from feincms import settings
+from feincms.utils import thumbnails
 
 from . import logger
 from .models import Category, MediaFile
@@ -58,6 +59,7 @@ class MediaFileAdminForm(forms.ModelForm):
                     if instance.id and hasattr(instance, 'original_name'):
                         logger.info("Overwriting file %s with new data" % (
                             instance.original_name))
+                        thumbnails.forget(instance.original_name)
                         instance.file.storage.delete(instance.original_name)
                         return instance.original_name
 
@@ -7,7 +7,6 @@ from __future__ import absolute_import, unicode_literals
 import os
 
 from django import forms
-from django.conf import settings as django_settings
 from django.contrib import admin
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
@@ -17,7 +16,7 @@ except ImportError:  # Django 1.6
     from django.contrib.sites.models import get_current_site
 from django.core.files.images import get_image_dimensions
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
 from django.template.defaultfilters import filesizeformat
@@ -89,18 +88,23 @@ assign_category.short_description = _('Add selected media files to category')
 
 # -------------------------------------------------------------------------
 def save_as_zipfile(modeladmin, request, queryset):
-    from .zip import export_zipfile
-
-    site = get_current_site(request)
-    try:
-        zip_name = export_zipfile(site, queryset)
-        messages.info(request, _("ZIP file exported as %s") % zip_name)
-    except Exception as e:
-        messages.error(request, _("ZIP file export failed: %s") % str(e))
+    from .zip import export_filename, stream_zipfile
+
+    # Problems surfacing while streaming would only truncate the download,
+    # therefore check that all files are available before starting.
+    missing = [
+        mf.file.name for mf in queryset
+        if not mf.file.storage.exists(mf.file.name)]
+    if missing:
+        messages.error(request, _("ZIP file export failed: %s") % (
+            _("Missing files: %s") % ', '.join(missing)))
         return
 
-    return HttpResponseRedirect(
-        os.path.join(django_settings.MEDIA_URL, zip_name))
+    response = StreamingHttpResponse(
+        stream_zipfile(queryset), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (
+        export_filename(get_current_site(request)))
+    return response
 
 
 save_as_zipfile.short_description = _(
@@ -19,8 +19,10 @@ from feincms import settings
 from feincms.models import ExtensionsMixin
 from feincms.translations import (
     TranslatedObjectMixin, Translation, TranslatedObjectManager)
+from feincms.utils import thumbnails
 
 from . import logger
+from .thumbnail import generate_presets_after_commit
 
 
 # ------------------------------------------------------------------------
@@ -191,8 +193,18 @@ class MediaFileBase(models.Model, ExtensionsMixin, TranslatedObjectMixin):
             except (OSError, IOError, ValueError) as e:
                 logger.error("Unable to read file size for %s: %s" % (self, e))
 
+        # Uploads are committed to the storage by the model field
+        file_changed = self.file and (
+            not self.file._committed or
+            self.file.name != getattr(self, '_original_file_name', None))
+
         super(MediaFileBase, self).save(*args, **kwargs)
 
+        if file_changed:
+            # The file may have been overwritten (FEINCMS_MEDIAFILE_OVERWRITE)
+            thumbnails.forget(self.file.name)
+            generate_presets_after_commit(self)
+
         logger.info("Saved mediafile %d (%s, type %s, %d bytes)" % (
             self.id, self.file.name, self.type, self.file_size or 0))
 
@@ -201,6 +213,7 @@ class MediaFileBase(models.Model, ExtensionsMixin, TranslatedObjectMixin):
         if getattr(self, '_original_file_name', None):
             if self.file.name != self._original_file_name:
                 self.delete_mediafile(self._original_file_name)
+        self._original_file_name = self.file.name
 
         self.purge_translation_cache()
     save.alters_data = True
@@ -208,6 +221,7 @@ class MediaFileBase(models.Model, ExtensionsMixin, TranslatedObjectMixin):
     def delete_mediafile(self, name=None):
         if name is None:
             name = self.file.name
+        thumbnails.forget(name)
         try:
             self.file.storage.delete(name)
         except Exception as e:
@@ -0,0 +1,135 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+Reconciliation of the media library with its storage, used by the
+``medialibrary_orphans`` management command.
+
+Storages are only accessed through ``listdir``, ``exists`` and ``delete``,
+therefore all storage backends are supported. All generators yield names in
+sorted order.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import os
+import re
+
+from django.utils.encoding import force_text
+
+from feincms import settings
+from feincms.templatetags.feincms_thumbnail import (
+    CropscaleThumbnailer, Thumbnailer)
+from feincms.utils.concurrency import run_concurrently
+
+
+def walk_storage(storage, path=''):
+    """
+    Yields the names of all files below ``path`` in ``storage``.
+    """
+    try:
+        dirs, files = storage.listdir(path)
+    except (OSError, IOError):  # The directory does not exist
+        return
+
+    # Directories are sorted as if their name ended with a slash, so that
+    # the names of all files end up in sorted order
+    entries = sorted(
+        [(os.path.join(path, force_text(d)) + '/', True) for d in dirs] +
+        [(os.path.join(path, force_text(f)), False) for f in files])
+    for name, is_dir in entries:
+        if is_dir:
+            for child in walk_storage(storage, name.rstrip('/')):
+                yield child
+        else:
+            yield name
+
+
+def upload_root(field):
+    """
+    Returns the directory below which ``field`` (a ``FileField``) stores
+    its files, the part of ``upload_to`` before the first date placeholder.
+    Returns an empty string (the root of the storage) if ``upload_to`` is a
+    callable.
+    """
+    if callable(field.upload_to):
+        return ''
+    prefix = force_text(field.upload_to).split('%', 1)[0]
+    return prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+
+
+def find_orphans(storage, names, root=''):
+    """
+    Yields all files below ``root`` in ``storage`` which are not contained
+    in ``names`` (a set of file names). Thumbnails are skipped.
+    """
+    thumbnail_dir = settings.FEINCMS_THUMBNAIL_DIR
+    for name in walk_storage(storage, root):
+        if name not in names and not name.startswith(thumbnail_dir):
+            yield name
+
+
+def find_missing(storage, names, root=''):
+    """
+    Yields all entries of ``names`` (a set of file names) which do not exist
+    in ``storage``. Files below ``root`` are found by listing directories,
+    all others are checked one by one.
+    """
+    remaining = set(names)
+    remaining.difference_update(walk_storage(storage, root))
+    for name in sorted(remaining):
+        if (not root or name.startswith(root + '/') or
+                not storage.exists(name)):
+            yield name
+
+
+_THUMBNAIL_RE = re.compile(
+    r'^(?P<base>.+)(?:%s)\d+x\d+(?:-[0-9a-f]{8})?\.\w+$' % '|'.join(
+        re.escape(cls.MARKER) for cls in (Thumbnailer, CropscaleThumbnailer)))
+
+
+def find_thumbnail_orphans(storage, removed=()):
+    """
+    Yields all thumbnails below ``FEINCMS_THUMBNAIL_DIR`` whose original
+    does not exist anymore or is contained in ``removed`` (f.e. orphans
+    which are about to be deleted). Directories containing originals are
+    listed once each.
+    """
+    thumbnail_dir = settings.FEINCMS_THUMBNAIL_DIR
+    removed = set(removed)
+    originals = {}
+
+    for name in walk_storage(storage, thumbnail_dir.rstrip('/')):
+        match = _THUMBNAIL_RE.match(name[len(thumbnail_dir):])
+        if not match:
+            continue
+
+        base = match.group('base')
+        directory = os.path.dirname(base)
+        if directory not in originals:
+            try:
+                files = storage.listdir(directory)[1]
+            except (OSError, IOError):
+                files = []
+            originals[directory] = set()
+            for f in files:
+                f = os.path.join(directory, force_text(f))
+                if f not in removed:
+                    originals[directory].update((f, os.path.splitext(f)[0]))
+
+        if base not in originals[directory]:
+            yield name
+
+
+def delete_files(storage, names, workers=1):
+    """
+    Deletes ``names`` from ``storage`` using ``workers`` threads. Returns
+    a list of ``(name, exc_info)`` tuples of the files which could not be
+    deleted.
+    """
+    names = list(names)
+    results = run_concurrently(
+        [(storage.delete, (name,), {}) for name in names], workers)
+    return [
+        (name, exc_info)
+        for name, (result, exc_info) in zip(names, results) if exc_info]
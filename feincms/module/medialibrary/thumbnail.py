@@ -1,8 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 
+from django.db import transaction
+
 from feincms import settings
 from feincms.templatetags import feincms_thumbnail
-from feincms.utils import get_object
+from feincms.utils import get_object, thumbnails
+from feincms.utils.concurrency import CompletedFuture, get_executor
 
 
 def default_admin_thumbnail(mediafile, dimensions='100x100', **kwargs):
@@ -21,3 +24,72 @@ def admin_thumbnail(mediafile, dimensions='100x100'):
         _cached_thumbnailer = get_object(
             settings.FEINCMS_MEDIALIBRARY_THUMBNAIL)
     return _cached_thumbnailer(mediafile, dimensions=dimensions)
+
+
+def generate_presets(file, force=False):
+    """
+    Generates all thumbnails configured in
+    ``FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS`` for ``file``. Thumbnails which
+    are up to date already are only generated again if ``force`` is set.
+    """
+    for preset in settings.FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS:
+        feincms_thumbnail.get_preset_thumbnailer(file, preset).get_url(
+            force=force)
+
+
+def generate_presets_later(mediafile):
+    """
+    Generates the thumbnail presets of an image media file in a background
+    thread, or queues them if ``FEINCMS_THUMBNAIL_QUEUE`` is set. Always
+    returns a future, which is completed already if there was nothing to do,
+    the presets have been queued or no thread could be used.
+    """
+    presets = settings.FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS
+    if not presets or mediafile.type != 'image' or not mediafile.file:
+        return CompletedFuture()
+
+    file = thumbnails.StoredFile(
+        mediafile.file.name, mediafile.file.storage)
+
+    if settings.FEINCMS_THUMBNAIL_QUEUE:
+        for preset in presets:
+            thumbnailer = feincms_thumbnail.get_preset_thumbnailer(
+                file, preset)
+            thumbnails.enqueue(
+                thumbnailer.__class__, file.storage, file.name,
+                thumbnailer.size, thumbnailer.format, thumbnailer.options)
+        return CompletedFuture()
+
+    executor = None
+    if settings.FEINCMS_THUMBNAIL_WORKERS > 0:
+        executor = get_executor(
+            settings.FEINCMS_THUMBNAIL_WORKERS, name='thumbnails')
+    if executor is None:
+        generate_presets(file)
+        return CompletedFuture()
+    return executor.submit(generate_presets, file)
+
+
+def generate_presets_after_commit(mediafile):
+    """
+    Calls ``generate_presets_later`` once the current transaction has been
+    committed, so that a rolled back upload does not start any work. Django
+    versions without ``transaction.on_commit`` (before 1.9) call it right
+    away.
+    """
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is None:
+        generate_presets_later(mediafile)
+    else:
+        on_commit(lambda: generate_presets_later(mediafile))
+
+
+def rebuild_presets(name):
+    """
+    Regenerates all thumbnail presets of the media file named ``name``. Used
+    by the ``generate_thumbnails`` management command.
+    """
+    from feincms.module.medialibrary.models import MediaFile
+
+    storage = MediaFile._meta.get_field('file').storage
+    generate_presets(thumbnails.StoredFile(name, storage), force=True)
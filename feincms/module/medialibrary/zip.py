@@ -9,17 +9,30 @@
 
 from __future__ import absolute_import, unicode_literals
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+from contextlib import closing
+from itertools import groupby
 import json
 import zipfile
 import os
-import time
+import sys
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 
 from django.conf import settings as django_settings
-from django.core.files.base import ContentFile
+from django.core.files.base import File
+from django.db import transaction
 from django.template.defaultfilters import slugify
-from django.utils import timezone
+from django.utils import six, timezone
+from django.utils.encoding import force_bytes, force_text
+
+from feincms.utils import thumbnails
+from feincms.utils.concurrency import run_concurrently
 
 from .models import Category, MediaFile, MediaFileTranslation
+from .thumbnail import generate_presets_after_commit
 
 
 # ------------------------------------------------------------------------
@@ -27,7 +40,65 @@ export_magic = 'feincms-export-01'
 
 
 # ------------------------------------------------------------------------
-def import_zipfile(category_id, overwrite, data):
+def _read_info(comment):
+    try:
+        return json.loads(force_text(comment))
+    except ValueError:
+        return {}
+
+
+def _categories_by_key(slugs, categories):
+    # Adds categories to the ``categories`` dictionary using (slug, title)
+    # keys. The oldest category wins if there are duplicates.
+    for category in Category.objects.filter(slug__in=slugs).order_by('pk'):
+        categories.setdefault((category.slug, category.title), category)
+
+
+def import_categories(categories):
+    """
+    Creates the categories from the meta information of an export file
+    which do not exist yet (matched by slug and title). Returns a
+    dictionary mapping the ids in the export file to categories.
+
+    Uses one ``bulk_create`` and one query per category level.
+    """
+    existing = {}
+    _categories_by_key([cat['slug'] for cat in categories], existing)
+
+    category_id_map = {}
+
+    def by_level(cat):
+        return cat.get('level', 999)
+
+    for level, group in groupby(sorted(categories, key=by_level), by_level):
+        group = list(group)
+        missing = OrderedDict(
+            ((cat['slug'], cat['title']), cat) for cat in group
+            if (cat['slug'], cat['title']) not in existing)
+        if missing:
+            Category.objects.bulk_create([
+                Category(
+                    slug=cat['slug'],
+                    title=cat['title'],
+                    parent=category_id_map.get(cat.get('parent', 0)))
+                for cat in missing.values()])
+            _categories_by_key([cat['slug'] for cat in group], existing)
+
+        for cat in group:
+            category_id_map[cat['id']] = existing[(cat['slug'], cat['title'])]
+    return category_id_map
+
+
+def _save_member(zip_file, zi, name, storage):
+    # Streams one member of the zip file into the storage
+    with closing(zip_file.open(zi)) as handle:
+        content = File(handle, name=name)
+        content.size = zi.file_size
+        return storage.save(name, content)
+
+
+def import_zipfile(category_id, overwrite, data, workers=4, batch_size=100,
+                   progress=None):
     """
     Import a collection of media files from a zip file.
 
@@ -35,158 +106,364 @@ def import_zipfile(category_id, overwrite, data):
         files will have added (eg. cathegory "newly uploaded files")
     overwrite: attempt to overwrite existing files. This might
         not work with non-trivial storage handlers
+    data: the zip file, either a path or a file-like object
+    workers: number of threads writing files to the storage
+    batch_size: number of files written and inserted into the database
+        at once
+    progress: if set, called with the number of processed and the total
+        number of files after each batch
+
+    Files are streamed from the archive into the storage, never loaded into
+    memory completely. Media files, their translations and categories are
+    created with ``bulk_create``, therefore ``MediaFile.save`` is not called
+    (thumbnail presets are generated nevertheless).
     """
     category = None
     if category_id:
         category = Category.objects.get(pk=int(category_id))
 
+    # Use the path of large uploads; Python 2 opens a separate file handle
+    # for each member then, which allows reading members concurrently
+    data = getattr(data, 'temporary_file_path', lambda: data)()
     z = zipfile.ZipFile(data)
+    if not isinstance(data, six.string_types) and sys.version_info < (3, 5):
+        workers = 1
 
     # Peek into zip file to find out whether it contains meta information
-    is_export_file = False
-    info = {}
-    try:
-        info = json.loads(z.comment)
-        if info['export_magic'] == export_magic:
-            is_export_file = True
-    except:
-        pass
+    info = _read_info(z.comment)
+    is_export_file = info.get('export_magic') == export_magic
 
     # If meta information, do we need to create any categories?
     # Also build translation map for category ids.
     category_id_map = {}
     if is_export_file:
-        for cat in sorted(
-                info.get('categories', []),
-                key=lambda k: k.get('level', 999)):
-            new_cat, created = Category.objects.get_or_create(
-                slug=cat['slug'],
-                title=cat['title'])
-            category_id_map[cat['id']] = new_cat
-            if created and cat.get('parent', 0):
-                parent_cat = category_id_map.get(cat.get('parent', 0), None)
-                if parent_cat:
-                    new_cat.parent = parent_cat
-                    new_cat.save()
+        category_id_map = import_categories(info.get('categories', []))
 
-    count = 0
+    members = []
     for zi in z.infolist():
         if not zi.filename.endswith('/'):
             bname = os.path.basename(zi.filename)
             if bname and not bname.startswith(".") and "." in bname:
-                fname, ext = os.path.splitext(bname)
-                wanted_dir = os.path.dirname(zi.filename)
-                target_fname = slugify(fname) + ext.lower()
-
-                info = {}
-                if is_export_file:
-                    info = json.loads(zi.comment)
-
-                mf = None
-                if overwrite:
-                    full_path = os.path.join(wanted_dir, target_fname)
-                    try:
-                        mf = MediaFile.objects.get(file=full_path)
-                        mf.file.delete(save=False)
-                    except MediaFile.DoesNotExist:
-                        mf = None
-
-                if mf is None:
-                    mf = MediaFile()
-                if overwrite:
-                    mf.file.field.upload_to = wanted_dir
-                mf.copyright = info.get('copyright', '')
-                mf.file.save(
-                    target_fname,
-                    ContentFile(z.read(zi.filename)),
-                    save=False)
-                mf.save()
-
-                found_metadata = False
-                if is_export_file:
-                    try:
-                        for tr in info['translations']:
-                            found_metadata = True
-                            mt, mt_created =\
-                                MediaFileTranslation.objects.get_or_create(
-                                    parent=mf, language_code=tr['lang'])
-                            mt.caption = tr['caption']
-                            mt.description = tr.get('description', None)
-                            mt.save()
-
-                        # Add categories
-                        mf.categories = (
-                            category_id_map[cat_id]
-                            for cat_id in info.get('categories', []))
-                    except Exception:
-                        pass
-
-                if not found_metadata:
-                    mt = MediaFileTranslation()
-                    mt.parent = mf
-                    mt.caption = fname.replace('_', ' ')
-                    mt.save()
-
-                if category:
-                    mf.categories.add(category)
-
-                count += 1
+                members.append(zi)
+
+    count = 0
+    for i in range(0, len(members), batch_size):
+        count += _import_batch(
+            z, members[i:i + batch_size], overwrite, category,
+            category_id_map if is_export_file else None, workers)
+        if progress:
+            progress(count, len(members))
 
     return count
 
 
+def _import_batch(z, members, overwrite, category, category_id_map, workers):
+    field = MediaFile._meta.get_field('file')
+    storage = field.storage
+
+    names = []
+    for zi in members:
+        fname, ext = os.path.splitext(os.path.basename(zi.filename))
+        target_fname = slugify(fname) + ext.lower()
+        if overwrite:
+            names.append(os.path.join(
+                os.path.dirname(zi.filename), target_fname))
+        else:
+            names.append(field.generate_filename(MediaFile(), target_fname))
+
+    existing = {}
+    if overwrite:
+        existing = dict(
+            (mf.file.name, mf)
+            for mf in MediaFile.objects.filter(file__in=names))
+        for mf in existing.values():
+            mf.delete_mediafile()
+
+    results = run_concurrently([
+        (_save_member, (z, zi, name, storage), {})
+        for zi, name in zip(members, names)], workers)
+
+    try:
+        for result, exc_info in results:
+            if exc_info:
+                six.reraise(*exc_info)
+
+        mediafiles = []
+        translations = {}
+        for zi, (name, exc_info) in zip(members, results):
+            info = (
+                _read_info(zi.comment) if category_id_map is not None else {})
+            mf = existing.get(name) or MediaFile(created=timezone.now())
+            mf.file = name
+            mf.type = mf.determine_file_type(name)
+            mf.file_size = zi.file_size
+            mf.copyright = info.get('copyright', '')
+            mf._import_info = info
+            mediafiles.append(mf)
+
+            fname = os.path.splitext(os.path.basename(zi.filename))[0]
+            translations[name] = [
+                MediaFileTranslation(
+                    language_code=tr['lang'],
+                    caption=tr['caption'],
+                    description=tr.get('description') or '')
+                for tr in info.get('translations', [])
+            ] or [MediaFileTranslation(caption=fname.replace('_', ' '))]
+
+        _insert_batch(mediafiles, translations, category, category_id_map)
+    except Exception:
+        # Do not leave the files of this batch behind without media files
+        exc_info = sys.exc_info()
+        for result, error in results:
+            if not error:
+                try:
+                    thumbnails.forget(result)
+                    storage.delete(result)
+                except Exception:
+                    pass
+        six.reraise(*exc_info)
+
+    for mf in mediafiles:
+        generate_presets_after_commit(mf)
+
+    return len(mediafiles)
+
+
+def _insert_batch(mediafiles, translations, category, category_id_map):
+    # Inserts or updates the database rows of one batch of media files
+    updated_pks = [mf.pk for mf in mediafiles if mf.pk]
+    with transaction.atomic():
+        for mf in mediafiles:
+            if mf.pk:
+                MediaFile.objects.filter(pk=mf.pk).update(
+                    file=mf.file.name, type=mf.type, file_size=mf.file_size,
+                    copyright=mf.copyright)
+                mf.purge_translation_cache()
+
+        new_mediafiles = [mf for mf in mediafiles if not mf.pk]
+        new_names = [mf.file.name for mf in new_mediafiles]
+        # Rows already using the names of new files (f.e. media files whose
+        # file went missing) must not be mistaken for the inserted rows
+        stale_pks = list(MediaFile.objects.filter(
+            file__in=new_names).values_list('pk', flat=True))
+        MediaFile.objects.bulk_create(new_mediafiles)
+
+        # bulk_create does not set primary keys on most databases
+        if any(mf.pk is None for mf in new_mediafiles):
+            pks = dict(MediaFile.objects.filter(
+                file__in=new_names,
+            ).exclude(pk__in=stale_pks).values_list('file', 'pk'))
+            for mf in new_mediafiles:
+                mf.pk = mf.id = pks[mf.file.name]
+
+        MediaFileTranslation.objects.filter(parent__in=updated_pks).delete()
+
+        new_translations = []
+        for mf in mediafiles:
+            for translation in translations[mf.file.name]:
+                translation.parent_id = mf.pk
+                new_translations.append(translation)
+        MediaFileTranslation.objects.bulk_create(new_translations)
+
+        categories = MediaFile._meta.get_field('categories')
+        through = categories.rel.through
+        source = '%s_id' % categories.m2m_field_name()
+        target = '%s_id' % categories.m2m_reverse_field_name()
+        links = set()
+        for mf in mediafiles:
+            for cat_id in mf._import_info.get('categories', []):
+                if cat_id in category_id_map:
+                    links.add((mf.pk, category_id_map[cat_id].pk))
+            if category:
+                links.add((mf.pk, category.pk))
+        links.difference_update(through.objects.filter(**{
+            '%s__in' % source: [pk for pk, cat in links]
+        }).values_list(source, target))
+        through.objects.bulk_create([
+            through(**{source: pk, target: cat}) for pk, cat in links])
+
+
 # ------------------------------------------------------------------------
-def export_zipfile(site, queryset):
-    now = timezone.now()
-    zip_name = "export_%s_%04d%02d%02d.zip" % (
-        slugify(site.domain), now.year, now.month, now.day)
+#: Size of the chunks copied into and streamed out of exported zip files
+EXPORT_CHUNK_SIZE = 64 * 1024
 
-    zip_data = open(os.path.join(django_settings.MEDIA_ROOT, zip_name), "w")
-    zip_file = zipfile.ZipFile(zip_data, 'w', allowZip64=True)
 
-    # Save the used categories in the zip file's global comment
+def _export_batches(queryset, batch_size=100):
+    # Prefetching does not work together with ``iterator()``, load media
+    # files in batches instead
+    pks = list(queryset.values_list('pk', flat=True))
+    manager = queryset.model._default_manager
+    for i in range(0, len(pks), batch_size):
+        batch = manager.filter(pk__in=pks[i:i + batch_size]).prefetch_related(
+            'categories', 'translations')
+        for mf in batch:
+            yield mf
+
+
+def _date_time(mf):
+    created = mf.created
+    if timezone.is_aware(created):
+        created = timezone.localtime(created)
+    return created.timetuple()[:6]
+
+
+def _write_member_from_file(zip_file, zip_info, field_file):
+    """
+    Adds ``field_file`` to ``zip_file`` using ``ZipFile.write``, which copies
+    the file from disk instead of reading it into memory. Files of storages
+    without local paths are copied into a temporary file first. The member
+    keeps the modification time of the file on disk.
+    """
+    storage = field_file.storage
+    try:
+        path = storage.path(field_file.name)
+    except NotImplementedError:
+        with NamedTemporaryFile() as temp:
+            with storage.open(field_file.name, 'rb') as file_data:
+                for chunk in iter(
+                        lambda: file_data.read(EXPORT_CHUNK_SIZE), b''):
+                    temp.write(chunk)
+            temp.flush()
+            zip_file.write(temp.name, arcname=zip_info.filename)
+    else:
+        zip_file.write(path, arcname=zip_info.filename)
+
+    # The comment is only written to the central directory when closing
+    zip_file.filelist[-1].comment = zip_info.comment
+
+
+def _write_members(zip_file, queryset):
+    """
+    Writes the media files of ``queryset`` into ``zip_file`` and yields after
+    every chunk, so that the caller can stream the written data. The meta
+    information is stored in the comments of the members and of the zip
+    file itself.
+    """
+    all_categories = dict((cat.pk, cat) for cat in Category.objects.all())
+
+    def path_ids(pk):
+        ids = []
+        while pk:
+            ids.insert(0, pk)
+            pk = all_categories[pk].parent_id
+        return ids
+
     used_categories = set()
-    for mf in queryset:
-        for cat in mf.categories.all():
-            used_categories.update(cat.path_list())
+    for mf in _export_batches(queryset):
+        category_ids = [cat.pk for cat in mf.categories.all()]
+        for pk in category_ids:
+            used_categories.update(path_ids(pk))
 
-    info = {
-        'export_magic': export_magic,
-        'categories': [{
-            'id': cat.id,
-            'title': cat.title,
-            'slug': cat.slug,
-            'parent': cat.parent_id or 0,
-            'level': len(cat.path_list()),
-        } for cat in used_categories],
-    }
-    zip_file.comment = json.dumps(info)
-
-    for mf in queryset:
-        ctime = time.localtime(os.stat(mf.file.path).st_ctime)
-        info = json.dumps({
+        zip_info = zipfile.ZipInfo(
+            filename=mf.file.name, date_time=_date_time(mf))
+        zip_info.comment = force_bytes(json.dumps({
             'copyright': mf.copyright,
-            'categories': [cat.id for cat in mf.categories.all()],
+            'categories': category_ids,
             'translations': [{
                 'lang': t.language_code,
                 'caption': t.caption,
                 'description': t.description,
             } for t in mf.translations.all()],
-        })
-
-        with open(mf.file.path, "r") as file_data:
-            zip_info = zipfile.ZipInfo(
-                filename=mf.file.name,
-                date_time=(
-                    ctime.tm_year,
-                    ctime.tm_mon,
-                    ctime.tm_mday,
-                    ctime.tm_hour,
-                    ctime.tm_min,
-                    ctime.tm_sec))
-            zip_info.comment = info
-            zip_file.writestr(zip_info, file_data.read())
+        }))
+
+        if sys.version_info < (3, 6):
+            # Writing members in chunks is not supported
+            _write_member_from_file(zip_file, zip_info, mf.file)
+            yield
+            continue
+
+        with mf.file.storage.open(mf.file.name, 'rb') as file_data:
+            force_zip64 = (
+                mf.file_size is None or mf.file_size > zipfile.ZIP64_LIMIT)
+            with zip_file.open(
+                    zip_info, 'w', force_zip64=force_zip64) as member:
+                for chunk in iter(
+                        lambda: file_data.read(EXPORT_CHUNK_SIZE), b''):
+                    member.write(chunk)
+                    yield
+
+    # Save the used categories in the zip file's global comment
+    zip_file.comment = force_bytes(json.dumps({
+        'export_magic': export_magic,
+        'categories': [{
+            'id': pk,
+            'title': all_categories[pk].title,
+            'slug': all_categories[pk].slug,
+            'parent': all_categories[pk].parent_id or 0,
+            'level': len(path_ids(pk)),
+        } for pk in sorted(used_categories)],
+    }))
 
+
+def write_zipfile(fileobj, queryset):
+    """
+    Writes an export of the media files in ``queryset`` to ``fileobj``.
+    """
+    with closing(zipfile.ZipFile(fileobj, 'w', allowZip64=True)) as zip_file:
+        for _ in _write_members(zip_file, queryset):
+            pass
+
+
+class _StreamBuffer(object):
+    """
+    Write-only file collecting the data written by ``ZipFile``.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data, self.chunks, self.size = b''.join(self.chunks), [], 0
+        return data
+
+
+def stream_zipfile(queryset):
+    """
+    Generator yielding an export of the media files in ``queryset`` as zip
+    file in chunks, suitable for a ``StreamingHttpResponse``. Memory usage
+    does not depend on the size of the media files.
+    """
+    if sys.version_info < (3, 5):
+        # ZipFile cannot write to unseekable files, spool to disk first
+        with SpooledTemporaryFile(max_size=EXPORT_CHUNK_SIZE) as fileobj:
+            write_zipfile(fileobj, queryset)
+            fileobj.seek(0)
+            for chunk in iter(
+                    lambda: fileobj.read(EXPORT_CHUNK_SIZE), b''):
+                yield chunk
+        return
+
+    buf = _StreamBuffer()
+    with closing(zipfile.ZipFile(buf, 'w', allowZip64=True)) as zip_file:
+        for _ in _write_members(zip_file, queryset):
+            if buf.size >= EXPORT_CHUNK_SIZE:
+                yield buf.pop()
+    yield buf.pop()
+
+
+def export_filename(site):
+    now = timezone.now()
+    return "export_%s_%04d%02d%02d.zip" % (
+        slugify(site.domain), now.year, now.month, now.day)
+
+
+def export_zipfile(site, queryset):
+    """
+    Writes an export of the media files in ``queryset`` to ``MEDIA_ROOT``
+    and returns its file name.
+    """
+    zip_name = export_filename(site)
+    with open(os.path.join(django_settings.MEDIA_ROOT, zip_name), 'wb') as f:
+        write_zipfile(f, queryset)
     return zip_name
 
 # ------------------------------------------------------------------------
@@ -4,17 +4,85 @@ try:
     from collections import OrderedDict
 except ImportError:
     from django.utils.datastructures import SortedDict as OrderedDict
+import copy
+from random import SystemRandom
 
+from django.core.cache import cache as django_cache
+from django.db.models import signals
+from django.dispatch import receiver
 from django.http import Http404
 from django.template import Template
+from django.utils import six
 from django.utils.decorators import method_decorator
+from django.utils.translation import get_language
 from django.views import generic
 from django.views.generic.base import TemplateResponseMixin
 
 from feincms import settings
+from feincms.signals import subtrees_post_delete
+from feincms.utils import path_to_cache_key
+from feincms.utils.concurrency import call_safely, run_concurrently
+from feincms.utils.profiling import Profile, processor_name, timed
 from feincms.views.decorators import standalone
 
 
+RESPONSE_CACHE_GENERATION_KEY = 'FEINCMS:RESPONSECACHE'
+
+
+# Incremented whenever a processor registry is modified, invalidates the
+# compiled processor pipelines of all classes (registries may be shared with
+# subclasses).
+_processors_version = [0]
+
+
+class ProcessorRegistry(OrderedDict):
+    """
+    Ordered dictionary of request or response processors which invalidates
+    the compiled processor pipelines whenever it is modified.
+    """
+
+    def _modified(self):
+        _processors_version[0] += 1
+
+    def __setitem__(self, key, value):
+        super(ProcessorRegistry, self).__setitem__(key, value)
+        self._modified()
+
+    def __delitem__(self, key):
+        super(ProcessorRegistry, self).__delitem__(key)
+        self._modified()
+
+    def pop(self, *args):
+        self._modified()
+        return super(ProcessorRegistry, self).pop(*args)
+
+    def popitem(self, *args, **kwargs):
+        self._modified()
+        return super(ProcessorRegistry, self).popitem(*args, **kwargs)
+
+    def setdefault(self, *args):
+        self._modified()
+        return super(ProcessorRegistry, self).setdefault(*args)
+
+    def update(self, *args, **kwargs):
+        super(ProcessorRegistry, self).update(*args, **kwargs)
+        self._modified()
+
+    def clear(self):
+        super(ProcessorRegistry, self).clear()
+        self._modified()
+
+
+def cycle_response_cache(*args, **kwargs):
+    """
+    Invalidates all responses cached by ``ContentObjectMixin`` by changing
+    the cache generation which is part of all cache keys.
+    """
+    value = '%07x' % (SystemRandom().randint(0, 0x10000000))
+    django_cache.set(RESPONSE_CACHE_GENERATION_KEY, value)
+    return value
+
+
 class ContentModelMixin(object):
     """
     Mixin for ``feincms.models.Base`` subclasses which need need some degree of
@@ -34,7 +102,7 @@ class ContentModelMixin(object):
         always receives two arguments, the current object and the request.
         """
         if cls.request_processors is None:
-            cls.request_processors = OrderedDict()
+            cls.request_processors = ProcessorRegistry()
         cls.request_processors[fn if key is None else key] = fn
 
     @classmethod
@@ -45,9 +113,39 @@ class ContentModelMixin(object):
         request and the response.
         """
         if cls.response_processors is None:
-            cls.response_processors = OrderedDict()
+            cls.response_processors = ProcessorRegistry()
         cls.response_processors[fn if key is None else key] = fn
 
+    @classmethod
+    def get_processor_pipelines(cls):
+        """
+        Returns a tuple containing the request processors (in calling order,
+        that is last registered first) and the response processors as tuples
+        of ``(name, processor)`` tuples.
+
+        The pipelines are compiled once and only rebuilt after modifying
+        ``request_processors`` or ``response_processors`` (registries which
+        are not a ``ProcessorRegistry`` are only checked for identity).
+        """
+        pipelines = cls.__dict__.get('_feincms_processor_pipelines')
+        if (pipelines is None
+                or pipelines[0] != _processors_version[0]
+                or pipelines[1] is not cls.request_processors
+                or pipelines[2] is not cls.response_processors):
+            pipelines = (
+                _processors_version[0],
+                cls.request_processors,
+                cls.response_processors,
+                tuple(reversed([
+                    (processor_name(key, fn), fn)
+                    for key, fn in (cls.request_processors or {}).items()])),
+                tuple(
+                    (processor_name(key, fn), fn)
+                    for key, fn in (cls.response_processors or {}).items()),
+            )
+            cls._feincms_processor_pipelines = pipelines
+        return pipelines[3:]
+
     # TODO Implement admin_urlname templatetag protocol
     @property
     def app_label(self):
@@ -70,6 +168,18 @@ class ContentModelMixin(object):
         return self.__class__.__name__.lower()
 
 
+@receiver([signals.post_save, signals.post_delete, subtrees_post_delete])
+def _content_changed(sender, **kwargs):
+    if not settings.FEINCMS_RESPONSE_CACHE:
+        return
+
+    if (issubclass(sender, ContentModelMixin)
+            or issubclass(
+                getattr(sender, '_feincms_content_class', object),
+                ContentModelMixin)):
+        cycle_response_cache()
+
+
 class ContentObjectMixin(TemplateResponseMixin):
     """
     Mixin for Django's class based views which knows how to handle
@@ -90,10 +200,30 @@ class ContentObjectMixin(TemplateResponseMixin):
         if not hasattr(self.request, '_feincms_extra_context'):
             self.request._feincms_extra_context = {}
 
+        if not settings.FEINCMS_PROFILE:
+            return self.handle_object()
+
+        profile = self.request._feincms_profile = Profile()
+        response = self.handle_object()
+        profile.attach(self.request, response)
+        return response
+
+    def handle_object(self):
+        """
+        Runs the request processors, the ``process`` methods of content types,
+        renders the response and runs ``finalize`` methods of content types and
+        response processors.
+        """
         r = self.run_request_processors()
         if r:
             return r
 
+        cache_key = self.get_response_cache_key()
+        if cache_key:
+            response = django_cache.get(cache_key)
+            if response is not None:
+                return response
+
         r = self.process_content_types()
         if r:
             return r
@@ -108,8 +238,100 @@ class ContentObjectMixin(TemplateResponseMixin):
         if r:
             return r
 
+        if cache_key:
+            self.cache_response(cache_key, response)
+
         return response
 
+    def get_response_cache_key(self):
+        """
+        Returns the key used for caching the complete response, or ``None`` if
+        the response to the current request should not be cached.
+        """
+        if not settings.FEINCMS_RESPONSE_CACHE:
+            return None
+
+        request = self.request
+        if request.method not in ('GET', 'HEAD') or request.GET:
+            return None
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated():
+            return None
+
+        # Response processors are skipped when serving cached responses, and
+        # request processors may make the response depend on the current
+        # user. Only processors marked as safe allow caching.
+        get_pipelines = getattr(self.object, 'get_processor_pipelines', None)
+        if get_pipelines is not None:
+            request_processors, response_processors = get_pipelines()
+            if not all(
+                    getattr(fn, 'response_cache_safe', False)
+                    for name, fn in request_processors + response_processors):
+                return None
+
+        generation = django_cache.get(RESPONSE_CACHE_GENERATION_KEY)
+        if generation is None:
+            generation = cycle_response_cache()
+
+        return path_to_cache_key(
+            request.path,
+            prefix='RESPONSE:%s:%s:%s:%s' % (
+                request.method,
+                'https' if request.is_secure() else 'http',
+                get_language(),
+                generation))
+
+    def response_is_cacheable(self, response):
+        """
+        Only successful responses to pages without content types taking part
+        in the request-response cycle are cached. Responses setting cookies,
+        modifying the session, using the CSRF token or messages are never
+        cached.
+
+        Called after the response has been rendered, but before the response
+        middleware runs.
+        """
+        if (response.status_code != 200
+                or response.cookies
+                or getattr(response, 'streaming', False)):
+            return False
+
+        request = self.request
+        session = getattr(request, 'session', None)
+        if session is not None and session.modified:
+            return False
+
+        # The CSRF and the messages middleware only set their cookies later
+        if request.META.get('CSRF_COOKIE_USED'):
+            return False
+        messages = getattr(request, '_messages', None)
+        if messages is not None and (
+                getattr(messages, 'used', False)
+                or getattr(messages, '_queued_messages', None)):
+            return False
+
+        return not self.object.content.all_of_type(tuple(
+            self.object._feincms_content_types_with_process
+            + self.object._feincms_content_types_with_finalize))
+
+    def cache_response(self, cache_key, response):
+        """
+        Caches the response after rendering if ``response_is_cacheable``
+        allows it.
+        """
+        def _set(response):
+            if self.response_is_cacheable(response):
+                django_cache.set(
+                    cache_key, response,
+                    settings.FEINCMS_RESPONSE_CACHE_TIMEOUT)
+
+        if getattr(response, 'is_rendered', True):
+            _set(response)
+        else:
+            # Template responses are rendered later
+            response.add_post_render_callback(_set)
+
     def get_template_names(self):
         # According to the documentation this method is supposed to return
         # a list. However, we can also return a Template instance...
@@ -127,6 +349,27 @@ class ContentObjectMixin(TemplateResponseMixin):
         # implementation...
         return super(ContentObjectMixin, self).get_template_names()
 
+    def render_to_response(self, context, **response_kwargs):
+        """
+        Renders the response using the compiled template of the FeinCMS
+        template (see ``Template.get_template``) instead of the template
+        loaders, unless ``get_template_names`` returns something else.
+        """
+        template = self.get_template_names()
+        if (isinstance(template, (list, tuple)) and len(template) == 1
+                and getattr(self.object, 'template', None) is not None
+                and template[0] == self.object.template.path):
+            template = self.object.template.get_template()
+
+        response_kwargs.setdefault('content_type', self.content_type)
+        if hasattr(self, 'template_engine'):  # Django 1.8 and better
+            response_kwargs.setdefault('using', self.template_engine)
+        return self.response_class(
+            request=self.request,
+            template=template,
+            context=context,
+            **response_kwargs)
+
     def get_context_data(self, **kwargs):
         context = self.request._feincms_extra_context
         context[self.context_object_name or 'feincms_object'] = self.object
@@ -151,8 +394,11 @@ class ContentObjectMixin(TemplateResponseMixin):
         if not getattr(self.object, 'request_processors', None):
             return
 
-        for fn in reversed(list(self.object.request_processors.values())):
-            r = fn(self.object, self.request)
+        request_processors = self.object.get_processor_pipelines()[0]
+        for name, fn in request_processors:
+            r = timed(
+                self.request, 'request_processor', name,
+                fn, (self.object, self.request))
             if r:
                 return r
 
@@ -165,8 +411,11 @@ class ContentObjectMixin(TemplateResponseMixin):
         if not getattr(self.object, 'response_processors', None):
             return
 
-        for fn in self.object.response_processors.values():
-            r = fn(self.object, self.request, response)
+        response_processors = self.object.get_processor_pipelines()[1]
+        for name, fn in response_processors:
+            r = timed(
+                self.request, 'response_processor', name,
+                fn, (self.object, self.request, response))
             if r:
                 return r
 
@@ -180,17 +429,20 @@ class ContentObjectMixin(TemplateResponseMixin):
         # did any content type successfully end processing?
         successful = False
 
-        for content in self.object.content.all_of_type(tuple(
-                self.object._feincms_content_types_with_process)):
+        for r, exc_info in self._process_contents(
+                self.object.content.all_of_type(tuple(
+                    self.object._feincms_content_types_with_process))):
 
-            try:
-                r = content.process(self.request, view=self)
-                if r in (True, False):
-                    successful = r
-                elif r:
-                    return r
-            except Http404 as e:
-                http404 = e
+            if exc_info is not None:
+                if isinstance(exc_info[1], Http404):
+                    http404 = exc_info[1]
+                    continue
+                six.reraise(*exc_info)
+
+            if r in (True, False):
+                successful = r
+            elif r:
+                return r
 
         if not successful:
             if http404:
@@ -209,6 +461,86 @@ class ContentObjectMixin(TemplateResponseMixin):
                     self.object,
                 ))
 
+    def _process_contents(self, contents):
+        """
+        Yields ``(result, exc_info)`` tuples of the ``process`` calls of all
+        passed content blocks in their order, stopping as soon as the caller
+        stops iterating.
+
+        Consecutive content blocks of content types setting
+        ``feincms_process_concurrently = True`` are processed concurrently if
+        ``FEINCMS_PROCESS_CONCURRENCY`` allows it and the current request is
+        a ``GET`` or ``HEAD`` request (``ApplicationContent`` sets the flag
+        per application). All other content blocks are always processed
+        sequentially in the request thread.
+        """
+        concurrent = (
+            settings.FEINCMS_PROCESS_CONCURRENCY > 1
+            and self.request.method in ('GET', 'HEAD'))
+
+        batch = []
+        for content in contents:
+            if concurrent and getattr(
+                    content, 'feincms_process_concurrently', False):
+                batch.append(content)
+                continue
+
+            for result in self._process_batch(batch):
+                yield result
+            batch = []
+            yield self._process_content(content, self.request, self)
+
+        for result in self._process_batch(batch):
+            yield result
+
+    def _process_content(self, content, request, view):
+        return call_safely(timed, (
+            request, 'process', content.__class__.__name__,
+            content.process, (request,), {'view': view}))
+
+    def _process_batch(self, contents):
+        if len(contents) < 2:
+            for content in contents:
+                yield self._process_content(content, self.request, self)
+            return
+
+        # The user and the session are loaded lazily, load them now so that
+        # worker threads only read them
+        user = getattr(self.request, 'user', None)
+        getattr(user, 'pk', None)
+        session = getattr(self.request, 'session', None)
+        if session is not None:
+            session.keys()
+
+        # Every content block gets its own shallow copy of the request, the
+        # view and the extra context. Changes to the extra context and the
+        # template name are merged in the order of the content blocks
+        # afterwards.
+        extra_context = self.request._feincms_extra_context
+        views = []
+        calls = []
+        for content in contents:
+            request = copy.copy(self.request)
+            request._feincms_extra_context = dict(extra_context)
+            view = copy.copy(self)
+            view.request = request
+            views.append(view)
+            calls.append((timed, (
+                request, 'process', content.__class__.__name__,
+                content.process, (request,), {'view': view}), {}))
+
+        original = dict(extra_context)
+        results = run_concurrently(
+            calls, settings.FEINCMS_PROCESS_CONCURRENCY)
+        for view, result in zip(views, results):
+            extra_context.update(
+                (key, value)
+                for key, value in view.request._feincms_extra_context.items()
+                if key not in original or original[key] is not value)
+            if view.template_name is not self.template_name:
+                self.template_name = view.template_name
+            yield result
+
     def finalize_content_types(self, response):
         """
         Runs finalize() on content types having such a method, adds headers and
@@ -218,7 +550,9 @@ class ContentObjectMixin(TemplateResponseMixin):
         for content in self.object.content.all_of_type(tuple(
                 self.object._feincms_content_types_with_finalize)):
 
-            r = content.finalize(self.request, response)
+            r = timed(
+                self.request, 'finalize', content.__class__.__name__,
+                content.finalize, (self.request, response))
             if r:
                 return r
 
@@ -12,6 +12,7 @@ from django.core.exceptions import PermissionDenied
 from django.conf import settings as django_settings
 from django.db import models
 from django.db.models import Q
+from django.dispatch import receiver
 from django.http import Http404
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
@@ -23,6 +24,7 @@ from feincms._internal import get_model
 from feincms.models import create_base_model
 from feincms.module.mixins import ContentModelMixin
 from feincms.module.page import processors
+from feincms.signals import subtrees_pre_delete
 from feincms.utils.managers import ActiveAwareContentManagerMixin
 
 from feincms.utils import path_to_cache_key, shorten_string
@@ -306,6 +308,28 @@ class BasePage(create_base_model(MPTTModel), ContentModelMixin):
         self.invalidate_cache()
     delete.alters_data = True
 
+    @classmethod
+    def check_subtree_deletion(cls, queryset):
+        """
+        Raises ``PermissionDenied`` if ``queryset`` contains pages using a
+        singleton template and deleting those is not allowed. Called by
+        ``feincms.utils.tree.delete_subtrees``, which does not go through
+        ``delete()``.
+        """
+        if settings.FEINCMS_SINGLETON_TEMPLATE_DELETION_ALLOWED:
+            return
+
+        singletons = [
+            key for key, template in getattr(
+                cls, '_feincms_templates', {}).items()
+            if template.singleton]
+        if singletons and queryset.filter(
+                template_key__in=singletons).exists():
+            raise PermissionDenied(_(
+                'This %(page_class)s uses a singleton template, and '
+                'FEINCMS_SINGLETON_TEMPLATE_DELETION_ALLOWED=False' % {
+                    'page_class': cls._meta.verbose_name}))
+
     # Remove the page from the url-to-page cache
     def invalidate_cache(self):
         ck = self.path_to_cache_key(self._original_cached_url)
@@ -430,6 +454,20 @@ class BasePage(create_base_model(MPTTModel), ContentModelMixin):
             processors.extra_context_request_processor, key='extra_context')
 
 
+# ------------------------------------------------------------------------
+@receiver(subtrees_pre_delete)
+def _subtrees_pre_delete(sender, pks, **kwargs):
+    """
+    Remove bulk-deleted pages from the url-to-page cache
+    """
+    if not issubclass(sender, BasePage):
+        return
+
+    urls = sender._base_manager.filter(pk__in=pks).values_list(
+        '_cached_url', flat=True)
+    django_cache.delete_many([sender.path_to_cache_key(url) for url in urls])
+
+
 # ------------------------------------------------------------------------
 class Page(BasePage):
     class Meta:
@@ -1,12 +1,25 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import logging
+from random import random
 import re
 import sys
+import threading
+from time import time
+import warnings
 
 from django.conf import settings as django_settings
+from django.core.signals import request_finished
+from django.db import connection
+from django.dispatch import receiver
 from django.http import Http404, HttpResponseRedirect
 
+from feincms._internal import call_last_modified
+from feincms.utils import concurrency
+from feincms.utils.profiling import (
+    Profile, aggregate_sample, debug_cursor_attribute, queries_since,
+    query_log_position, summarize_queries)
+
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +40,9 @@ def redirect_request_processor(page, request):
         raise Http404()
 
 
+redirect_request_processor.response_cache_safe = True
+
+
 def extra_context_request_processor(page, request):
     """
     Fills ``request._feincms_extra_context`` with a few useful variables.
@@ -49,6 +65,9 @@ def extra_context_request_processor(page, request):
         })
 
 
+extra_context_request_processor.response_cache_safe = True
+
+
 def etag_request_processor(page, request):
     """
     Short-circuits the request-response cycle if the ETag matches.
@@ -73,7 +92,7 @@ def etag_request_processor(page, request):
         return etag
 
     def lastmodifier(request, page, *args, **kwargs):
-        lm = page.last_modified()
+        lm = call_last_modified(page, request)
         return lm
 
     # Unavailable in Django 1.0 -- the current implementation of ETag support
@@ -93,6 +112,9 @@ def etag_request_processor(page, request):
         return rsp
 
 
+etag_request_processor.response_cache_safe = True
+
+
 def etag_response_processor(page, request, response):
     """
     Response processor to set an etag header on outgoing responses.
@@ -104,6 +126,9 @@ def etag_response_processor(page, request, response):
         response['ETag'] = '"' + etag + '"'
 
 
+etag_response_processor.response_cache_safe = True
+
+
 def debug_sql_queries_response_processor(verbose=False, file=sys.stderr):
     """
     Attaches a handler which prints the query count (and optionally all
@@ -116,7 +141,15 @@ def debug_sql_queries_response_processor(verbose=False, file=sys.stderr):
         models.Page.register_response_processor(
             processors.debug_sql_queries_response_processor(verbose=True),
             )
+
+    Deprecated, use ``sampling_profiler_request_processor`` and
+    ``sampling_profiler_response_processor`` instead.
     """
+    warnings.warn(
+        'debug_sql_queries_response_processor has been deprecated and will'
+        ' be removed in a future release. Use the sampling profiler'
+        ' processors instead.', DeprecationWarning, stacklevel=2)
+
     if not django_settings.DEBUG:
         return lambda page, request, response: None
 
@@ -149,3 +182,96 @@ def debug_sql_queries_response_processor(verbose=False, file=sys.stderr):
         print("-" * 60, file=file)
 
     return processor
+
+
+# ------------------------------------------------------------------------
+# The value of the debug cursor attribute of the connection of the current
+# thread before sampling started
+_sampling = threading.local()
+
+
+@receiver(request_finished)
+def _restore_debug_cursor(**kwargs):
+    """
+    Stops logging queries after a sampled request, also if the response
+    processors did not run (f.e. because a request processor returned a
+    response or an exception occurred).
+    """
+    debug_cursor = getattr(_sampling, 'debug_cursor', None)
+    if debug_cursor is not None:
+        setattr(connection, debug_cursor_attribute(connection), debug_cursor)
+        _sampling.debug_cursor = None
+        concurrency.collect_queries(None)
+
+
+def sampling_profiler_request_processor(sample_rate=0.01):
+    """
+    Returns a request processor which profiles a random sample of the
+    requests, even if ``DEBUG = False``: Query count, total database time,
+    duplicate queries, the time taken to render content blocks and to render
+    the template are aggregated per page template in Django's cache. Use
+    the ``feincms_profile`` management command to look at the results.
+
+    Has to be registered after all other request processors (they are run
+    in reverse order of registration) together with
+    ``sampling_profiler_response_processor``, which has to be registered
+    last::
+
+        from feincms.module.page import models, processors
+        models.Page.register_request_processor(
+            processors.sampling_profiler_request_processor(sample_rate=0.05),
+            key='sampling_profiler')
+        models.Page.register_response_processor(
+            processors.sampling_profiler_response_processor,
+            key='sampling_profiler')
+    """
+
+    def processor(page, request):
+        if random() >= sample_rate:
+            return
+
+        attribute = debug_cursor_attribute(connection)
+        if getattr(_sampling, 'debug_cursor', None) is None:
+            _sampling.debug_cursor = getattr(connection, attribute)
+        request._feincms_sample = {
+            'position': query_log_position(connection),
+            'worker_queries': [],
+        }
+        setattr(connection, attribute, True)
+        concurrency.collect_queries(request._feincms_sample['worker_queries'])
+
+        if getattr(request, '_feincms_profile', None) is None:
+            request._feincms_profile = Profile()
+
+    return processor
+
+
+def sampling_profiler_response_processor(page, request, response):
+    """
+    Aggregates the profile of requests sampled by
+    ``sampling_profiler_request_processor`` after the response has been
+    rendered.
+    """
+    sample = getattr(request, '_feincms_sample', None)
+    if sample is None:
+        return
+
+    template_start = time()
+
+    def _record(response):
+        template_time = time() - template_start
+        _restore_debug_cursor()
+
+        data = summarize_queries(
+            queries_since(connection, sample['position']) +
+            sample['worker_queries'])
+        data['render_time'] = sum(
+            seconds for kind, name, seconds in request._feincms_profile.timings
+            if kind == 'render')
+        data['template_time'] = template_time
+        aggregate_sample(page.template.key, data)
+
+    if getattr(response, 'is_rendered', True):
+        _record(response)
+    else:
+        response.add_post_render_callback(_record)
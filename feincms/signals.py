@@ -18,3 +18,13 @@ from django.dispatch import Signal
 itemeditor_post_save_related = Signal(providing_args=["instance", "created"])
 
 # ------------------------------------------------------------------------
+# These signals are sent once per call to
+# ``feincms.utils.tree.delete_subtrees`` instead of the per-row
+# ``pre_delete`` and ``post_delete`` signals for tree nodes, their content
+# blocks and rows cascading from them. ``pks`` is the list of primary keys
+# of all deleted tree nodes.
+
+subtrees_pre_delete = Signal(providing_args=["pks"])
+subtrees_post_delete = Signal(providing_args=["pks"])
+
+# ------------------------------------------------------------------------
@@ -60,16 +60,18 @@
         var insert_after = $("<input>").attr("type", "button").addClass("button").attr("value", feincms_gettext('After')).click(function(){
             var modvar = select_content.val();
             var modname = select_content.find("option:selected").html();
-            var new_fieldset = create_new_fieldset_from_module(modvar, modname);
-            add_fieldset(target_region_id, new_fieldset, {where:'insertAfter', relative_to:item, animate:true});
-            update_item_controls(new_fieldset, target_region_id);
+            create_new_fieldset_from_module(modvar, modname, function(new_fieldset) {
+                add_fieldset(target_region_id, new_fieldset, {where:'insertAfter', relative_to:item, animate:true});
+                update_item_controls(new_fieldset, target_region_id);
+            });
         });
         var insert_before = $("<input>").attr("type", "button").addClass("button").attr("value", feincms_gettext('Before')).click(function(){
             var modvar = select_content.val();
             var modname = select_content.find("option:selected").html();
-            var new_fieldset = create_new_fieldset_from_module(modvar, modname);
-            add_fieldset(target_region_id, new_fieldset, {where:'insertBefore', relative_to:item, animate:true});
-            update_item_controls(new_fieldset, target_region_id);
+            create_new_fieldset_from_module(modvar, modname, function(new_fieldset) {
+                add_fieldset(target_region_id, new_fieldset, {where:'insertBefore', relative_to:item, animate:true});
+                update_item_controls(new_fieldset, target_region_id);
+            });
         });
         insert_control.append("<span>" + feincms_gettext('Insert new:') + "</span>").append(" ").append(select_content).append(" ").append(insert_before).append(insert_after);
         control_units.append(insert_control);
@@ -120,9 +122,11 @@
     }
 
 
-    function create_new_fieldset_from_module(modvar, modname) {
-        var new_form = create_new_spare_form(modvar);
-        return create_new_item_from_form(new_form, modname, modvar);
+    function create_new_fieldset_from_module(modvar, modname, callback) {
+        // The form may have to be loaded first, see load_lazy_inline
+        create_new_spare_form(modvar, function(new_form) {
+            callback(create_new_item_from_form(new_form, modname, modvar));
+        });
     }
 
     function add_fieldset(region_id, item, how){
@@ -168,7 +172,61 @@
         }
     }
 
-    function create_new_spare_form(modvar) {
+    function init_inline_fields(elem) {
+        elem.find("input[name$=-region]").addClass("region-choice-field");
+        elem.find("input[name$=-DELETE]").addClass("delete-field");
+        elem.find("input[name$=-ordering]").addClass("order-field");
+    }
+
+    function load_lazy_inline(group, callback) {
+        // The inline of a content type without any content blocks is only
+        // rendered as a placeholder. Fetch the real inline and call
+        // callback once it has been inserted. Callbacks of clicks arriving
+        // while the inline is loading are queued.
+        var callbacks = group.data('callbacks');
+        if (callbacks) {
+            callbacks.push(callback);
+            return;
+        }
+        callbacks = [callback];
+        group.data('callbacks', callbacks);
+
+        $.ajax({
+            url: group.data('url'),
+            cache: false,
+            success: function(html) {
+                var id = group.attr('id');
+                group.replaceWith(html);
+                var new_group = $('#' + id);
+                new_group.find('div.inline-related').each(function() {
+                    init_inline_fields($(this));
+                });
+                hide_form_rows_with_hidden_widgets(new_group);
+                new_group.hide();
+
+                for (var i=0; i<callbacks.length; i++)
+                    callbacks[i]();
+            },
+            error: function() {
+                group.removeData('callbacks');
+                window.alert(feincms_gettext('Loading the content type failed, please try again.'));
+            }
+        });
+    }
+
+    function create_new_spare_form(modvar, callback) {
+        var group = $('#'+modvar+'_set-group');
+        if (group.hasClass('feincms_lazy_inline')) {
+            load_lazy_inline(group, function() {
+                callback(spawn_spare_form(modvar));
+            });
+        }
+        else {
+            callback(spawn_spare_form(modvar));
+        }
+    }
+
+    function spawn_spare_form(modvar) {
         var old_form_count = parseInt($('#id_'+modvar+'_set-TOTAL_FORMS').val(), 10);
         // **** UGLY CODE WARNING, avert your gaze! ****
         // for some unknown reason, the add-button click handler function
@@ -263,12 +321,12 @@
             contentblock_init_handlers[i]();
     }
 
-    function hide_form_rows_with_hidden_widgets(){
+    function hide_form_rows_with_hidden_widgets(groups){
         /* This is not normally done in django -- the fields are shown
            with visible labels and invisible widgets, but FeinCMS used to
            use custom form rendering to hide rows for hidden fields.
            This is an attempt to preserve that behaviour. */
-        $('div.feincms_inline div.form-row').each(function(){
+        (groups || $('div.feincms_inline')).find('div.form-row').each(function(){
             var child_count = $(this).find('*').length;
             var invisible_types = 'div, label, input[type=hidden], p.help';
             var invisible_count = $(this).find(invisible_types).length;
@@ -412,9 +470,11 @@
                 return;
 
             var modname = select_content.find("option:selected").html();
-            var new_fieldset = create_new_fieldset_from_module(modvar, modname);
-            add_fieldset(ACTIVE_REGION, new_fieldset, {where:'append', animate:true});
-            update_item_controls(new_fieldset, ACTIVE_REGION);
+            var region_id = ACTIVE_REGION;
+            create_new_fieldset_from_module(modvar, modname, function(new_fieldset) {
+                add_fieldset(region_id, new_fieldset, {where:'append', animate:true});
+                update_item_controls(new_fieldset, region_id);
+            });
         });
 
         $(document.body).on('click', 'h2 img.item-delete', function() {
@@ -536,9 +596,7 @@
                 return;
             }
 
-            elem.find("input[name$=-region]").addClass("region-choice-field");
-            elem.find("input[name$=-DELETE]").addClass("delete-field");
-            elem.find("input[name$=-ordering]").addClass("order-field");
+            init_inline_fields(elem);
 
             if (!elem.hasClass("empty-form")){
                 var region_id = REGION_MAP.indexOf(
@@ -615,15 +673,23 @@
 
     // externally accessible helpers
     window.ItemEditor = {
-        add_content: function(type, region) {
-            var new_fieldset = create_new_fieldset_from_module(type, CONTENT_NAMES[type]);
-            add_fieldset(region, new_fieldset, {where: 'append', animate: 'true'});
-            update_item_controls(new_fieldset, region);
-            return new_fieldset;
+        add_content: function(type, region, callback) {
+            // Returns the new fieldset if it could be created right away.
+            // Forms of lazily loaded inlines arrive later, pass a callback
+            // to receive the new fieldset in any case.
+            var result;
+            create_new_fieldset_from_module(type, CONTENT_NAMES[type], function(new_fieldset) {
+                add_fieldset(region, new_fieldset, {where: 'append', animate: 'true'});
+                update_item_controls(new_fieldset, region);
+                result = new_fieldset;
+                if (callback)
+                    callback(new_fieldset);
+            });
+            return result;
         },
 
-        add_content_to_current: function(type) {
-            return ItemEditor.add_content(type, ACTIVE_REGION);
+        add_content_to_current: function(type, callback) {
+            return ItemEditor.add_content(type, ACTIVE_REGION, callback);
         }
     };
 
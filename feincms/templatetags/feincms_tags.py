@@ -4,41 +4,118 @@
 
 from __future__ import absolute_import, unicode_literals
 
+from copy import copy
 import logging
+import threading
 
 from django import template
 from django.conf import settings
+from django.utils import six
 from django.utils.safestring import mark_safe
 
+from feincms import settings as feincms_settings
 from feincms.utils import get_singleton, get_singleton_url
+from feincms.utils.concurrency import run_concurrently
+from feincms.utils.profiling import timed
 
 
 register = template.Library()
 
 
+# Render levels of requests whose content blocks are rendered in a worker
+# thread are tracked per thread, because the blocks of one region must not
+# see each other's level.
+_local = threading.local()
+
+
+def _get_render_level(request):
+    if getattr(_local, 'request', None) is request:
+        return _local.render_level
+    return getattr(request, 'feincms_render_level', 0)
+
+
+def _set_render_level(request, level):
+    if getattr(_local, 'request', None) is request:
+        _local.render_level = level
+    else:
+        setattr(request, 'feincms_render_level', level)
+
+
 def _render_content(content, **kwargs):
     # Track current render level and abort if we nest too deep. Avoids
     # crashing in recursive page contents (eg. a page list that contains
     # itself or similar).
     request = kwargs.get('request')
     if request is not None:
-        level = getattr(request, 'feincms_render_level', 0)
+        level = _get_render_level(request)
         if level > 10:
             logging.getLogger('feincms').error(
                 'Refusing to render %r, render level is already %s' % (
                     content, level))
             return
-        setattr(request, 'feincms_render_level', level + 1)
+        _set_render_level(request, level + 1)
 
-    r = content.render(**kwargs)
+    r = timed(
+        request, 'render', content.__class__.__name__,
+        content.render, kwargs=kwargs)
 
     if request is not None:
-        level = getattr(request, 'feincms_render_level', 1)
-        setattr(request, 'feincms_render_level', max(level - 1, 0))
+        level = _get_render_level(request)
+        _set_render_level(request, max(level - 1, 0))
 
     return r
 
 
+def _render_content_in_thread(level, content, **kwargs):
+    # Runs in a worker thread: Starts at the render level of the thread
+    # rendering the region and uses a copy of the template context, because
+    # rendering pushes and pops the context.
+    request = kwargs.get('request')
+    if kwargs.get('context') is not None:
+        kwargs['context'] = copy(kwargs['context'])
+
+    _local.request, _local.render_level = request, level
+    try:
+        return _render_content(content, **kwargs)
+    finally:
+        _local.request = _local.render_level = None
+
+
+def _render_region(contents, request, context):
+    """
+    Renders all content blocks and joins the output in order. Blocks of
+    content types setting ``feincms_render_concurrently = True`` are rendered
+    in a thread pool if ``FEINCMS_RENDER_CONCURRENCY`` allows it.
+    """
+    concurrent = [
+        index for index, content in enumerate(contents)
+        if getattr(content, 'feincms_render_concurrently', False)]
+    max_workers = feincms_settings.FEINCMS_RENDER_CONCURRENCY
+
+    if len(concurrent) < 2 or max_workers < 2:
+        return ''.join(
+            '%s' % (_render_content(
+                content, request=request, context=context) or '')
+            for content in contents)
+
+    level = _get_render_level(request) if request is not None else 0
+    results = dict(zip(concurrent, run_concurrently([
+        (_render_content_in_thread, (level, contents[index]), {
+            'request': request, 'context': context})
+        for index in concurrent], max_workers)))
+
+    output = []
+    for index, content in enumerate(contents):
+        if index in results:
+            r, exc_info = results[index]
+            if exc_info is not None:
+                six.reraise(*exc_info)
+        else:
+            r = _render_content(content, request=request, context=context)
+        output.append('%s' % (r or ''))
+    return ''.join(output)
+
+
 @register.simple_tag(takes_context=True)
 def feincms_render_region(context, feincms_object, region, request=None):
     """
@@ -47,9 +124,8 @@ def feincms_render_region(context, feincms_object, region, request=None):
     if not feincms_object:
         return ''
 
-    return mark_safe(''.join(
-        _render_content(content, request=request, context=context)
-        for content in getattr(feincms_object.content, region)))
+    return mark_safe(_render_region(
+        getattr(feincms_object.content, region), request, context))
 
 
 @register.simple_tag(takes_context=True)
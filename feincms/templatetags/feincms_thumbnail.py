@@ -4,43 +4,107 @@
 
 from __future__ import absolute_import, unicode_literals
 
+from contextlib import contextmanager
+import hashlib
 from io import BytesIO
+import json
 import logging
 from PIL import Image
+import posixpath
 import re
+from tempfile import SpooledTemporaryFile
 
 from django import template
-from django.utils.encoding import force_text, python_2_unicode_compatible
+from django.utils.encoding import (
+    force_bytes, force_text, python_2_unicode_compatible)
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.core.files.base import File
 from django.utils import six
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 
 from feincms import settings
+from feincms.utils import thumbnails
+from feincms.utils.concurrency import run_concurrently
 
 
 logger = logging.getLogger('feincms.templatetags.thumbnail')
 register = template.Library()
 
+#: Encoded thumbnails larger than this are spooled to disk before saving them
+THUMBNAIL_SPOOL_SIZE = 1024 * 1024
+
+#: File extensions and MIME types of the supported output formats
+THUMBNAIL_FORMATS = {
+    'avif': ('avif', 'image/avif'),
+    'jpeg': ('jpg', 'image/jpeg'),
+    'png': ('png', 'image/png'),
+    'webp': ('webp', 'image/webp'),
+}
+
+
+def format_supported(format):
+    """
+    Returns ``True`` if the installed PIL can write ``format``.
+    """
+    Image.init()
+    return format in THUMBNAIL_FORMATS and format.upper() in Image.SAVE
+
+
+def _close(image):
+    # Image.close() only exists in newer versions of Pillow
+    if hasattr(image, 'close'):
+        image.close()
+
 
 @python_2_unicode_compatible
 class Thumbnailer(object):
     THUMBNAIL_SIZE_RE = re.compile(r'^(?P<w>\d+)x(?P<h>\d+)$')
     MARKER = '_thumb_'
 
-    def __init__(self, filename, size='200x200'):
+    def __init__(self, filename, size='200x200', format=None, options=None):
         self.filename = filename
         self.size = size
+        #: Output format (see ``THUMBNAIL_FORMATS``). Thumbnails are saved in
+        #: the format of the original (or as JPEG) if not set.
+        self.format = format
+        #: Encoder options, added to ``FEINCMS_THUMBNAIL_FORMAT_OPTIONS``
+        self.options = options or {}
+
+    def copy(self, size):
+        """
+        Returns a thumbnailer for the same file, format and options, but a
+        different size.
+        """
+        return self.__class__(
+            self.filename, size, format=self.format, options=self.options)
+
+    def get_options(self):
+        """
+        Returns the encoder options for the output format.
+        """
+        options = dict(
+            settings.FEINCMS_THUMBNAIL_FORMAT_OPTIONS.get(self.format, {}))
+        options.update(self.options)
+        return options
 
     @property
     def url(self):
         return six.text_type(self)
 
     def __str__(self):
+        return self.get_url(defer=bool(settings.FEINCMS_THUMBNAIL_QUEUE))
+
+    def resolve(self):
+        """
+        Returns a ``(storage, filename, miniature, size)`` tuple, where
+        ``size`` is a dictionary containing the values matched by
+        ``THUMBNAIL_SIZE_RE``, or ``None`` if there is no file or the size
+        is invalid. Does not access the storage.
+        """
         match = self.THUMBNAIL_SIZE_RE.match(self.size)
         if not (self.filename and match):
-            return ''
-
-        matches = match.groupdict()
+            return None
 
         # figure out storage
         if hasattr(self.filename, 'storage'):
@@ -60,29 +124,56 @@ class Thumbnailer(object):
         except ValueError:
             basename, format = filename, 'jpg'
 
+        suffix = ''
+        if self.format:
+            # Different encoder options lead to different files. The options
+            # are serialized the same way on all Python versions.
+            format = THUMBNAIL_FORMATS[self.format][0]
+            suffix = '-%s' % hashlib.md5(force_bytes(json.dumps(
+                self.get_options(), sort_keys=True))).hexdigest()[:8]
+
         miniature = ''.join([
             settings.FEINCMS_THUMBNAIL_DIR,
             basename,
             self.MARKER,
             self.size,
+            suffix,
             '.',
             format,
         ])
 
-        if not storage.exists(miniature):
+        return storage, filename, miniature, match.groupdict()
+
+    def get_url(self, defer=False, force=False):
+        """
+        Returns the URL of the thumbnail, generating it first if it does not
+        exist yet or is outdated. If ``defer`` is ``True``, the generation is
+        left to the ``generate_thumbnails`` management command instead and
+        the URL of the original is returned in the meantime. ``force``
+        regenerates the thumbnail in any case.
+        """
+        resolved = self.resolve()
+        if resolved is None:
+            return ''
+        storage, filename, miniature, matches = resolved
+
+        if force:
             generate = True
+        elif thumbnails.is_registered(filename, miniature, storage):
+            return storage.url(miniature)
         else:
             try:
-                generate = (
-                    storage.modified_time(miniature)
-                    < storage.modified_time(filename))
-            except (NotImplementedError, AttributeError):
-                # storage does NOT support modified_time
-                generate = False
+                generate = not self.is_current(storage, filename, miniature)
             except (OSError, IOError):
                 # Someone might have delete the file
                 return ''
 
+        if generate and defer:
+            thumbnails.enqueue(
+                self.__class__, storage, filename, self.size,
+                self.format, self.options)
+            return storage.url(filename)
+
         if generate:
             try:
                 self.generate(
@@ -101,29 +192,218 @@ class Thumbnailer(object):
                 # happen, catch them all so the thumbnailer will never fail.
                 return storage.url(filename)
 
+        thumbnails.register(filename, miniature, storage=storage)
         return storage.url(miniature)
 
+    def is_current(self, storage, original, miniature):
+        """
+        Returns ``True`` if ``miniature`` exists and is not older than
+        ``original``.
+        """
+        if not storage.exists(miniature):
+            return False
+        try:
+            return (
+                storage.modified_time(miniature)
+                >= storage.modified_time(original))
+        except (NotImplementedError, AttributeError):
+            # storage does NOT support modified_time
+            return True
+
     def generate(self, storage, original, size, miniature):
-        with storage.open(original) as original_handle:
-            with BytesIO(original_handle.read()) as original_bytes:
-                image = Image.open(original_bytes)
+        with self.open_image(storage, original) as image:
+            # defining the size
+            w, h = int(size['w']), int(size['h'])
+
+            format = image.format  # Save format for the save() call later
+            image.thumbnail([w, h], Image.ANTIALIAS)
+            self.save_image(storage, image, format, miniature)
+
+    def prepare(self, image, size):
+        """
+        Lets JPEG images be downscaled while decoding, as far as possible
+        for generating a thumbnail of ``size``. Has to be called before the
+        image data is loaded.
+        """
+        image.draft(image.mode, (int(size['w']), int(size['h'])))
+
+    def transform(self, image, size):
+        """
+        Returns a new image containing the thumbnail of ``image``.
+        """
+        image = image.copy()
+        image.thumbnail([int(size['w']), int(size['h'])], Image.ANTIALIAS)
+        return image
+
+    def expected_size(self, original_size, size):
+        """
+        Returns the size of a thumbnail of an image of ``original_size``.
+        """
+        src_width, src_height = original_size
+        scale = min(
+            float(size['w']) / src_width, float(size['h']) / src_height, 1)
+        return (
+            max(int(round(src_width * scale)), 1),
+            max(int(round(src_height * scale)), 1))
+
+    #: Thumbnails of smaller sizes may be created from thumbnails of larger
+    #: sizes, see ``get_srcset``
+    DERIVE_SMALLER_SIZES = True
+
+    def get_srcset(self, sizes, defer=False):
+        """
+        Returns a ``srcset`` attribute value containing thumbnails of all
+        ``sizes`` (f.e. ``['400x400', '800x800', '1600x1600']``), described
+        by their widths.
+
+        Missing thumbnails are generated together from a single decode of
+        the original, smaller thumbnails from larger ones where possible.
+        The result is remembered in the thumbnail registry. If ``defer`` is
+        ``True``, missing thumbnails are queued and the original is used in
+        the meantime.
+        """
+        resolved = [
+            item for item in (
+                self.copy(size).resolve()
+                for size in sizes)
+            if item is not None]
+        if not resolved:
+            return ''
 
-                # defining the size
-                w, h = int(size['w']), int(size['h'])
+        storage, filename = resolved[0][:2]
+        key = 'srcset:%s' % ','.join(item[2] for item in resolved)
+        srcset = thumbnails.lookup(filename, key, storage)
+        if srcset:
+            return srcset
 
-                format = image.format  # Save format for the save() call later
-                image.thumbnail([w, h], Image.ANTIALIAS)
-                buf = BytesIO()
-                if image.mode not in ('RGBA', 'RGB', 'L'):
-                    image = image.convert('RGBA')
-                if format.lower() not in ('jpg', 'jpeg', 'png'):
-                    format = 'jpeg'
-                image.save(buf, format, quality=90)
-                raw_data = buf.getvalue()
-                buf.close()
+        try:
+            with self.open_image(storage, filename) as image:
+                original_size = image.size
+                missing = [
+                    item for item in resolved
+                    if not self.is_current(storage, filename, item[2])]
+
+                if missing and defer:
+                    for item in missing:
+                        thumbnails.enqueue(
+                            self.__class__, storage, filename,
+                            self.size_string(item[3]), self.format,
+                            self.options)
+                    return '%s %sw' % (storage.url(filename), image.size[0])
+
+                if missing:
+                    self.generate_variants(storage, image, missing)
+        except Exception as exc:
+            logger.warning(
+                'Rendering a thumbnail failed: %r',
+                exc,
+                exc_info=True,
+                extra={'stack': True, 'exception': exc})
+            return ''
 
-                storage.delete(miniature)
-                storage.save(miniature, ContentFile(raw_data))
+        for item in resolved:
+            thumbnails.register(filename, item[2], storage=storage)
+        srcset = ', '.join(
+            '%s %sw' % (
+                storage.url(miniature),
+                self.expected_size(original_size, size)[0])
+            for _storage, _filename, miniature, size in resolved)
+        thumbnails.register(filename, key, srcset, storage)
+        return srcset
+
+    def generate_variants(self, storage, image, variants):
+        """
+        Generates the thumbnails for all ``(storage, original, miniature,
+        size)`` tuples in ``variants`` from the opened ``image``, largest
+        first.
+        """
+        format = image.format  # Save format for the save() call later
+        original_size = image.size
+        variants = sorted(
+            variants,
+            key=lambda item: self.expected_size(original_size, item[3]),
+            reverse=True)
+
+        self.prepare(image, variants[0][3])
+        source = image
+        for _storage, _original, miniature, size in variants:
+            variant = self.transform(source, size)
+            self.save_image(storage, variant, format, miniature)
+            if self.DERIVE_SMALLER_SIZES:
+                source = variant
+
+    def size_string(self, size):
+        return '%(w)sx%(h)s' % size
+
+    @contextmanager
+    def open_image(self, storage, original):
+        """
+        Opens the original without reading it into memory first where
+        possible: Files of local storages are opened by path, files of other
+        storages are read directly from the storage's file object if it is
+        seekable.
+        """
+        try:
+            path = storage.path(original)
+        except (NotImplementedError, AttributeError):
+            path = None
+
+        if path:
+            image = Image.open(path)
+            try:
+                yield image
+            finally:
+                _close(image)
+            return
+
+        with storage.open(original) as handle:
+            try:
+                handle.seek(0)
+            except (AttributeError, IOError, OSError, ValueError):
+                handle = BytesIO(handle.read())
+            image = Image.open(handle)
+            try:
+                yield image
+            finally:
+                _close(image)
+
+    def save_image(self, storage, image, format, miniature):
+        """
+        Encodes ``image`` into a temporary file, which is only held in memory
+        while it is small, and saves it as ``miniature``.
+        """
+        if image.mode not in ('RGBA', 'RGB', 'L'):
+            image = image.convert('RGBA')
+
+        if self.format:
+            format = self.format
+            options = self.get_options()
+            if format == 'jpeg' and image.mode == 'RGBA':
+                image = image.convert('RGB')
+            colors = options.pop('colors', None)
+            if format == 'png' and colors:
+                # Quantize to a palette of ``colors`` colors using fast
+                # octree for RGBA and median cut otherwise. The method has
+                # to be passed explicitly, old Pillow versions neither accept
+                # None nor quantize RGBA images by default.
+                try:
+                    image = image.quantize(
+                        colors, 2 if image.mode == 'RGBA' else 0)
+                except ValueError:  # Method not supported by this Pillow
+                    logger.warning(
+                        'Cannot quantize %s image %s, saving it as is',
+                        image.mode, miniature)
+        else:
+            options = {'quality': 90}
+            if format.lower() not in ('jpg', 'jpeg', 'png'):
+                format = 'jpeg'
+
+        with SpooledTemporaryFile(max_size=THUMBNAIL_SPOOL_SIZE) as buf:
+            image.save(buf, format, **options)
+            buf.seek(0)
+            thumbnails.unregister([miniature])
+            storage.delete(miniature)
+            storage.save(miniature, File(buf))
 
 
 class CropscaleThumbnailer(Thumbnailer):
@@ -131,53 +411,65 @@ class CropscaleThumbnailer(Thumbnailer):
         r'^(?P<w>\d+)x(?P<h>\d+)(-(?P<x>\d+)x(?P<y>\d+))?$')
     MARKER = '_cropscale_'
 
+    #: Thumbnails are cropped differently depending on their aspect ratio
+    DERIVE_SMALLER_SIZES = False
+
     def generate(self, storage, original, size, miniature):
-        with storage.open(original) as original_handle:
-            with BytesIO(original_handle.read()) as original_bytes:
-                image = Image.open(original_bytes)
-
-                w, h = int(size['w']), int(size['h'])
-
-                if size['x'] and size['y']:
-                    x, y = int(size['x']), int(size['y'])
-                else:
-                    x, y = 50, 50
-
-                src_width, src_height = image.size
-                src_ratio = float(src_width) / float(src_height)
-                dst_width, dst_height = w, h
-                dst_ratio = float(dst_width) / float(dst_height)
-
-                if dst_ratio < src_ratio:
-                    crop_height = src_height
-                    crop_width = crop_height * dst_ratio
-                    x_offset = int(float(src_width - crop_width) * x / 100)
-                    y_offset = 0
-                else:
-                    crop_width = src_width
-                    crop_height = crop_width / dst_ratio
-                    x_offset = 0
-                    y_offset = int(float(src_height - crop_height) * y / 100)
-
-                format = image.format  # Save format for the save() call later
-                image = image.crop((
-                    x_offset,
-                    y_offset,
-                    x_offset + int(crop_width),
-                    y_offset + int(crop_height)))
-                image = image.resize((dst_width, dst_height), Image.ANTIALIAS)
-
-                buf = BytesIO()
-                if image.mode not in ('RGBA', 'RGB', 'L'):
-                    image = image.convert('RGBA')
-                if format.lower() not in ('jpg', 'jpeg', 'png'):
-                    format = 'jpeg'
-                image.save(buf, format, quality=90)
-                raw_data = buf.getvalue()
-                buf.close()
-
-                storage.delete(miniature)
-                storage.save(miniature, ContentFile(raw_data))
+        with self.open_image(storage, original) as image:
+            format = image.format  # Save format for the save() call later
+            self.prepare(image, size)
+            image = self.transform(image, size)
+            self.save_image(storage, image, format, miniature)
+
+    def prepare(self, image, size):
+        # Let JPEG images be downscaled while decoding, as long as the
+        # cropped area stays larger than the requested size.
+        w, h = int(size['w']), int(size['h'])
+        src_width, src_height = image.size
+        scale = max(float(w) / src_width, float(h) / src_height)
+        if scale < 1:
+            image.draft(image.mode, (
+                int(src_width * scale) + 1,
+                int(src_height * scale) + 1))
+
+    def transform(self, image, size):
+        w, h = int(size['w']), int(size['h'])
+
+        if size['x'] and size['y']:
+            x, y = int(size['x']), int(size['y'])
+        else:
+            x, y = 50, 50
+
+        src_width, src_height = image.size
+        src_ratio = float(src_width) / float(src_height)
+        dst_width, dst_height = w, h
+        dst_ratio = float(dst_width) / float(dst_height)
+
+        if dst_ratio < src_ratio:
+            crop_height = src_height
+            crop_width = crop_height * dst_ratio
+            x_offset = int(float(src_width - crop_width) * x / 100)
+            y_offset = 0
+        else:
+            crop_width = src_width
+            crop_height = crop_width / dst_ratio
+            x_offset = 0
+            y_offset = int(float(src_height - crop_height) * y / 100)
+
+        image = image.crop((
+            x_offset,
+            y_offset,
+            x_offset + int(crop_width),
+            y_offset + int(crop_height)))
+        return image.resize((dst_width, dst_height), Image.ANTIALIAS)
+
+    def expected_size(self, original_size, size):
+        return int(size['w']), int(size['h'])
+
+    def size_string(self, size):
+        if size['x'] and size['y']:
+            return '%(w)sx%(h)s-%(x)sx%(y)s' % size
+        return '%(w)sx%(h)s' % size
 
 
 @register.filter
@@ -205,6 +497,52 @@ def thumbnail(filename, size='200x200'):
     return Thumbnailer(filename, size)
 
 
+@register.filter
+def thumbnail_srcset(filename, sizes):
+    """
+    Returns a ``srcset`` containing thumbnails of all comma-separated
+    sizes::
+
+        <img src="{{ image|thumbnail:"400x400" }}"
+            srcset="{{ image|thumbnail_srcset:"400x400,800x800,1600x1600" }}">
+    """
+
+    return Thumbnailer(filename).get_srcset(
+        sizes.split(','), defer=bool(settings.FEINCMS_THUMBNAIL_QUEUE))
+
+
+@register.filter
+def cropscale_srcset(filename, sizes):
+    """
+    Same as ``thumbnail_srcset``, for cropscaled thumbnails.
+    """
+
+    return CropscaleThumbnailer(filename).get_srcset(
+        sizes.split(','), defer=bool(settings.FEINCMS_THUMBNAIL_QUEUE))
+
+
+@register.filter
+def thumbnail_preset(filename, preset):
+    """
+    Returns the thumbnail for the preset named ``preset`` in
+    ``FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS``::
+
+        {{ mediafile.file|thumbnail_preset:"teaser" }}
+    """
+
+    return get_preset_thumbnailer(filename, preset)
+
+
+def get_preset_thumbnailer(filename, preset):
+    options = dict(settings.FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS[preset])
+    size = options.pop('size')
+    thumbnailer_class = (
+        CropscaleThumbnailer if options.pop('mode', None) == 'cropscale'
+        else Thumbnailer)
+    format = options.pop('format', None)
+    return thumbnailer_class(filename, size, format=format, options=options)
+
+
 @register.filter
 def cropscale(filename, size='200x200'):
     """
@@ -213,3 +551,158 @@ def cropscale(filename, size='200x200'):
     """
 
     return CropscaleThumbnailer(filename, size)
+
+
+def get_thumbnail_urls(files, size='200x200', thumbnailer_class=None):
+    """
+    Returns the thumbnail URLs of all ``files`` (media files, ``ImageField``
+    or ``FileField`` values or names) at once, in order:
+
+    * Looks up all thumbnails in the registry using one cache access per
+      storage.
+    * Lists the thumbnail directory once per storage and directory for the
+      rest, if the storage supports listing directories. Thumbnails found
+      this way are not compared to the modification time of the original.
+    * Generates the missing thumbnails in ``FEINCMS_THUMBNAIL_WORKERS``
+      parallel threads (or queues them if ``FEINCMS_THUMBNAIL_QUEUE`` is
+      set).
+    """
+    thumbnailer_class = thumbnailer_class or Thumbnailer
+    thumbnailers = [
+        thumbnailer_class(_file(item), size) for item in files]
+    resolved = [thumbnailer.resolve() for thumbnailer in thumbnailers]
+    by_storage = {}
+    for item in resolved:
+        if item is not None:
+            by_storage.setdefault(id(item[0]), (item[0], []))[1].append(
+                item[1:3])
+    known = set()
+    for storage, pairs in by_storage.values():
+        known.update(thumbnails.registered(pairs, storage))
+
+    urls = [''] * len(thumbnailers)
+    listings = {}
+    missing = []
+    for index, item in enumerate(resolved):
+        if item is None:
+            continue
+
+        storage, filename, miniature, matches = item
+        if miniature in known:
+            urls[index] = storage.url(miniature)
+            continue
+
+        directory, name = posixpath.split(miniature)
+        key = (id(storage), directory)
+        if key not in listings:
+            listings[key] = _listdir(storage, directory)
+
+        if listings[key] is None:
+            missing.append((index, False))
+        elif name in listings[key]:
+            thumbnails.register(filename, miniature, storage=storage)
+            urls[index] = storage.url(miniature)
+        else:
+            missing.append((index, True))
+
+    results = run_concurrently([
+        (thumbnailers[index].get_url, (), {
+            'defer': bool(settings.FEINCMS_THUMBNAIL_QUEUE),
+            'force': force})
+        for index, force in missing], settings.FEINCMS_THUMBNAIL_WORKERS)
+
+    for (index, force), (url, exc_info) in zip(missing, results):
+        if exc_info is None:
+            urls[index] = url
+
+    return urls
+
+
+def _file(item):
+    # Media files have a file attribute, but so do field files
+    if hasattr(item, 'storage') or not hasattr(item, 'file'):
+        return item
+    return item.file
+
+
+def _listdir(storage, directory):
+    """
+    Returns the set of file names in ``directory`` or ``None`` if the storage
+    cannot list directories.
+    """
+    try:
+        return set(storage.listdir(directory)[1])
+    except (NotImplementedError, AttributeError):
+        return None
+    except (OSError, IOError):
+        # The directory does not exist yet
+        return set()
+
+
+@register.assignment_tag
+def batch_thumbnails(files, size='200x200', mode='thumbnail'):
+    """
+    Resolves the thumbnails of all files passed at once (see
+    ``get_thumbnail_urls``) and returns a list of ``(file, url)`` tuples::
+
+        {% batch_thumbnails mediafiles "200x200" "cropscale" as thumbs %}
+        {% for mediafile, url in thumbs %}
+            <img src="{{ url }}" alt="{{ mediafile.translation.caption }}">
+        {% endfor %}
+    """
+    files = list(files)
+    thumbnailer_class = (
+        CropscaleThumbnailer if mode == 'cropscale' else Thumbnailer)
+    return list(zip(files, get_thumbnail_urls(
+        files, size, thumbnailer_class)))
+
+
+@register.simple_tag
+def thumbnail_picture(filename, dimensions, formats='webp,jpeg',
+                      mode='thumbnail', alt='', sizes=''):
+    """
+    Renders a ``<picture>`` element offering thumbnails in several formats,
+    so that browsers can pick the smallest format they support::
+
+        {% thumbnail_picture image "400x400,800x800" "webp,jpeg" alt="" %}
+
+    ``dimensions`` contains one or more comma-separated sizes; several sizes
+    are offered using ``srcset`` (pass ``sizes`` too in this case). The last
+    format is used for the ``<img>`` fallback and should be supported by all
+    browsers. Formats which cannot be written by the installed PIL are
+    skipped. ``mode`` is either ``'thumbnail'`` or ``'cropscale'``.
+    """
+    if not filename:
+        return ''
+
+    thumbnailer_class = (
+        CropscaleThumbnailer if mode == 'cropscale' else Thumbnailer)
+    dimensions = dimensions.split(',')
+    formats = [
+        format for format in formats.split(',') if format_supported(format)]
+    defer = bool(settings.FEINCMS_THUMBNAIL_QUEUE)
+
+    def _srcset(format):
+        thumbnailer = thumbnailer_class(filename, dimensions[0], format=format)
+        if len(dimensions) > 1:
+            return thumbnailer.get_srcset(dimensions, defer=defer)
+        return thumbnailer.get_url(defer=defer)
+
+    sizes_attr = format_html(' sizes="{0}"', sizes) if sizes else ''
+    sources = [
+        format_html(
+            '<source type="{0}" srcset="{1}"{2}>',
+            THUMBNAIL_FORMATS[format][1], _srcset(format), sizes_attr)
+        for format in formats[:-1]]
+
+    fallback = formats[-1] if formats else None
+    img = thumbnailer_class(filename, dimensions[0], format=fallback)
+    if len(dimensions) > 1:
+        sources.append(format_html(
+            '<img src="{0}" srcset="{1}"{2} alt="{3}">',
+            img.get_url(defer=defer), _srcset(fallback), sizes_attr, alt))
+    else:
+        sources.append(format_html(
+            '<img src="{0}" alt="{1}">', img.get_url(defer=defer), alt))
+
+    return mark_safe('<picture>%s</picture>' % ''.join(sources))
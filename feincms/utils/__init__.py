@@ -5,6 +5,12 @@
 from __future__ import absolute_import, division, unicode_literals
 
 from hashlib import md5
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
 
 try:
     from importlib import import_module
@@ -103,6 +109,43 @@ def path_to_cache_key(path, max_length=200, prefix=""):
     return cache_key
 
 
+# ------------------------------------------------------------------------
+class LRUCache(object):
+    """
+    Thread-safe in-process mapping holding at most ``maxsize`` entries. The
+    least recently used entries are evicted first.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                # SortedDict.popitem() does not support last=False
+                del self._data[next(iter(self._data))]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
 # ------------------------------------------------------------------------
 def get_singleton(template_key, cls=None, raise_exception=True):
     cls = cls or settings.FEINCMS_DEFAULT_PAGE_MODEL
@@ -0,0 +1,159 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+Helpers for running independent parts of a request concurrently in a
+bounded thread pool.
+
+Requires ``concurrent.futures`` (part of the standard library since Python
+3.2, available as ``futures`` backport for Python 2). Everything runs
+sequentially if it is not available.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import sys
+import threading
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+
+from django.core.urlresolvers import (
+    get_script_prefix, get_urlconf, set_script_prefix, set_urlconf)
+from django.db import close_old_connections, connection
+from django.utils import translation
+
+from feincms.utils.profiling import (
+    debug_cursor_attribute, queries_since, query_log_position)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Calls running in worker threads must not wait for other calls in the same
+# pool, that could exhaust the pool and deadlock.
+_local = threading.local()
+
+
+def get_executor(max_workers, name='default'):
+    """
+    Returns the process-wide thread pool called ``name`` with ``max_workers``
+    threads, or ``None`` if thread pools are not available. Background work
+    should use its own ``name``, so that it cannot delay the pools used while
+    rendering responses.
+    """
+    if ThreadPoolExecutor is None:
+        return None
+
+    key = (name, max_workers)
+    with _executors_lock:
+        if key not in _executors:
+            _executors[key] = ThreadPoolExecutor(max_workers)
+        return _executors[key]
+
+
+class CompletedFuture(object):
+    """
+    Stands in for a future when the work has been done synchronously
+    already, supports ``done()``, ``result()`` and ``exception()``.
+    """
+
+    def __init__(self, result=None):
+        self._result = result
+
+    def done(self):
+        return True
+
+    def result(self, timeout=None):
+        return self._result
+
+    def exception(self, timeout=None):
+        return None
+
+
+def call_safely(fn, args=(), kwargs=None):
+    """
+    Calls ``fn`` and returns a ``(result, exc_info)`` tuple, where exactly one
+    of both is ``None``.
+    """
+    try:
+        return fn(*args, **(kwargs or {})), None
+    except Exception:
+        return None, sys.exc_info()
+
+
+def collect_queries(queries):
+    """
+    Makes worker threads append the queries of calls submitted by the current
+    thread to the list ``queries`` (see ``run_concurrently``), which is used
+    for profiling sampled requests. ``None`` stops collecting.
+    """
+    _local.collected_queries = queries
+
+
+def _call_in_thread(language, script_prefix, urlconf, queries, fn, args,
+                    kwargs):
+    # Translations, the script prefix and the URLconf are thread-local,
+    # database connections too. Worker threads outlive requests, therefore
+    # unusable or expired connections are closed before and after every
+    # call, the same way the request handler does it. Calls never see
+    # uncommitted writes of the calling thread.
+    close_old_connections()
+    if language:
+        translation.activate(language)
+    set_script_prefix(script_prefix)
+    set_urlconf(urlconf)
+    _local.in_worker = True
+
+    if queries is not None:
+        attribute = debug_cursor_attribute(connection)
+        debug_cursor = getattr(connection, attribute)
+        setattr(connection, attribute, True)
+        position = query_log_position(connection)
+
+    try:
+        return call_safely(fn, args, kwargs)
+    finally:
+        if queries is not None:
+            queries.extend(queries_since(connection, position))
+            setattr(connection, attribute, debug_cursor)
+
+        _local.in_worker = False
+        set_urlconf(None)
+        translation.deactivate()
+        close_old_connections()
+
+
+def run_concurrently(calls, max_workers):
+    """
+    Runs ``calls``, a list of ``(fn, args, kwargs)`` tuples, in a thread pool
+    holding at most ``max_workers`` threads and returns a list of
+    ``(result, exc_info)`` tuples (see ``call_safely``) in the order of
+    ``calls``. The active language, the script prefix and the URLconf are
+    propagated to the worker threads, and queries are collected if
+    ``collect_queries`` has been called.
+
+    Falls back to running all calls sequentially in the current thread if
+    thread pools are not available, ``max_workers`` is smaller than two,
+    there is at most one call or the current thread is a worker thread
+    itself.
+    """
+    executor = None
+    if max_workers > 1 and not getattr(_local, 'in_worker', False):
+        executor = get_executor(max_workers)
+    if executor is None or len(calls) < 2:
+        return [call_safely(fn, args, kwargs) for fn, args, kwargs in calls]
+
+    language = translation.get_language()
+    script_prefix = get_script_prefix()
+    urlconf = get_urlconf()
+    queries = getattr(_local, 'collected_queries', None)
+
+    futures = [
+        executor.submit(
+            _call_in_thread, language, script_prefix, urlconf, queries, fn,
+            args, kwargs)
+        for fn, args, kwargs in calls]
+    return [future.result() for future in futures]
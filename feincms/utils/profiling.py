@@ -0,0 +1,231 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+Request-scoped timing of processors and content types, activated by the
+``FEINCMS_PROFILE`` setting, and aggregation of sampled request profiles
+(see ``feincms.module.page.processors.sampling_profiler_request_processor``).
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import re
+from time import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from django.core.cache import cache
+
+from feincms import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------
+class Profile(object):
+    """
+    Collects timings of the request processors, the ``process``, ``render``
+    and ``finalize`` methods of content types and the response processors
+    for one request.
+    """
+
+    def __init__(self):
+        #: List of ``(kind, name, seconds)`` tuples in the order of execution
+        self.timings = []
+
+    def record(self, kind, name, seconds):
+        self.timings.append((kind, name, seconds))
+
+    def summary(self):
+        """
+        Returns the timings summed up per kind and name as a string, f.e.
+        ``request_processor:redirect=0.1ms, render:RawContent=1.5ms``.
+        """
+        totals = OrderedDict()
+        for kind, name, seconds in self.timings:
+            key = '%s:%s' % (kind, name)
+            totals[key] = totals.get(key, 0) + seconds
+
+        return ', '.join(
+            '%s=%.1fms' % (key, seconds * 1000)
+            for key, seconds in totals.items())
+
+    def attach(self, request, response):
+        """
+        Exposes the profile as configured by ``FEINCMS_PROFILE`` as soon as
+        the response has been rendered.
+        """
+        def _expose(response):
+            if settings.FEINCMS_PROFILE == 'header':
+                response['X-FeinCMS-Profile'] = self.summary()
+            else:
+                logger.info('%s: %s', request.path, self.summary())
+
+        if getattr(response, 'is_rendered', True):
+            _expose(response)
+        else:
+            response.add_post_render_callback(_expose)
+
+
+# ------------------------------------------------------------------------
+def timed(request, kind, name, fn, args=(), kwargs=None):
+    """
+    Calls ``fn(*args, **kwargs)`` and records the time taken in the profile of
+    ``request``, if there is any.
+    """
+    kwargs = kwargs or {}
+    profile = getattr(request, '_feincms_profile', None)
+    if profile is None:
+        return fn(*args, **kwargs)
+
+    start = time()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.record(kind, name, time() - start)
+
+
+def processor_name(key, fn):
+    """
+    Returns a readable name for a processor registered under ``key``.
+    """
+    if key is not fn:
+        return '%s' % key
+    return getattr(fn, '__name__', repr(fn))
+
+
+# ------------------------------------------------------------------------
+PROFILE_CACHE_KEY = 'FEINCMS:PROFILE:%s'
+PROFILE_INDEX_CACHE_KEY = 'FEINCMS:PROFILE'
+PROFILE_CACHE_TIMEOUT = 7 * 24 * 3600
+
+#: Count of duplicate query fingerprints kept per template
+PROFILE_DUPLICATES = 20
+
+_FINGERPRINT_RE = re.compile(r"""'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b""")
+
+
+def fingerprint(sql):
+    """
+    Returns the SQL statement with all literals replaced by ``?``, so that
+    queries only differing in their parameters can be grouped.
+    """
+    return re.sub(r'(\?, )+\?', '?', _FINGERPRINT_RE.sub('?', sql))
+
+
+def summarize_queries(queries):
+    """
+    Returns a dictionary containing the count, the total time and duplicate
+    fingerprints of the passed queries (as returned by
+    ``connection.queries``).
+    """
+    fingerprints = {}
+    for query in queries:
+        sql = fingerprint(query['sql'])
+        fingerprints[sql] = fingerprints.get(sql, 0) + 1
+    return {
+        'queries': len(queries),
+        'db_time': sum(float(q['time']) for q in queries),
+        'duplicates': dict(
+            (sql, count) for sql, count in fingerprints.items() if count > 1),
+    }
+
+
+def debug_cursor_attribute(connection):
+    """
+    Returns the name of the attribute forcing ``connection`` to log queries.
+    """
+    # Django 1.8 renamed use_debug_cursor to force_debug_cursor
+    if hasattr(connection, 'force_debug_cursor'):
+        return 'force_debug_cursor'
+    return 'use_debug_cursor'
+
+
+def _query_log(connection):
+    # Django 1.8 keeps the log in a deque of bounded length
+    log = getattr(connection, 'queries_log', None)
+    return connection.queries if log is None else log
+
+
+def query_log_position(connection):
+    """
+    Returns a marker for the end of the query log of ``connection``, to be
+    passed to ``queries_since``.
+    """
+    log = _query_log(connection)
+    return log[-1] if log else None
+
+
+def queries_since(connection, position):
+    """
+    Returns the queries logged by ``connection`` after ``position``. The log
+    is searched for the entry itself instead of using its index, because
+    the oldest entries are dropped when the log is full (Django 1.8) or
+    the log may have been reset in the meantime.
+    """
+    log = list(_query_log(connection))
+    for index in range(len(log) - 1, -1, -1):
+        if log[index] is position:
+            return log[index + 1:]
+    return log
+
+
+def aggregate_sample(key, sample):
+    """
+    Adds a sample to the aggregate stored under ``key`` (the page template
+    key) in Django's cache. Samples contain the numbers returned by
+    ``summarize_queries`` and ``render_time`` and ``template_time``.
+
+    Concurrent updates may get lost, which is acceptable for sampling.
+    """
+    cache_key = PROFILE_CACHE_KEY % key
+    aggregate = cache.get(cache_key) or {
+        'requests': 0,
+        'queries': 0,
+        'max_queries': 0,
+        'db_time': 0.0,
+        'render_time': 0.0,
+        'template_time': 0.0,
+        'duplicates': {},
+    }
+
+    aggregate['requests'] += 1
+    aggregate['max_queries'] = max(
+        aggregate['max_queries'], sample['queries'])
+    for field in ('queries', 'db_time', 'render_time', 'template_time'):
+        aggregate[field] += sample[field]
+
+    duplicates = dict(aggregate['duplicates'])
+    for sql, count in sample['duplicates'].items():
+        duplicates[sql] = duplicates.get(sql, 0) + count
+    aggregate['duplicates'] = dict(sorted(
+        duplicates.items(), key=lambda item: -item[1])[:PROFILE_DUPLICATES])
+
+    cache.set(cache_key, aggregate, PROFILE_CACHE_TIMEOUT)
+
+    keys = cache.get(PROFILE_INDEX_CACHE_KEY) or []
+    if key not in keys:
+        cache.set(
+            PROFILE_INDEX_CACHE_KEY, keys + [key], PROFILE_CACHE_TIMEOUT)
+
+
+def get_aggregates():
+    """
+    Returns a dictionary mapping template keys to their aggregates.
+    """
+    keys = cache.get(PROFILE_INDEX_CACHE_KEY) or []
+    aggregates = cache.get_many([PROFILE_CACHE_KEY % key for key in keys])
+    return OrderedDict(
+        (key, aggregates[PROFILE_CACHE_KEY % key])
+        for key in keys if PROFILE_CACHE_KEY % key in aggregates)
+
+
+def reset_aggregates():
+    keys = cache.get(PROFILE_INDEX_CACHE_KEY) or []
+    cache.delete_many(
+        [PROFILE_CACHE_KEY % key for key in keys] + [PROFILE_INDEX_CACHE_KEY])
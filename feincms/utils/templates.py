@@ -0,0 +1,78 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+Process-wide cache of compiled templates, used for rendering CMS objects and
+content blocks without going through all template loaders on every call.
+
+Templates are always loaded again while ``DEBUG`` is active so that changes
+to template files are visible immediately.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # Django < 1.8
+    from django.test.signals import setting_changed
+from django.dispatch import receiver
+from django.template import Context, Template, loader
+
+
+#: Compiled templates by tuple of template names
+_compiled_templates = {}
+
+
+@receiver(setting_changed)
+def _clear_compiled_templates(sender, setting, **kwargs):
+    if setting.startswith('TEMPLATE') or setting == 'INSTALLED_APPS':
+        _compiled_templates.clear()
+
+
+def select_template(template_names):
+    """
+    Returns the first template of ``template_names`` (a template name or a
+    list of template names) which exists, as ``loader.select_template``
+    does. The result is cached per process.
+    """
+    if not isinstance(template_names, (list, tuple)):
+        template_names = (template_names,)
+    key = tuple(template_names)
+
+    if settings.DEBUG:
+        return loader.select_template(key)
+
+    try:
+        return _compiled_templates[key]
+    except KeyError:
+        template = _compiled_templates[key] = loader.select_template(key)
+        return template
+
+
+def render_to_string(template_names, dictionary=None, context_instance=None):
+    """
+    Drop-in replacement for ``django.template.loader.render_to_string``
+    using ``select_template`` above.
+    """
+    template = select_template(template_names)
+
+    # Django 1.8 and better wrap Django templates in backend specific
+    # template objects
+    template = getattr(template, 'template', template)
+    if not isinstance(template, Template):
+        if context_instance:
+            return loader.render_to_string(
+                template_names, dictionary, context_instance=context_instance)
+        return loader.render_to_string(template_names, dictionary)
+
+    if not context_instance:
+        return template.render(Context(dictionary))
+    if not dictionary:
+        return template.render(context_instance)
+
+    context_instance.update(dictionary)
+    try:
+        return template.render(context_instance)
+    finally:
+        context_instance.pop()
@@ -0,0 +1,281 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+Registry of thumbnails known to exist and to be up to date, stored in
+Django's cache. Rendering a thumbnail contained in the registry does not
+access the storage at all (see ``feincms.templatetags.feincms_thumbnail``).
+
+Also contains the on-disk queue used for generating thumbnails outside of
+requests if ``FEINCMS_THUMBNAIL_QUEUE`` is set.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import errno
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import uuid
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.utils.encoding import force_bytes
+
+from feincms import settings
+from feincms.utils import get_object
+
+
+logger = logging.getLogger(__name__)
+
+
+THUMBNAIL_CACHE_KEY = 'FEINCMS:THUMBNAIL:%s'
+THUMBNAIL_VERSION_CACHE_KEY = 'FEINCMS:THUMBNAILVERSION:%s'
+
+# Thumbnails are registered together with the current version of their
+# original. ``forget`` removes the version, which invalidates all thumbnails
+# of the original at once without having to keep a list of them, so that
+# concurrent registrations cannot overwrite each other.
+#
+# Thumbnails also store the size and modification time of local originals,
+# which are compared if the storage of the original is passed when looking
+# them up. Originals replaced without going through ``MediaFile.save`` are
+# noticed this way. Remote storages are not asked, ``forget`` has to be
+# called for them.
+
+
+def _cache_key(key, name):
+    return key % hashlib.md5(force_bytes(name)).hexdigest()
+
+
+def _signature(storage, original):
+    # Returns the size and modification time of ``original`` if it is a
+    # local file, an empty string otherwise.
+    if storage is None:
+        return ''
+    try:
+        stat = os.stat(storage.path(original))
+    except (NotImplementedError, AttributeError, OSError, ValueError):
+        return ''
+    return '%s:%s' % (stat.st_size, stat.st_mtime)
+
+
+def _lookup_many(pairs, storage):
+    # Returns a dictionary mapping the registered miniatures out of the
+    # ``(original, miniature)`` tuples in ``pairs`` to their value, using a
+    # single cache lookup. Signatures are only compared if ``storage`` is
+    # given.
+    keys = {}
+    signatures = {}
+    for original, miniature in pairs:
+        keys[miniature] = (
+            original,
+            _cache_key(THUMBNAIL_VERSION_CACHE_KEY, original),
+            _cache_key(THUMBNAIL_CACHE_KEY, miniature))
+        if storage is not None and original not in signatures:
+            signatures[original] = _signature(storage, original)
+    found = cache.get_many(list(set(
+        key for item in keys.values() for key in item[1:])))
+
+    result = {}
+    for miniature, (original, version_key, key) in keys.items():
+        entry = found.get(key)
+        version = found.get(version_key)
+        if (isinstance(entry, tuple) and len(entry) == 3 and
+                version is not None and entry[0] == version and
+                entry[1] == signatures.get(original, entry[1])):
+            result[miniature] = entry[2]
+    return result
+
+
+def is_registered(original, miniature, storage=None):
+    """
+    Returns ``True`` if the thumbnail ``miniature`` of ``original`` has been
+    registered.
+    """
+    return bool(lookup(original, miniature, storage))
+
+
+def lookup(original, miniature, storage=None):
+    """
+    Returns the value registered for ``miniature`` of ``original`` or
+    ``None``.
+    """
+    if not settings.FEINCMS_THUMBNAIL_CACHE_TIMEOUT:
+        return None
+    return _lookup_many([(original, miniature)], storage).get(miniature)
+
+
+def registered(pairs, storage=None):
+    """
+    Returns the set of registered thumbnails out of ``pairs``, a list of
+    ``(original, miniature)`` tuples of originals in ``storage``, using a
+    single cache lookup.
+    """
+    if not settings.FEINCMS_THUMBNAIL_CACHE_TIMEOUT or not pairs:
+        return set()
+    return set(_lookup_many(pairs, storage))
+
+
+def register(original, miniature, value=True, storage=None):
+    """
+    Registers ``miniature`` as up to date thumbnail of ``original``.
+    ``value`` can be used to store additional data, f.e. the ``srcset`` of
+    a set of thumbnails.
+    """
+    timeout = settings.FEINCMS_THUMBNAIL_CACHE_TIMEOUT
+    if not timeout:
+        return
+
+    version_key = _cache_key(THUMBNAIL_VERSION_CACHE_KEY, original)
+    version = cache.get(version_key)
+    if version is None:
+        # Another thread may have added a version in the meantime
+        cache.add(version_key, uuid.uuid4().hex, timeout)
+        version = cache.get(version_key)
+        if version is None:
+            return
+
+    cache.set(
+        _cache_key(THUMBNAIL_CACHE_KEY, miniature),
+        (version, _signature(storage, original), value), timeout)
+
+
+def forget(original):
+    """
+    Removes all thumbnails of ``original`` from the registry. Has to be
+    called when ``original`` is changed or deleted.
+    """
+    cache.delete(_cache_key(THUMBNAIL_VERSION_CACHE_KEY, original))
+
+
+def unregister(miniatures):
+    """
+    Removes the thumbnails ``miniatures`` from the registry, f.e. after
+    deleting them.
+    """
+    cache.delete_many([
+        _cache_key(THUMBNAIL_CACHE_KEY, miniature)
+        for miniature in miniatures])
+
+
+# ------------------------------------------------------------------------
+def _dotted_path(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+class StoredFile(object):
+    """
+    Minimal stand-in for a ``FieldFile``, which is what thumbnailers need to
+    find the storage of an image.
+    """
+
+    def __init__(self, name, storage):
+        self.name = name
+        self.storage = storage
+
+
+def enqueue(thumbnailer_class, storage, original, size, format=None,
+            options=None):
+    """
+    Adds a job for generating a thumbnail to the queue directory and returns
+    ``True``, or ``False`` if the same job is queued already. ``format`` and
+    ``options`` are passed on to the thumbnailer.
+
+    Storages are recorded by their class. Workers use ``default_storage`` if
+    its class matches, otherwise they instantiate the class without
+    arguments.
+    """
+    job = {
+        'thumbnailer': _dotted_path(thumbnailer_class),
+        'storage': _dotted_path(storage.__class__),
+        'original': original,
+        'size': size,
+        'format': format,
+        'options': options or {},
+    }
+    queue = settings.FEINCMS_THUMBNAIL_QUEUE
+    path = os.path.join(queue, '%s.json' % hashlib.md5(force_bytes(
+        json.dumps(job, sort_keys=True))).hexdigest())
+
+    if os.path.exists(path) or glob.glob(
+            '%s.*.working' % re.sub(r'([*?[])', r'[\1]', path)):
+        # Queued already or being processed right now
+        return False
+
+    try:
+        os.makedirs(queue)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+    # Write to a temporary file first so that workers never see partial
+    # jobs
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=queue)
+    with os.fdopen(fd, 'w') as handle:
+        json.dump(job, handle)
+    os.rename(tmp, path)
+    return True
+
+
+def queued_jobs():
+    """
+    Returns the paths of all queued jobs.
+    """
+    queue = settings.FEINCMS_THUMBNAIL_QUEUE
+    if not queue or not os.path.isdir(queue):
+        return []
+    return sorted(
+        os.path.join(queue, name) for name in os.listdir(queue)
+        if name.endswith('.json'))
+
+
+def process_job(path):
+    """
+    Generates the thumbnail described by the job at ``path`` and removes the
+    job. Returns ``True`` if the thumbnail could be generated, ``False`` if
+    not or if another worker took the job first. Jobs which could not be
+    processed are kept as ``<path>.failed``.
+    """
+    working = '%s.%s.working' % (path, os.getpid())
+    try:
+        os.rename(path, working)
+    except OSError:
+        return False
+
+    success = False
+    try:
+        with open(working) as handle:
+            job = json.load(handle)
+
+        thumbnailer = get_object(job['thumbnailer'])
+        if _dotted_path(default_storage.__class__) == job['storage']:
+            storage = default_storage
+        else:
+            storage = get_object(job['storage'])()
+
+        original = job['original']
+        url = thumbnailer(
+            StoredFile(original, storage), job['size'],
+            format=job.get('format'), options=job.get('options'),
+        ).get_url(defer=False)
+        success = bool(url) and url != storage.url(original)
+        return success
+    except Exception as exc:
+        logger.warning(
+            'Processing the thumbnail job %s failed: %r', path, exc,
+            exc_info=True)
+        return False
+    finally:
+        failed = '%s.failed' % path
+        if success:
+            os.remove(working)
+            if os.path.exists(failed):
+                # An earlier attempt failed
+                os.remove(failed)
+        else:
+            os.rename(working, failed)
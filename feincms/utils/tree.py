@@ -0,0 +1,202 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+Bulk operations for django-mptt_-managed FeinCMS models.
+
+.. _django-mptt: https://github.com/django-mptt/django-mptt/
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.deletion import Collector
+
+from feincms.signals import subtrees_pre_delete, subtrees_post_delete
+
+
+# ------------------------------------------------------------------------
+def _batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def _has_dependent_rows(cls):
+    """
+    Returns ``True`` if rows of ``cls`` may be referenced by other rows
+    (many to many fields or foreign keys pointing to ``cls``), which means
+    that related rows have to be collected before deleting them.
+    """
+    opts = cls._meta
+    if opts.many_to_many:
+        return True
+
+    if hasattr(opts, 'get_fields'):
+        # Django 1.8 and better
+        return any(
+            f.auto_created and not f.concrete for f in opts.get_fields())
+
+    return bool(
+        opts.get_all_related_objects(include_hidden=True)
+        or opts.get_all_related_many_to_many_objects())
+
+
+def _delete_rows(model, column, values, using, batch_size):
+    """
+    Deletes the rows of ``model`` whose ``column`` is contained in
+    ``values`` with one ``DELETE`` statement per batch.
+    """
+    connection = connections[using]
+    cursor = connection.cursor()
+
+    for batch in _batches(values, batch_size):
+        cursor.execute(
+            'DELETE FROM %s WHERE %s IN (%s)' % (
+                connection.ops.quote_name(model._meta.db_table),
+                connection.ops.quote_name(column),
+                ','.join(['%s'] * len(batch))),
+            batch)
+
+
+def _delete_collected(queryset, using, batch_size):
+    """
+    Deletes ``queryset`` including all rows cascading from it like
+    ``QuerySet.delete()``, but without sending ``pre_delete`` and
+    ``post_delete``. Django's deletion collector determines the rows to
+    delete and the foreign keys to set to ``NULL``.
+    """
+    collector = Collector(using=using)
+    collector.collect(queryset)
+    collector.sort()
+
+    for qs in collector.fast_deletes:
+        _delete_rows(
+            qs.model, qs.model._meta.pk.column,
+            list(qs.values_list('pk', flat=True)), using, batch_size)
+
+    for model, updates in collector.field_updates.items():
+        for (field, value), instances in updates.items():
+            for batch in _batches([obj.pk for obj in instances], batch_size):
+                model._base_manager.using(using).filter(
+                    pk__in=batch).update(**{field.name: value})
+
+    for model, instances in collector.data.items():
+        _delete_rows(
+            model, model._meta.pk.column, [obj.pk for obj in instances],
+            using, batch_size)
+
+
+def _delete_content_rows(model, pks, using, batch_size):
+    """
+    Deletes all content blocks belonging to the tree nodes in ``pks``
+    with one ``DELETE`` statement per content type table and batch.
+    """
+    for cls in getattr(model, '_feincms_content_types', ()):
+        if _has_dependent_rows(cls):
+            for batch in _batches(pks, batch_size):
+                _delete_collected(
+                    cls._base_manager.using(using).filter(parent__in=batch),
+                    using, batch_size)
+            continue
+
+        _delete_rows(
+            cls, cls._meta.get_field('parent').column, pks, using,
+            batch_size)
+
+
+def _close_gap(model, using, tree_id, lft, rght):
+    """
+    Moves the nodes to the right of the deleted range ``lft``-``rght`` in
+    tree ``tree_id`` to the left.
+    """
+    opts = model._mptt_meta
+    width = rght - lft + 1
+    nodes = model._base_manager.using(using).filter(**{
+        opts.tree_id_attr: tree_id})
+
+    nodes.filter(**{'%s__gt' % opts.left_attr: rght}).update(**{
+        opts.left_attr: F(opts.left_attr) - width})
+    nodes.filter(**{'%s__gt' % opts.right_attr: rght}).update(**{
+        opts.right_attr: F(opts.right_attr) - width})
+
+
+# ------------------------------------------------------------------------
+def delete_subtrees(queryset, batch_size=500):
+    """
+    Deletes the nodes in ``queryset`` including all their descendants and
+    returns the primary keys of all deleted nodes.
+
+    Deleting nodes one by one is prohibitively expensive for large subtrees,
+    because every deletion updates the MPTT fields of the whole tree and
+    walks through every content type table separately. This function
+    instead:
+
+    * Collects all nodes by their tree range (selected nodes which are
+      descendants of other selected nodes are skipped).
+    * Deletes content blocks using ``parent_id IN (...)`` batches per
+      content type table.
+    * Deletes the nodes themselves in batches and closes the gap in the
+      MPTT tree once per deleted subtree instead of once per node. Rows
+      referencing the nodes (translations, symlinks and other foreign
+      keys) are cascaded or set to ``NULL`` as determined by Django's
+      deletion collector.
+
+    ``pre_delete`` and ``post_delete`` are not sent for any of the deleted
+    rows; ``feincms.signals.subtrees_pre_delete`` and
+    ``feincms.signals.subtrees_post_delete`` are sent once instead.
+
+    Models may veto the deletion by defining a ``check_subtree_deletion``
+    classmethod which receives ``queryset`` and raises an exception (f.e.
+    pages using singleton templates, see
+    ``feincms.module.page.models.BasePage``).
+    """
+    model = queryset.model
+    opts = model._mptt_meta
+    using = queryset.db
+
+    check = getattr(model, 'check_subtree_deletion', None)
+    if check is not None:
+        check(queryset)
+
+    nodes = queryset.order_by(opts.tree_id_attr, opts.left_attr).values_list(
+        opts.tree_id_attr, opts.left_attr, opts.right_attr)
+
+    roots = []
+    for tree_id, lft, rght in nodes:
+        if roots and roots[-1][0] == tree_id and roots[-1][2] >= rght:
+            # Contained in the previous subtree
+            continue
+        roots.append((tree_id, lft, rght))
+
+    pks = []
+    for tree_id, lft, rght in roots:
+        pks.extend(model._base_manager.using(using).filter(**{
+            opts.tree_id_attr: tree_id,
+            '%s__gte' % opts.left_attr: lft,
+            '%s__lte' % opts.right_attr: rght,
+        }).order_by(opts.left_attr).values_list('pk', flat=True))
+
+    if not pks:
+        return pks
+
+    subtrees_pre_delete.send(sender=model, pks=pks)
+
+    with transaction.atomic(using=using):
+        _delete_content_rows(model, pks, using, batch_size)
+
+        # Delete the deepest nodes first so that the self-referencing
+        # parent foreign key does not make the collector collect the same
+        # nodes again and again.
+        for batch in _batches(pks[::-1], batch_size):
+            _delete_collected(
+                model._base_manager.using(using).filter(pk__in=batch),
+                using, batch_size)
+
+        # Close gaps from right to left, so that ranges which still have to
+        # be processed are not shifted.
+        for tree_id, lft, rght in sorted(roots, key=lambda r: (r[0], -r[1])):
+            _close_gap(model, using, tree_id, lft, rght)
+
+    subtrees_post_delete.send(sender=model, pks=pks)
+    return pks
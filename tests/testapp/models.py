@@ -50,8 +50,6 @@ Page.create_content_type(ContactFormContent, form=ContactForm)
 Page.create_content_type(FileContent)
 Page.register_request_processor(processors.etag_request_processor)
 Page.register_response_processor(processors.etag_response_processor)
-Page.register_response_processor(
-    processors.debug_sql_queries_response_processor())
 
 
 def get_admin_fields(form, *args, **kwargs):
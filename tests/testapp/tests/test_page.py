@@ -5,40 +5,58 @@
 from __future__ import absolute_import, unicode_literals
 
 from datetime import datetime, timedelta
+from io import BytesIO
 import os
 import re
 
 from django import forms, template
 from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth.models import User, AnonymousUser
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.messages import get_messages
 from django.core import mail
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.http import Http404, HttpResponseBadRequest
+from django.db import connection, models
+from django.db.models import signals
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.middleware.csrf import get_token
 from django.template import TemplateDoesNotExist
 from django.template.defaultfilters import slugify
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 from django.utils import timezone
 from django.utils.encoding import force_text
+from django.utils.http import http_date
 
 from mptt.exceptions import InvalidMove
 
 from feincms import settings as feincms_settings
+from feincms._internal import call_last_modified
 from feincms.content.application.models import (
-    app_reverse, cycle_app_reverse_cache)
+    APP_REVERSE_CACHE_GENERATION_KEY, ApplicationContent, app_reverse,
+    cycle_app_reverse_cache)
 from feincms.content.image.models import ImageContent
 from feincms.content.raw.models import RawContent
 from feincms.content.richtext.models import RichTextContent
 
 from feincms.context_processors import add_page_if_missing
 from feincms.models import ContentProxy
+from feincms.module.extensions.changedate import (
+    dt_to_utc_timestamp, last_modified_request_processor)
+from feincms.module.mixins import ContentView, cycle_response_cache
 from feincms.module.medialibrary.models import Category, MediaFile
+from feincms.module.page import processors
 from feincms.module.page.extensions.navigation import PagePretender
 from feincms.module.page.models import Page
 from feincms.module.page.templatetags import feincms_page_tags
+from feincms.signals import subtrees_post_delete
 from feincms.translations import short_language_code
+from feincms.utils.profiling import (
+    debug_cursor_attribute, get_aggregates, reset_aggregates)
+from feincms.utils.tree import delete_subtrees
 
 from .test_stuff import Empty
 
@@ -188,6 +206,12 @@ class PagesTestCase(TestCase):
             reverse('admin:page_page_change', args=(42,)),
             should_be=False)
 
+        # Models without content types do not query anything
+        editor = admin.site._registry[Page]
+        obj = Empty()
+        obj._feincms_content_types = []
+        self.assertEqual(editor.get_content_types_in_use(obj), set())
+
     def test_03_add_another(self):
         self.login()
         self.assertRedirects(
@@ -409,6 +433,33 @@ class PagesTestCase(TestCase):
         self.assertRedirects(response, '/admin/page/page/')
         self.assertEqual(page.content.main[0].__class__.__name__, 'RawContent')
 
+        # Only formsets of content types in use are loaded from the database
+        response = self.client.get(
+            reverse('admin:page_page_change', args=(page.pk,)))
+        forms_per_type = dict(
+            (formset.opts.model.__name__, len(formset.formset.forms))
+            for formset in response.context['inline_admin_formsets'])
+        self.assertEqual(forms_per_type['RawContent'], 1)
+        self.assertEqual(forms_per_type['MediaFileContent'], 0)
+
+        # Empty forms of unused content types are fetched on demand
+        self.assertContains(
+            response,
+            'id="mediafilecontent_set-group"'
+            ' data-url="/admin/page/page/content-type-form/'
+            '?prefix=mediafilecontent_set"')
+        self.assertNotContains(response, 'id="mediafilecontent_set-empty"')
+        self.assertContains(response, 'id="rawcontent_set-empty"')
+        self.assertContains(
+            self.client.get(
+                '/admin/page/page/content-type-form/'
+                '?prefix=mediafilecontent_set'),
+            'id="mediafilecontent_set-empty"')
+        self.assertEqual(
+            self.client.get(
+                '/admin/page/page/content-type-form/?prefix=unknown'
+            ).status_code, 404)
+
         page2 = Page.objects.get(pk=2)
         page2.symlinked_page = page
 
@@ -573,6 +624,67 @@ class PagesTestCase(TestCase):
         self.assertEqual(page.content_title, page.title)
         self.assertEqual(page.content_subtitle, '')
 
+    def test_13_delete_selected_tree(self):
+        self.create_default_page_set()
+        page1, page2 = list(Page.objects.order_by('id'))
+        page3 = self.create_page('page3', parent=page2)
+        page4 = self.create_page('page4')
+        page3.rawcontent_set.create(region='main', ordering=0, text='Hi')
+        page4.rawcontent_set.create(region='main', ordering=0, text='Bye')
+
+        page5 = self.create_page('page5')
+        page5.translation_of = page3
+        page5.save()
+
+        deleted = []
+
+        def receiver(sender, **kwargs):
+            deleted.append(sender)
+
+        self.login()
+        signals.post_delete.connect(receiver)
+        subtrees_post_delete.connect(receiver)
+        try:
+            response = self.client.post('/admin/page/page/', {
+                'action': 'delete_selected',
+                'post': 'yes',
+                '_selected_action': [page2.pk, page3.pk],
+            })
+        finally:
+            signals.post_delete.disconnect(receiver)
+            subtrees_post_delete.disconnect(receiver)
+        self.assertRedirects(response, '/admin/page/page/')
+
+        # Only the aggregate signal is sent, translations are cascaded
+        self.assertEqual(deleted, [Page])
+
+        self.assertEqual(
+            sorted(Page.objects.values_list('pk', flat=True)),
+            [page1.pk, page4.pk])
+        self.assertEqual(
+            list(page4.rawcontent_set.values_list('text', flat=True)),
+            ['Bye'])
+        self.assertEqual(
+            page3.rawcontent_set.model.objects.filter(
+                parent=page3.pk).count(),
+            0)
+
+        # The gaps in the tree have been closed
+        page1 = Page.objects.get(pk=page1.pk)
+        self.assertEqual((page1.lft, page1.rght), (1, 2))
+        self.assertEqual(page1.get_descendant_count(), 0)
+
+        # Pages using singleton templates cannot be deleted in bulk either
+        template = Page._feincms_templates['base']
+        template.singleton = True
+        try:
+            self.assertRaises(
+                PermissionDenied, delete_subtrees,
+                Page.objects.filter(pk=page4.pk))
+        finally:
+            template.singleton = False
+        self.assertEqual(Page.objects.count(), 2)
+
     def test_13_inheritance_and_ct_tracker(self):
         self.create_default_page_set()
 
@@ -1287,6 +1399,19 @@ class PagesTestCase(TestCase):
                 lambda: app_reverse(
                     'ac_module_root', 'testapp.applicationcontent_urls'))
 
+        # Equal arguments of different types do not share cache entries
+        for first, second in ((1, True), ('1', 1)):
+            self.assertEqual(
+                app_reverse(
+                    'ac_args_test', 'testapp.applicationcontent_urls',
+                    args=(first, 'x')),
+                '/test-page/test-child-page/args_test/%s/x/' % first)
+            self.assertEqual(
+                app_reverse(
+                    'ac_args_test', 'testapp.applicationcontent_urls',
+                    args=(second, 'x')),
+                '/test-page/test-child-page/args_test/%s/x/' % second)
+
         # This should not raise
         self.assertEqual(
             self.client.get(
@@ -1422,6 +1547,32 @@ class PagesTestCase(TestCase):
             app_reverse('ac_module_root', 'testapp.applicationcontent_urls'),
             page.get_absolute_url())
 
+        # the mount table is only built once
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                app_reverse(
+                    'ac_module_root', 'testapp.applicationcontent_urls'),
+                page.get_absolute_url())
+
+        # changes not affecting app_reverse do not invalidate the cache
+        generation = cache.get(APP_REVERSE_CACHE_GENERATION_KEY)
+        page1.title = 'Changed title'
+        page1.save()
+        self.assertEqual(
+            cache.get(APP_REVERSE_CACHE_GENERATION_KEY), generation)
+
+        # ... but changing the URL of an ancestor does
+        slug = page1.slug
+        page1.slug = 'changed-slug'
+        page1.save()
+        self.assertNotEqual(
+            cache.get(APP_REVERSE_CACHE_GENERATION_KEY), generation)
+        self.assertEqual(
+            app_reverse('ac_module_root', 'testapp.applicationcontent_urls'),
+            '/changed-slug/test-child-page/')
+        page1.slug = slug
+        page1.save()
+
         # when specific applicationcontent exists more then once reverse should
         # return the URL of the first (ordered by primary key) page.
         self.login()
@@ -1454,6 +1605,18 @@ class PagesTestCase(TestCase):
             app_reverse('ac_module_root', 'testapp.applicationcontent_urls'),
             page.get_absolute_url())
 
+        # Overriding closest_match is respected
+        cls = ApplicationContent._feincms_content_models[0]
+        cls.closest_match = classmethod(
+            lambda cls, urlconf_path: page_de_1.applicationcontent_set.get())
+        try:
+            self.assertEqual(
+                app_reverse(
+                    'ac_module_root', 'testapp.applicationcontent_urls'),
+                page_de_1.get_absolute_url())
+        finally:
+            del cls.closest_match
+
     def test_29_medialibrary_admin(self):
         self.create_default_page_set()
         self.login()
@@ -1510,6 +1673,29 @@ class PagesTestCase(TestCase):
         self.assertEqual(stats.count('image'), 12)
         self.assertEqual(stats.count('other'), 0)
 
+        response = self.client.post('/admin/medialibrary/mediafile/', {
+            'action': 'save_as_zipfile',
+            '_selected_action': MediaFile.objects.exclude(
+                file='somefile.jpg').values_list('pk', flat=True)[:3],
+        })
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(
+            len(zipfile.ZipFile(BytesIO(b''.join(
+                response.streaming_content))).namelist()),
+            3)
+
+        # Missing files are reported before the download starts
+        missing = MediaFile.objects.create(file='missing/nofile.jpg')
+        response = self.client.post('/admin/medialibrary/mediafile/', {
+            'action': 'save_as_zipfile',
+            '_selected_action': [missing.pk],
+        })
+        self.assertRedirects(response, '/admin/medialibrary/mediafile/')
+        message = ' '.join(
+            '%s' % m for m in get_messages(response.wsgi_request))
+        self.assertTrue('ZIP file export failed' in message)
+        self.assertTrue('missing/nofile.jpg' in message)
+
     def test_30_context_processors(self):
         self.create_default_page_set()
         Page.objects.update(active=True, in_navigation=True)
@@ -1573,6 +1759,40 @@ class PagesTestCase(TestCase):
         self.assertContains(response, 'a content 43')
         self.assertIn('yabba dabba', response['cache-control'])
 
+    def test_32_applicationcontent_concurrently(self):
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.active = True
+        page.template_key = 'theother'
+        page.save()
+
+        for ordering in range(2):
+            page.applicationcontent_set.create(
+                region='main', ordering=ordering, urlconf_path='whatever')
+        page.rawcontent_set.create(
+            region='sidebar', ordering=0, text='some_sidebar_region_text')
+
+        config = page.applicationcontent_set.model.ALL_APPS_CONFIG[
+            'whatever']['config']
+        old = feincms_settings.FEINCMS_PROCESS_CONCURRENCY
+        try:
+            config['process_concurrently'] = True
+            feincms_settings.FEINCMS_PROCESS_CONCURRENCY = 4
+
+            self.assertContains(
+                self.client.get(page.get_absolute_url()), 'module_root',
+                count=2)
+
+            # The template and the context returned by the applications
+            # are merged into the view
+            response = self.client.get(
+                page.get_absolute_url() + 'inheritance20/')
+            self.assertContains(response, 'a content 42')
+            self.assertContains(response, 'some_sidebar_region_text')
+        finally:
+            del config['process_concurrently']
+            feincms_settings.FEINCMS_PROCESS_CONCURRENCY = old
+
     def test_33_preview(self):
         self.create_default_page_set()
         page = Page.objects.get(pk=1)
@@ -1744,3 +1964,223 @@ class PagesTestCase(TestCase):
             {'feincms_page': page1}, p, path='/test-page/whatsup/test/'))
         self.assertFalse(feincms_page_tags.page_is_active(
             {'feincms_page': page2}, p, path='/test-page/'))
+
+    def test_41_response_cache(self):
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.template_key = 'theother'
+        page.active = True
+        page.save()
+        page.rawcontent_set.create(
+            region='main',
+            ordering=0,
+            text='Cached content')
+
+        old = feincms_settings.FEINCMS_RESPONSE_CACHE
+        feincms_settings.FEINCMS_RESPONSE_CACHE = True
+        cycle_response_cache()
+
+        try:
+            self.assertContains(
+                self.client.get(page.get_absolute_url()), 'Cached content')
+
+            # Updates bypassing signals are not visible...
+            page.rawcontent_set.update(text='Changed content')
+            self.assertContains(
+                self.client.get(page.get_absolute_url()), 'Cached content')
+
+            # ... but saving content invalidates the cache
+            page.rawcontent_set.get().save()
+            self.assertContains(
+                self.client.get(page.get_absolute_url()), 'Changed content')
+
+            # Responses using the CSRF token are not cached
+            def csrf_processor(page, request):
+                get_token(request)
+            csrf_processor.response_cache_safe = True
+
+            # Processors which are not marked as safe prevent caching
+            def unsafe_processor(page, request):
+                pass
+
+            for processor in (csrf_processor, unsafe_processor):
+                Page.register_request_processor(processor, key='test')
+                cycle_response_cache()
+                try:
+                    for text in ('Uncached', 'Still uncached'):
+                        page.rawcontent_set.update(text=text)
+                        self.assertContains(
+                            self.client.get(page.get_absolute_url()), text)
+                finally:
+                    del Page.request_processors['test']
+
+            # Authenticated users always get fresh responses
+            cycle_response_cache()
+            self.client.get(page.get_absolute_url())
+            page.rawcontent_set.update(text='Fresh content')
+            self.login()
+            self.assertContains(
+                self.client.get(page.get_absolute_url()), 'Fresh content')
+        finally:
+            feincms_settings.FEINCMS_RESPONSE_CACHE = old
+
+    def test_42_last_modified(self):
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.template_key = 'theother'
+        page.active = True
+        page.save()
+
+        yesterday = timezone.now() - timedelta(days=1)
+        Page.objects.filter(pk=page.pk).update(modification_date=yesterday)
+        page.rawcontent_set.create(region='main', ordering=0, text='Hello')
+
+        # Saving content blocks updates the modification date of the page
+        page = Page.objects.get(pk=1)
+        self.assertTrue(page.last_modified() > yesterday)
+
+        # Implementations not accepting the request keep working
+        class Legacy(object):
+            def last_modified(self):
+                return yesterday
+
+        self.assertEqual(call_last_modified(Legacy(), None), yesterday)
+        self.assertEqual(
+            call_last_modified(page, None), page.last_modified())
+
+        Page.register_request_processor(
+            last_modified_request_processor, key='last_modified')
+        try:
+            self.assertEqual(self.client.get(
+                page.get_absolute_url(),
+                HTTP_IF_MODIFIED_SINCE=http_date(
+                    dt_to_utc_timestamp(page.last_modified())),
+            ).status_code, 304)
+            self.assertContains(self.client.get(
+                page.get_absolute_url(),
+                HTTP_IF_MODIFIED_SINCE=http_date(
+                    dt_to_utc_timestamp(yesterday)),
+            ), 'Hello')
+        finally:
+            del Page.request_processors['last_modified']
+
+    def test_43_profile(self):
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.template_key = 'theother'
+        page.active = True
+        page.save()
+        page.rawcontent_set.create(region='main', ordering=0, text='Hello')
+
+        old = feincms_settings.FEINCMS_PROFILE
+        feincms_settings.FEINCMS_PROFILE = 'header'
+        try:
+            profile = self.client.get(
+                page.get_absolute_url())['X-FeinCMS-Profile']
+        finally:
+            feincms_settings.FEINCMS_PROFILE = old
+
+        self.assertIn('request_processor:redirect=', profile)
+        self.assertIn('render:RawContent=', profile)
+        self.assertIn('response_processor:etag_response_processor=', profile)
+
+        # Pipelines are compiled once...
+        self.assertTrue(
+            Page.get_processor_pipelines()[0] is
+            Page.get_processor_pipelines()[0])
+
+        # ... but modifying the registries directly takes effect immediately
+        Page.request_processors['direct'] = lambda page, request: None
+        feincms_settings.FEINCMS_PROFILE = 'header'
+        try:
+            profile = self.client.get(
+                page.get_absolute_url())['X-FeinCMS-Profile']
+            self.assertIn('request_processor:direct=', profile)
+
+            del Page.request_processors['direct']
+            profile = self.client.get(
+                page.get_absolute_url())['X-FeinCMS-Profile']
+            self.assertNotIn('request_processor:direct=', profile)
+        finally:
+            Page.request_processors.pop('direct', None)
+            feincms_settings.FEINCMS_PROFILE = old
+
+    def test_44_sampling_profiler(self):
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.template_key = 'theother'
+        page.active = True
+        page.save()
+        page.rawcontent_set.create(region='main', ordering=0, text='Hello')
+
+        def short_circuit(page, request):
+            if 'short' in request.GET:
+                return HttpResponse('Short')
+
+        attribute = debug_cursor_attribute(connection)
+        debug_cursor = getattr(connection, attribute)
+        reset_aggregates()
+
+        # Request processors run in reverse order of registration, so
+        # short_circuit runs after the sampler
+        Page.register_request_processor(short_circuit, key='short')
+        Page.register_request_processor(
+            processors.sampling_profiler_request_processor(sample_rate=1),
+            key='sampling_profiler')
+        Page.register_response_processor(
+            processors.sampling_profiler_response_processor,
+            key='sampling_profiler')
+        try:
+            self.assertContains(
+                self.client.get(page.get_absolute_url()), 'Hello')
+            self.assertEqual(getattr(connection, attribute), debug_cursor)
+
+            # Query logging is stopped also if the response processors do
+            # not run
+            self.assertContains(
+                self.client.get(page.get_absolute_url() + '?short=1'),
+                'Short')
+            self.assertEqual(getattr(connection, attribute), debug_cursor)
+        finally:
+            del Page.request_processors['short']
+            del Page.request_processors['sampling_profiler']
+            del Page.response_processors['sampling_profiler']
+
+        aggregate = get_aggregates()['theother']
+        self.assertEqual(aggregate['requests'], 1)
+        self.assertTrue(aggregate['queries'] >= 1)
+        reset_aggregates()
+        self.assertEqual(get_aggregates(), {})
+
+    def test_45_template_names(self):
+        self.create_default_page_set()
+        page = Page.objects.get(pk=1)
+        page.template_key = 'theother'
+        page.active = True
+        page.save()
+        page.rawcontent_set.create(region='main', ordering=0, text='Hello')
+
+        class View(ContentView):
+            def get_template_names(self):
+                return ['alternate/' + name for name in super(
+                    View, self).get_template_names()]
+
+        view = ContentView()
+        view.object = page
+        view.request = RequestFactory().get('/')
+        self.assertEqual(view.get_template_names(), [page.template.path])
+        response = view.render_to_response({})
+        self.assertTrue(
+            response.template_name is page.template.get_template())
+
+        # The compiled template is only used if the template names have not
+        # been changed
+        view = View()
+        view.object = page
+        view.request = RequestFactory().get('/')
+        self.assertEqual(
+            view.get_template_names(), ['alternate/' + page.template.path])
+        response = view.render_to_response({})
+        self.assertEqual(
+            response.template_name, ['alternate/' + page.template.path])
+        self.assertRaises(TemplateDoesNotExist, response.render)
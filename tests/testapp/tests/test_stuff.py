@@ -4,17 +4,55 @@
 
 from __future__ import absolute_import, unicode_literals
 
+from collections import deque
 import doctest
+from io import BytesIO
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from PIL import Image
+
+try:
+    from unittest import skipIf
+except ImportError:  # Python 2.6
+    from django.utils.unittest import skipIf
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.db import connection
+from django.template import Context
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+from django.utils import translation
+from django.utils.six import StringIO
 from django.utils.encoding import force_text
 
 import feincms
+from feincms import settings as feincms_settings
 from feincms.models import Region, Template
 from feincms.module.blog.models import Entry
-from feincms.utils import get_object, shorten_string
+from feincms.templatetags.feincms_tags import feincms_render_region
+from feincms.module.medialibrary.models import Category, MediaFile
+from feincms.module.medialibrary.thumbnail import generate_presets_later
+from feincms.module.medialibrary.zip import import_zipfile, stream_zipfile
+from feincms.module.mixins import ContentView
+from feincms.templatetags.feincms_thumbnail import (
+    Thumbnailer, batch_thumbnails, cropscale, cropscale_srcset,
+    format_supported, get_thumbnail_urls, thumbnail, thumbnail_picture,
+    thumbnail_preset, thumbnail_srcset)
+from feincms.utils import (
+    LRUCache, get_object, shorten_string, templates, thumbnails)
+from feincms.utils import concurrency, profiling
+from feincms.utils.concurrency import run_concurrently
 
 
 # ------------------------------------------------------------------------
@@ -52,6 +90,17 @@ class ModelsTest(TestCase):
         self.assertEqual(r.key, t.regions[0].key)
         self.assertEqual(force_text(r), 'region title')
 
+    def test_template_get_template(self):
+        t = Template('base template', 'base.html', ())
+
+        compiled = t.get_template()
+        self.assertTrue(compiled is t.get_template())
+
+        with override_settings(DEBUG=True):
+            self.assertFalse(compiled is t.get_template())
+        with override_settings(TEMPLATE_DEBUG=True):
+            self.assertFalse(compiled is t.get_template())
+
 
 class UtilsTest(TestCase):
     def test_get_object(self):
@@ -81,6 +130,692 @@ class UtilsTest(TestCase):
         self.assertEqual(string, 'Badger-ger')
         self.assertEqual(len(string), 10)
 
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_run_concurrently(self):
+        def fail():
+            raise ValueError('fail')
+
+        calls = [
+            (translation.get_language, (), {}),
+            (fail, (), {}),
+            (int, ('3',), {}),
+        ]
+
+        for max_workers in (0, 4):
+            with translation.override('de'):
+                results = run_concurrently(calls, max_workers)
+
+            self.assertEqual(results[0], ('de', None))
+            self.assertEqual(results[1][0], None)
+            self.assertTrue(isinstance(results[1][1][1], ValueError))
+            self.assertEqual(results[2], (3, None))
+
+    def test_queries_since(self):
+        # Django 1.8 drops the oldest queries when the log is full
+        log = deque([{'sql': 'a'}, {'sql': 'b'}], maxlen=3)
+        db = Empty()
+        db.queries_log = log
+
+        position = profiling.query_log_position(db)
+        log.extend([{'sql': 'c'}, {'sql': 'd'}])
+        self.assertEqual(
+            [q['sql'] for q in profiling.queries_since(db, position)],
+            ['c', 'd'])
+
+    def test_render_to_string(self):
+        names = ['content/video/missing.html', 'content/video/unknown.html']
+        template = templates.select_template(names)
+        self.assertTrue(template is templates.select_template(names))
+
+        context = Context({'content': 'outer'})
+        depth = len(context.dicts)
+        output = templates.render_to_string(
+            names, {'content': {'video': 'http://example.com/'}},
+            context_instance=context)
+        self.assertTrue('http://example.com/' in output)
+        self.assertEqual(len(context.dicts), depth)
+        self.assertEqual(context['content'], 'outer')
+
+    def test_render_region_concurrently(self):
+        class Content(object):
+            feincms_render_concurrently = True
+
+            def __init__(self, text):
+                self.text = text
+
+            def render(self, request, context):
+                context.push()
+                context['text'] = self.text
+                return '%s%s:%s' % (
+                    translation.get_language(), request.feincms_render_level,
+                    context['text'])
+
+        class Object(object):
+            class content(object):
+                main = [Content('a'), Content('b'), Content('c')]
+                main[1].feincms_render_concurrently = False
+
+        request = Empty()
+        request.feincms_render_level = 1
+        context = Context({'text': 'x'})
+
+        old = feincms_settings.FEINCMS_RENDER_CONCURRENCY
+        try:
+            feincms_settings.FEINCMS_RENDER_CONCURRENCY = 4
+            with translation.override('de'):
+                output = feincms_render_region(
+                    context, Object(), 'main', request)
+        finally:
+            feincms_settings.FEINCMS_RENDER_CONCURRENCY = old
+
+        # The region is joined in order, blocks rendered in worker threads
+        # neither change the render level of the request nor the context.
+        self.assertEqual(output, 'de1:ade2:bde1:c')
+        self.assertEqual(request.feincms_render_level, 1)
+        self.assertEqual(context['text'], 'b')
+
+    @skipIf(
+        concurrency.ThreadPoolExecutor is None,
+        'concurrent.futures is not available')
+    def test_process_contents_concurrently(self):
+        class Content(object):
+            feincms_process_concurrently = True
+
+            def __init__(self, key):
+                self.key = key
+
+            def process(self, request, **kwargs):
+                request._feincms_extra_context[self.key] = (
+                    threading.current_thread() is main_thread)
+                request._feincms_extra_context['last'] = self.key
+                return self.key
+
+        contents = [Content('a'), Content('b'), Content('c'), Content('d')]
+        contents[2].feincms_process_concurrently = False
+
+        main_thread = threading.current_thread()
+        view = ContentView()
+        view.request = RequestFactory().get('/')
+        view.request._feincms_extra_context = {'extra_path': '/'}
+
+        old = feincms_settings.FEINCMS_PROCESS_CONCURRENCY
+        try:
+            feincms_settings.FEINCMS_PROCESS_CONCURRENCY = 4
+            results = list(view._process_contents(contents))
+        finally:
+            feincms_settings.FEINCMS_PROCESS_CONCURRENCY = old
+
+        # Only consecutive flagged content blocks are processed concurrently,
+        # the changes to the extra context are merged in order.
+        self.assertEqual(
+            results, [('a', None), ('b', None), ('c', None), ('d', None)])
+        self.assertEqual(view.request._feincms_extra_context, {
+            'extra_path': '/', 'a': False, 'b': False, 'c': True, 'd': True,
+            'last': 'd'})
+
+    @skipIf(
+        concurrency.ThreadPoolExecutor is None,
+        'concurrent.futures is not available')
+    def test_collect_worker_queries(self):
+        def query(value):
+            cursor = connection.cursor()
+            cursor.execute('SELECT %s' % value)
+            return cursor.fetchone()[0]
+
+        queries = []
+        concurrency.collect_queries(queries)
+        try:
+            results = concurrency.run_concurrently(
+                [(query, (1,), {}), (query, (2,), {})], 2)
+        finally:
+            concurrency.collect_queries(None)
+
+        self.assertEqual([result for result, exc_info in results], [1, 2])
+        queries = sorted(q['sql'] for q in queries)
+        self.assertEqual(len(queries), 2)
+        self.assertTrue('SELECT 1' in queries[0])
+        self.assertTrue('SELECT 2' in queries[1])
+
+    @skipIf(
+        concurrency.ThreadPoolExecutor is None,
+        'concurrent.futures is not available')
+    def test_named_executors(self):
+        # Background work does not share the pools used while rendering
+        executor = concurrency.get_executor(2)
+        self.assertTrue(executor is concurrency.get_executor(2))
+        self.assertFalse(
+            executor is concurrency.get_executor(2, name='thumbnails'))
+
+
+class ThumbnailStorage(FileSystemStorage):
+    # Can be instantiated without arguments by thumbnail queue workers
+    location = None
+
+    def __init__(self):
+        super(ThumbnailStorage, self).__init__(
+            location=ThumbnailStorage.location, base_url='/media/')
+
+
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.location = ThumbnailStorage.location = tempfile.mkdtemp()
+        self.image = Empty()
+        self.image.storage = ThumbnailStorage()
+        self.image.name = 'image.png'
+
+        buf = BytesIO()
+        Image.new('RGB', (100, 50)).save(buf, 'png')
+        self.image.storage.save(self.image.name, ContentFile(buf.getvalue()))
+        cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_registry(self):
+        miniature = '_thumbs/image_thumb_20x20.png'
+        storage = self.image.storage
+
+        self.assertEqual(
+            '%s' % thumbnail(self.image, '20x20'), '/media/%s' % miniature)
+        self.assertTrue(thumbnails.is_registered(self.image.name, miniature))
+
+        # Registered thumbnails are not checked in the storage again
+        storage.delete(miniature)
+        self.assertEqual(
+            '%s' % thumbnail(self.image, '20x20'), '/media/%s' % miniature)
+        self.assertFalse(storage.exists(miniature))
+
+        thumbnails.forget(self.image.name)
+        self.assertFalse(
+            thumbnails.is_registered(self.image.name, miniature))
+        '%s' % thumbnail(self.image, '20x20')
+        self.assertTrue(storage.exists(miniature))
+
+        # Local originals replaced without forgetting them outdate their
+        # thumbnails nevertheless
+        self.assertTrue(
+            thumbnails.is_registered(self.image.name, miniature, storage))
+        buf = BytesIO()
+        Image.new('RGB', (80, 60)).save(buf, 'png')
+        storage.delete(self.image.name)
+        storage.save(self.image.name, ContentFile(buf.getvalue()))
+        self.assertFalse(
+            thumbnails.is_registered(self.image.name, miniature, storage))
+
+        # Forgetting an original invalidates all of its thumbnails, no
+        # matter in which order they have been registered
+        thumbnails.register('a.png', 'a1.png')
+        thumbnails.register('a.png', 'a2.png', 'value')
+        self.assertEqual(thumbnails.lookup('a.png', 'a2.png'), 'value')
+        thumbnails.forget('a.png')
+        thumbnails.register('a.png', 'a1.png')
+        self.assertEqual(thumbnails.registered([
+            ('a.png', 'a1.png'), ('a.png', 'a2.png'), ('b.png', 'b1.png'),
+        ]), set(['a1.png']))
+
+    def test_generate_streaming(self):
+        class RemoteStorage(object):
+            # Storage without local paths
+            def __init__(self, storage):
+                self.storage = storage
+
+            def __getattr__(self, name):
+                if name == 'path':
+                    raise AttributeError(name)
+                return getattr(self.storage, name)
+
+        image = Empty()
+        buf = BytesIO()
+        Image.new('RGB', (1600, 400)).save(buf, 'jpeg')
+        image.name = self.image.storage.save('image.jpg', ContentFile(
+            buf.getvalue()))
+
+        for storage in (
+                self.image.storage, RemoteStorage(self.image.storage)):
+            image.storage = storage
+            url = '%s' % cropscale(image, '40x20')
+            self.assertEqual(url, '/media/_thumbs/image_cropscale_40x20.jpg')
+            with storage.open('_thumbs/image_cropscale_40x20.jpg') as f:
+                self.assertEqual(Image.open(f).size, (40, 20))
+            storage.delete('_thumbs/image_cropscale_40x20.jpg')
+            thumbnails.forget('image.jpg')
+
+    def test_batch(self):
+        storage = self.image.storage
+        names = ['image.png', 'other.png', 'third.png']
+        with storage.open('image.png') as f:
+            data = f.read()
+        for name in names[1:]:
+            storage.save(name, ContentFile(data))
+
+        files = []
+        for name in names:
+            files.append(Empty())
+            files[-1].storage, files[-1].name = storage, name
+        files.append(None)
+
+        # Registered, existing and missing thumbnails
+        '%s' % thumbnail(files[0], '20x20')
+        '%s' % thumbnail(files[1], '20x20')
+        thumbnails.forget('other.png')
+
+        self.assertEqual(get_thumbnail_urls(files, '20x20'), [
+            '/media/_thumbs/image_thumb_20x20.png',
+            '/media/_thumbs/other_thumb_20x20.png',
+            '/media/_thumbs/third_thumb_20x20.png',
+            '',
+        ])
+        self.assertTrue(storage.exists('_thumbs/third_thumb_20x20.png'))
+        self.assertEqual(thumbnails.registered([
+            (name, '_thumbs/%s_thumb_20x20.png' % name[:-4])
+            for name in names]), set([
+                '_thumbs/image_thumb_20x20.png',
+                '_thumbs/other_thumb_20x20.png',
+                '_thumbs/third_thumb_20x20.png',
+            ]))
+
+        thumbs = batch_thumbnails(files[:1], '20x10', 'cropscale')
+        self.assertEqual(thumbs, [
+            (files[0], '/media/_thumbs/image_cropscale_20x10.png')])
+
+    def test_srcset(self):
+        storage = self.image.storage
+        srcset = thumbnail_srcset(self.image, '40x40,20x20,200x200')
+        self.assertEqual(srcset, ', '.join([
+            '/media/_thumbs/image_thumb_40x40.png 40w',
+            '/media/_thumbs/image_thumb_20x20.png 20w',
+            '/media/_thumbs/image_thumb_200x200.png 100w',
+        ]))
+        for box, size in (
+                ('40x40', (40, 20)), ('20x20', (20, 10)),
+                ('200x200', (100, 50))):
+            with storage.open('_thumbs/image_thumb_%s.png' % box) as f:
+                self.assertEqual(Image.open(f).size, size)
+
+        # The srcset is remembered as a whole
+        storage.delete('_thumbs/image_thumb_20x20.png')
+        self.assertEqual(
+            thumbnail_srcset(self.image, '40x40,20x20,200x200'), srcset)
+
+        thumbnails.forget(self.image.name)
+        self.assertEqual(
+            cropscale_srcset(self.image, '20x20,40x40'), ', '.join([
+                '/media/_thumbs/image_cropscale_20x20.png 20w',
+                '/media/_thumbs/image_cropscale_40x40.png 40w',
+            ]))
+        with storage.open('_thumbs/image_cropscale_20x20.png') as f:
+            self.assertEqual(Image.open(f).size, (20, 20))
+
+    def test_queue(self):
+        miniature = '_thumbs/image_thumb_20x20.png'
+        storage = self.image.storage
+
+        old = feincms_settings.FEINCMS_THUMBNAIL_QUEUE
+        try:
+            feincms_settings.FEINCMS_THUMBNAIL_QUEUE = os.path.join(
+                self.location, 'queue')
+
+            # The original is used until the queue has been processed, jobs
+            # are only queued once.
+            for i in range(2):
+                self.assertEqual(
+                    '%s' % thumbnail(self.image, '20x20'), '/media/image.png')
+            self.assertEqual(len(thumbnails.queued_jobs()), 1)
+            self.assertFalse(storage.exists(miniature))
+
+            # Jobs being processed are not queued again
+            job = thumbnails.queued_jobs()[0]
+            os.rename(job, '%s.123.working' % job)
+            '%s' % thumbnail(self.image, '20x20')
+            self.assertEqual(thumbnails.queued_jobs(), [])
+            os.rename('%s.123.working' % job, job)
+
+            call_command('generate_thumbnails', stdout=StringIO())
+            self.assertEqual(thumbnails.queued_jobs(), [])
+            self.assertTrue(storage.exists(miniature))
+            self.assertEqual(
+                '%s' % thumbnail(self.image, '20x20'), '/media/%s' % miniature)
+
+            # Failed jobs are kept
+            storage.delete(self.image.name)
+            thumbnails.forget(self.image.name)
+            '%s' % thumbnail(self.image, '30x30')
+            job = thumbnails.queued_jobs()[0]
+            call_command('generate_thumbnails', stdout=StringIO())
+            self.assertEqual(thumbnails.queued_jobs(), [])
+            self.assertTrue(os.path.exists('%s.failed' % job))
+        finally:
+            feincms_settings.FEINCMS_THUMBNAIL_QUEUE = old
+
+    def test_presets(self):
+        old = feincms_settings.FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS
+        workers = feincms_settings.FEINCMS_THUMBNAIL_WORKERS
+        try:
+            feincms_settings.FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS = {
+                'small': {'size': '20x20'},
+                'square': {'size': '30x30', 'mode': 'cropscale'},
+            }
+            mediafile = MediaFile(file=File(self.image.storage.open(
+                self.image.name), name='preset.png'))
+            mediafile.save()
+
+            storage = mediafile.file.storage
+            basename = mediafile.file.name[:-4]
+            miniatures = [
+                '_thumbs/%s_thumb_20x20.png' % basename,
+                '_thumbs/%s_cropscale_30x30.png' % basename,
+            ]
+            try:
+                generate_presets_later(mediafile).result()
+                for miniature in miniatures:
+                    self.assertTrue(storage.exists(miniature))
+
+                self.assertEqual(
+                    '%s' % thumbnail_preset(mediafile.file, 'square'),
+                    storage.url(miniatures[1]))
+
+                # Presets are only generated again if the file changed
+                storage.delete(miniatures[0])
+                feincms_settings.FEINCMS_THUMBNAIL_WORKERS = 0
+                mediafile.copyright = 'me'
+                mediafile.save()
+                self.assertFalse(storage.exists(miniatures[0]))
+
+                # Without threads, presets are generated synchronously
+                thumbnails.forget(mediafile.file.name)
+                self.assertTrue(generate_presets_later(mediafile).done())
+                self.assertTrue(storage.exists(miniatures[0]))
+
+                storage.delete(miniatures[0])
+                call_command(
+                    'generate_thumbnails', presets=True, stdout=StringIO())
+                self.assertTrue(storage.exists(miniatures[0]))
+            finally:
+                mediafile.delete_mediafile()
+                for miniature in miniatures:
+                    storage.delete(miniature)
+        finally:
+            feincms_settings.FEINCMS_MEDIALIBRARY_THUMBNAIL_PRESETS = old
+            feincms_settings.FEINCMS_THUMBNAIL_WORKERS = workers
+
+    def test_formats(self):
+        storage = self.image.storage
+
+        url = Thumbnailer(self.image, '20x20', format='jpeg').get_url()
+        self.assertRegexpMatches(
+            url, r'^/media/_thumbs/image_thumb_20x20-[0-9a-f]{8}\.jpg$')
+        with storage.open(url[len('/media/'):]) as handle:
+            image = Image.open(handle)
+            self.assertEqual(image.format, 'JPEG')
+            self.assertTrue(image.info.get('progressive'))
+
+        # Other encoder options lead to other thumbnails
+        url = Thumbnailer(
+            self.image, '20x20', format='png', options={'colors': 16},
+        ).get_url()
+        self.assertNotEqual(
+            url, Thumbnailer(self.image, '20x20', format='png').get_url())
+        with storage.open(url[len('/media/'):]) as handle:
+            self.assertEqual(Image.open(handle).mode, 'P')
+
+        # Names do not depend on the Python version
+        self.assertEqual(
+            Thumbnailer(self.image, '20x20', format='png').get_url(),
+            '/media/_thumbs/image_thumb_20x20-fb73e982.png')
+
+    def test_picture(self):
+        html = thumbnail_picture(
+            self.image, '20x20,40x40', 'avif,png,jpeg', alt='"Image"',
+            sizes='50vw')
+        self.assertTrue(html.startswith('<picture><source type="image/png"'))
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn('alt="&quot;Image&quot;"></picture>', html)
+        self.assertEqual(html.count('<source'), 1 + format_supported('avif'))
+        self.assertEqual(html.count('.jpg'), 3)
+
+        html = thumbnail_picture(self.image, '20x20', 'png')
+        self.assertRegexpMatches(
+            html, r'^<picture><img src="/media/_thumbs/image_thumb_20x20-'
+            r'[0-9a-f]{8}\.png" alt=""></picture>$')
+
+
+class MediaLibraryImportTest(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.path = os.path.join(self.location, 'import.zip')
+
+        with zipfile.ZipFile(self.path, 'w') as zip_file:
+            zip_file.comment = json.dumps({
+                'export_magic': 'feincms-export-01',
+                'categories': [
+                    {'id': 5, 'title': 'Sub', 'slug': 'sub', 'parent': 4,
+                     'level': 2},
+                    {'id': 4, 'title': 'Root', 'slug': 'root', 'parent': 0,
+                     'level': 1},
+                ],
+            }).encode('utf-8')
+            for i in range(5):
+                info = zipfile.ZipInfo('import/file_%d.TXT' % i)
+                info.comment = json.dumps({
+                    'copyright': 'me',
+                    'categories': [5],
+                    'translations': [
+                        {'lang': 'en', 'caption': 'File %d' % i},
+                        {'lang': 'de', 'caption': 'Datei %d' % i},
+                    ],
+                }).encode('utf-8')
+                zip_file.writestr(info, 'content %d' % i)
+            zip_file.writestr('.hidden.txt', 'hidden')
+
+    def tearDown(self):
+        for mediafile in MediaFile.objects.all():
+            mediafile.delete_mediafile()
+        shutil.rmtree(self.location)
+
+    def test_import(self):
+        category = Category.objects.create(title='Uploads', slug='uploads')
+        stdout = StringIO()
+        call_command(
+            'import_mediafiles', self.path, category=category.pk,
+            batch_size=2, stdout=stdout)
+        self.assertIn('Imported 4 of 5 files.', stdout.getvalue())
+        self.assertIn('Imported 5 files.', stdout.getvalue())
+
+        sub = Category.objects.get(slug='sub')
+        self.assertEqual(sub.parent.slug, 'root')
+        self.assertEqual(MediaFile.objects.count(), 5)
+
+        mediafile = MediaFile.objects.get(file__endswith='file_3.txt')
+        self.assertEqual(mediafile.type, 'txt')
+        self.assertEqual(mediafile.copyright, 'me')
+        self.assertEqual(mediafile.file_size, 9)
+        self.assertEqual(mediafile.file.read(), b'content 3')
+        mediafile.file.close()
+        self.assertEqual(
+            set(mediafile.categories.all()), set([category, sub]))
+        self.assertEqual(
+            dict(mediafile.translations.values_list(
+                'language_code', 'caption')),
+            {'en': 'File 3', 'de': 'Datei 3'})
+
+        # Importing again reuses the categories; overwriting replaces the
+        # files in the directories of the archive and their translations
+        for i in range(2):
+            call_command(
+                'import_mediafiles', self.path, overwrite=True, verbosity=0,
+                stdout=StringIO())
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(MediaFile.objects.count(), 10)
+        mediafile = MediaFile.objects.get(file='import/file_3.txt')
+        self.assertEqual(mediafile.translations.count(), 2)
+        self.assertEqual(mediafile.categories.get(), sub)
+
+    def test_import_existing_names(self):
+        # A media file whose file went missing; its name is reused
+        field = MediaFile._meta.get_field('file')
+        name = field.generate_filename(MediaFile(), 'file_0.txt')
+        stale = MediaFile.objects.create(file=name)
+        stale.translations.create(caption='Stale')
+
+        self.assertEqual(import_zipfile(None, False, self.path), 5)
+        self.assertEqual(
+            list(stale.translations.values_list('caption', flat=True)),
+            ['Stale'])
+        mediafile = MediaFile.objects.exclude(pk=stale.pk).get(file=name)
+        self.assertEqual(mediafile.translations.count(), 2)
+
+    def test_import_failure(self):
+        def fail(self, name):
+            raise ValueError(name)
+
+        storage = MediaFile._meta.get_field('file').storage
+        determine_file_type = MediaFile.determine_file_type
+        MediaFile.determine_file_type = fail
+        try:
+            self.assertRaises(
+                ValueError, import_zipfile, None, True, self.path)
+        finally:
+            MediaFile.determine_file_type = determine_file_type
+
+        # The files written before the failure have been removed again
+        self.assertFalse(MediaFile.objects.exists())
+        for i in range(5):
+            self.assertFalse(storage.exists('import/file_%d.txt' % i))
+
+    def test_export(self):
+        call_command(
+            'import_mediafiles', self.path, overwrite=True, verbosity=0,
+            stdout=StringIO())
+
+        data = b''.join(stream_zipfile(MediaFile.objects.all()))
+        zip_file = zipfile.ZipFile(BytesIO(data))
+        self.assertEqual(
+            sorted(zip_file.namelist()),
+            ['import/file_%d.txt' % i for i in range(5)])
+        self.assertEqual(zip_file.read('import/file_2.txt'), b'content 2')
+
+        info = json.loads(zip_file.comment.decode('utf-8'))
+        self.assertEqual(
+            [(cat['slug'], cat['level']) for cat in info['categories']],
+            [('root', 1), ('sub', 2)])
+        info = json.loads(
+            zip_file.getinfo('import/file_2.txt').comment.decode('utf-8'))
+        self.assertEqual(info['copyright'], 'me')
+        self.assertEqual(
+            sorted(tr['caption'] for tr in info['translations']),
+            ['Datei 2', 'File 2'])
+
+        # Exports can be imported again
+        self.assertEqual(import_zipfile(None, False, BytesIO(data)), 5)
+        self.assertEqual(MediaFile.objects.count(), 10)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(
+            MediaFile.objects.exclude(file__startswith='import/').filter(
+                translations__caption='File 2',
+                categories__parent__slug='root').count(),
+            1)
+
+
+class MediaLibraryOrphansTest(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.field = MediaFile._meta.get_field('file')
+        self.old_storage = self.field.storage
+        self.field.storage = storage = FileSystemStorage(self.location)
+
+        for name in (
+                'medialibrary/2015/01/a.jpg',
+                'medialibrary/2015/01/b.jpg',
+                'medialibrary/x/c.txt',
+                'other/d.txt',
+                '_thumbs/medialibrary/2015/01/a_thumb_20x20.jpg',
+                '_thumbs/medialibrary/2015/01/b_cropscale_9x9-0123abcd.png',
+                '_thumbs/medialibrary/gone_thumb_20x20.jpg',
+                '_thumbs/readme.txt'):
+            storage.save(name, ContentFile(b'data'))
+
+        MediaFile.objects.bulk_create([
+            MediaFile(file=name) for name in (
+                'medialibrary/2015/01/a.jpg',
+                'medialibrary/gone.jpg',
+                'other/d.txt',
+                'other/e.txt')])
+
+    def tearDown(self):
+        self.field.storage = self.old_storage
+        shutil.rmtree(self.location)
+
+    def test_orphans(self):
+        stdout = StringIO()
+        call_command('medialibrary_orphans', stdout=stdout)
+        self.assertEqual(stdout.getvalue().split(), [
+            'medialibrary/2015/01/b.jpg',
+            'medialibrary/x/c.txt'])
+
+        stdout = StringIO()
+        call_command('medialibrary_orphans', missing=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue().split(), [
+            'medialibrary/gone.jpg',
+            'other/e.txt'])
+
+        registered = [
+            ('medialibrary/2015/01/b.jpg', '_thumbs/b_thumb_20x20.jpg'),
+            ('medialibrary/gone.jpg',
+             '_thumbs/medialibrary/gone_thumb_20x20.jpg'),
+        ]
+        for original, miniature in registered:
+            thumbnails.register(original, miniature)
+        self.assertEqual(len(thumbnails.registered(registered)), 2)
+
+        stdout = StringIO()
+        call_command(
+            'medialibrary_orphans', thumbnails=True, delete=True, workers=2,
+            stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'medialibrary/2015/01/b.jpg',
+            'medialibrary/x/c.txt',
+            '_thumbs/medialibrary/2015/01/b_cropscale_9x9-0123abcd.png',
+            '_thumbs/medialibrary/gone_thumb_20x20.jpg',
+            'Deleted 4 orphaned files.'])
+
+        storage = self.field.storage
+        self.assertFalse(storage.exists('medialibrary/x/c.txt'))
+        self.assertTrue(storage.exists('medialibrary/2015/01/a.jpg'))
+        self.assertTrue(storage.exists(
+            '_thumbs/medialibrary/2015/01/a_thumb_20x20.jpg'))
+        self.assertEqual(thumbnails.registered(registered), set())
+
+    def test_orphans_unknown_root(self):
+        upload_to = self.field.upload_to
+        self.field.upload_to = '%Y/%m/'
+        try:
+            # Files of other apps in the same storage are never deleted
+            # without passing the upload directory explicitly
+            self.assertRaises(
+                CommandError, call_command, 'medialibrary_orphans',
+                delete=True, stdout=StringIO())
+            self.assertTrue(self.field.storage.exists('other/d.txt'))
+
+            stdout = StringIO()
+            call_command(
+                'medialibrary_orphans', delete=True, root='medialibrary',
+                stdout=stdout)
+            self.assertIn('Deleted 2 orphaned files.', stdout.getvalue())
+            self.assertTrue(self.field.storage.exists('other/d.txt'))
+        finally:
+            self.field.upload_to = upload_to
+
 
 class BlogTestCase(TestCase):
     def setUp(self):